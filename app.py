@@ -1,22 +1,43 @@
-import json
+import multiprocessing
 import os
-import re
 import time
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from itertools import chain
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, make_response, render_template
 from flask_cors import CORS
 
 import requests
-from bs4 import BeautifulSoup
+
+from hedge import Hedger, LatencyTracker
+from logs import LOG_SAMPLE_RATE, get_logger
+from jobs import JobRunner, job_payload
+from http_cache import (cache_headers, choose_encoding, compress_body, content_etag, http_date, is_not_modified,
+                        make_etag, should_compress)
+from metrics import (CACHE_LOOKUPS, CIRCUIT_OPEN, CONTENT_TYPE as METRICS_CONTENT_TYPE, SCRAPE_SECONDS,
+                     SCRAPES_IN_FLIGHT, THROTTLE_DELAY, render_metrics)
+from pagination import iter_pages
+from parsers import parse_page
+from scheduler import RefreshScheduler
+from singleflight import SingleFlight
+from records import RecordColumns, parse_date, parse_number
+from stats import WEEK_LABELS, rollup_stats
+from storage import DEFAULT_DATABASE_FILE, ElectricityStore
+from streaming import FORMATS, STREAM_BATCH_SIZE, PageRelay, encode_frames, stream_format
+from throttle import UpstreamUnavailable, upstream_throttle
+from topology_cache import (StaleRoomForm, TopologyCache, buildings_key, find_value, floors_key, room_form_key,
+                            rooms_key)
+from upstream_pool import PooledSession, pool_stats, record_upstream
+from watchlist import WATCHLIST_USAGE_DAYS, BalanceRefresher, load_watchlist
 
 # --- 全局配置 ---
-BASE_URL = "https://fee.vip.cpolar.cn"
+# 可指向本地模拟器 (simulator.py)，离线开发和基准测试时不访问线上站点
+BASE_URL = os.environ.get('UPSTREAM_BASE_URL', "https://fee.vip.cpolar.cn")
 LOGIN_URL = f"{BASE_URL}/default.aspx"
 RESULTS_URL = f"{BASE_URL}/usedRecord.aspx"
 # 获取当前文件 (app.py) 所在的目录的绝对路径
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-# 将 JSON 文件名与基础目录拼接成一个绝对路径
+# 旧版单房间 JSON 缓存 (启动时导入数据库)
 JSON_DATABASE_FILE = os.path.join(BASE_DIR, "electricity_data_single_room.json")
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
@@ -28,200 +49,401 @@ HEADERS = {
     'Upgrade-Insecure-Requests': '1',
     'Referer': BASE_URL,
 }
-REQUEST_DELAY = 0.1
+# 楼栋/楼层/房间拓扑缓存 (保存在数据库中，默认 7 天过期，过期后先返回旧数据并在后台刷新)；
+# TOPOLOGY_CACHE_FILE 为旧版 JSON 缓存文件，数据库中还没有拓扑时导入
+TOPOLOGY_CACHE_FILE = os.environ.get('TOPOLOGY_CACHE_FILE', os.path.join(BASE_DIR, "topology_cache.json"))
+TOPOLOGY_CACHE_TTL = int(os.environ.get('TOPOLOGY_CACHE_TTL', 7 * 24 * 3600))
+# 拓扑节点在进程内存中的保留时间；其他 worker 的失效最多延迟这么久可见
+TOPOLOGY_MEMO_TTL = float(os.environ.get('TOPOLOGY_MEMO_TTL', 5))
+# 增量抓取：已有历史时只向上游请求最新记录之后的日期 (设为 0 关闭)
+INCREMENTAL_SCRAPE = os.environ.get('INCREMENTAL_SCRAPE', '1') != '0'
+# 同一房间 + 日期范围的并发爬取合并为一次，跨 worker 的数据库锁超过该秒数自动失效
+SINGLEFLIGHT_LOCK_TTL = int(os.environ.get('SINGLEFLIGHT_LOCK_TTL', 300))
+# 缓存有效期；过期后查询立即返回旧数据 (stale: true) 并异步刷新
+CACHE_MAX_AGE = int(os.environ.get('CACHE_MAX_AGE', 3600))
+# 后台刷新：最近 REFRESH_ACTIVE_WINDOW 秒内被查询过的房间会在过期前自动刷新
+# PARSE_MODE=process 的解析进程以 spawn 启动，会把入口模块作为 __mp_main__ 重新执行 (python app.py 时即本模块)；
+# 后台调度不在 multiprocessing 子进程中启动 (子进程重新执行入口模块时 parent_process() 尚未设置，只能按进程名判断；
+# gunicorn 的 worker 由 os.fork 创建，进程名仍为 MainProcess，不受影响)
+SCHEDULER_ENABLED = (os.environ.get('SCHEDULER_ENABLED', '1') != '0'
+                     and multiprocessing.current_process().name == 'MainProcess')
+REFRESH_ACTIVE_WINDOW = int(os.environ.get('REFRESH_ACTIVE_WINDOW', 7 * 24 * 3600))
+REFRESH_CONCURRENCY = int(os.environ.get('REFRESH_CONCURRENCY', 2))
+REFRESH_TICK = int(os.environ.get('REFRESH_TICK', 60))
+# 后台刷新失败后按 REFRESH_RETRY_BASE * 2^(连续失败次数-1) 秒退避，最长 REFRESH_RETRY_MAX 秒
+REFRESH_RETRY_BASE = int(os.environ.get('REFRESH_RETRY_BASE', 60))
+REFRESH_RETRY_MAX = int(os.environ.get('REFRESH_RETRY_MAX', 3600))
+# 低余额监控的批量余额刷新 (watchlist.py)，与后台刷新一样只在 SCHEDULER_ENABLED 的进程中运行
+WATCHLIST_ENABLED = os.environ.get('WATCHLIST_ENABLED', '1') != '0'
+# 客户端可为房间设置刷新间隔 (秒)，不允许低于该值
+MIN_REFRESH_INTERVAL = int(os.environ.get('MIN_REFRESH_INTERVAL', 300))
+# 上游请求分阶段超时 (秒)：options 为首页和楼栋/楼层回发，select 为选择房间，query 为查询结果首页，page 为每个分页
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 5))
+UPSTREAM_TIMEOUTS = {
+    'options': float(os.environ.get('TIMEOUT_OPTIONS', 15)),
+    'select': float(os.environ.get('TIMEOUT_SELECT', 20)),
+    'query': float(os.environ.get('TIMEOUT_QUERY', 30)),
+    'page': float(os.environ.get('TIMEOUT_PAGE', 15)),
+}
+# 回发阶段 (指标 stage 标签) -> 超时阶段：login 为 GET 首页，building / floor 为选择楼栋、楼层的回发，room 为选择房间
+UPSTREAM_STAGES = {
+    'login': 'options',
+    'building': 'options',
+    'floor': 'options',
+    'room': 'select',
+    'query': 'query',
+    'page': 'page',
+}
+# 对冲请求：幂等 GET 超过该阶段 p95 延迟仍未返回时再发一份，取先返回者 (设为 1 开启)
+HEDGE_REQUESTS = os.environ.get('HEDGE_REQUESTS', '0') == '1'
+
+log = get_logger('app')
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'dev'
 CORS(app)
 
-def get_hidden_inputs(soup):
-    form_data = {}
-    for input_tag in soup.find_all('input', {'type': 'hidden'}):
-        name = input_tag.get('name')
-        value = input_tag.get('value', '')
-        if name:
-            form_data[name] = value
-    return form_data
-
-def parse_options_for_api(select_tag):
-    if not select_tag:
-        return []
-    options = []
-    for option in select_tag.find_all('option')[1:]:
-        value = option.get('value')
-        text = option.text.strip()
-        if value and text:
-            options.append({"text": text, "value": value})
-    return options
-
-def _parse_records_from_soup(soup):
-    records = []
-    rows = soup.select('table.dataTable tr.contentLine')
-    for row in rows:
-        cols = [td.text.strip() for td in row.find_all('td')]
-        if len(cols) == 4:
-            records.append({
-                "date": cols[0],
-                "meter_name": cols[1],
-                "usage": cols[2],
-                "price": cols[3]
-            })
-    return records
-
-def scrape_room_data(session, building_value, floor_value, room_value, form_data, start_date, end_date):
-    print(f"Scrape params: building_value={building_value}, floor_value={floor_value}, room_value={room_value}, dates={start_date} to {end_date}")  # 添加日志：参数
+store = ElectricityStore(DEFAULT_DATABASE_FILE)
+topology_cache = TopologyCache(store, TOPOLOGY_CACHE_TTL, TOPOLOGY_CACHE_FILE, TOPOLOGY_MEMO_TTL)
+if store.import_legacy_json(JSON_DATABASE_FILE):
+    log.info('legacy_json.imported', path=JSON_DATABASE_FILE)
+scrape_flight = SingleFlight(store, SINGLEFLIGHT_LOCK_TTL)
+
+def stage_timeout(stage):
+    return (UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_TIMEOUTS[stage])
+
+def clone_session(session):
+    # 对冲请求使用的兄弟会话：请求头和 cookie 相同，cookie jar 独立
+    sibling = PooledSession(session.headers)
+    sibling.cookies.update(session.cookies)
+    return sibling
+
+hedger = Hedger(LatencyTracker(), clone_session)
+
+def upstream_request(session, method, url, stage, **kwargs):
+    """
+    stage 为 UPSTREAM_STAGES 中的回发阶段：按阶段设置超时，并记录耗时和结果 (metrics.py)。
+    幂等 GET 在开启 HEDGE_REQUESTS 时走对冲请求。
+    """
+    kwargs.setdefault('timeout', stage_timeout(UPSTREAM_STAGES[stage]))
+    started = time.perf_counter()
+    try:
+        if method == 'GET' and HEDGE_REQUESTS:
+            response = hedger.get(session, url, stage, **kwargs)
+        else:
+            response = session.request(method, url, **kwargs)
+    except Exception as e:
+        record_upstream(stage, started, error=e)
+        raise
+    record_upstream(stage, started, response)
+    return response
+
+def upstream_get(session, url, stage, **kwargs):
+    return upstream_request(session, 'GET', url, stage, **kwargs)
+
+def upstream_post(session, url, stage, **kwargs):
+    return upstream_request(session, 'POST', url, stage, **kwargs)
+
+def select_room(session, building_value, floor_value, room_value, form_data):
+    """用选择楼层后页面的表单选择房间，返回跳转后的结果页响应 (最近几天的记录首页，含剩余电量)。"""
+    payload_select_room = {
+        **form_data,
+        'drlouming': building_value,
+        'drceng': floor_value,
+        'drfangjian': room_value,
+        'radio': 'usedR',
+        'ImageButton1.x': '30',
+        'ImageButton1.y': '10'
+    }
+    payload_select_room.pop('__EVENTTARGET', None)
+
+    response = upstream_post(session, LOGIN_URL, 'room', data=payload_select_room, headers={'Referer': LOGIN_URL})
+    response.raise_for_status()
+    return response
+
+def scrape_room_data(session, building_value, floor_value, room_value, form_data, segments, on_page=None,
+                     on_progress=None, keep_records=True):
+    """
+    选择房间后依次查询 segments 中的每个日期段 [(start_date, end_date), ...]，返回 (RecordColumns, 剩余电量)。
+    同一会话中后一个日期段直接在上一次的结果页上回发查询，不需要重新选择房间。
+    on_page(剩余电量, 该页 RecordColumns) 在每一页解析完成时按页码顺序调用 (供流式响应边爬边发)；
+    on_progress(已完成页数, 已知总页数, 已解析记录数) 同时调用 (供异步任务报告进度)，
+    总页数在每个日期段的结果首页返回后累加。
+    keep_records=False 时不在内存中累积记录 (由 on_page 逐页保存)，返回的 RecordColumns 为空。
+    """
+    log.debug('scrape.params', building_value=building_value, floor_value=floor_value, room_value=room_value,
+              segments=segments)
     try:
-        payload_select_room = {
-            **form_data,
-            'drlouming': building_value,
-            'drceng': floor_value,
-            'drfangjian': room_value,
-            'radio': 'usedR',
-            'ImageButton1.x': '30',
-            'ImageButton1.y': '10'
-        }
-        payload_select_room.pop('__EVENTTARGET', None)
-
-        print("Posting to select room...")  # 添加日志
-        time.sleep(REQUEST_DELAY)
-        res_after_select = session.post(LOGIN_URL, data=payload_select_room, headers={'Referer': LOGIN_URL})
-        print(f"Select room response status: {res_after_select.status_code}")  # 添加日志：状态
-        res_after_select.raise_for_status()
-
-        soup_results_page = BeautifulSoup(res_after_select.text, 'html.parser')
-        results_page_form_data = get_hidden_inputs(soup_results_page)
-
-        final_payload = {
-            **results_page_form_data,
-            'txtstart': start_date,
-            'txtend': end_date,
-            'btnser': '查询'
-        }
-
-        print("Posting query to results...")  # 添加日志
-        time.sleep(REQUEST_DELAY)
-        final_response = session.post(RESULTS_URL, data=final_payload, headers={'Referer': RESULTS_URL})
-        print(f"Results response status: {final_response.status_code}")  # 添加日志：状态
-        final_response.raise_for_status()
-
-        final_soup = BeautifulSoup(final_response.text, 'html.parser')
-
-        # 解析剩余电量
+        try:
+            res_after_select = select_room(session, building_value, floor_value, room_value, form_data)
+        except requests.exceptions.HTTPError as e:
+            raise StaleRoomForm(str(e)) from e
+        results_page = parse_page(res_after_select.text)
+        if results_page.has_select('drfangjian'):
+            # 仍停留在首页：表单已失效或房间不存在
+            raise StaleRoomForm("选择房间后未进入查询结果页")
+
+        results_page_form_data = results_page.hidden_inputs()
+
+        def fetch_page(page_num, page_session):
+            next_page_url = f"{RESULTS_URL}?p={page_num}"
+            res_page = upstream_get(page_session, next_page_url, 'page', headers={'Referer': RESULTS_URL})
+            log.debug('scrape.page', sample=LOG_SAMPLE_RATE, page=page_num, status=res_page.status_code)
+            res_page.raise_for_status()
+            return parse_page(res_page.text)
+
+        def fetch_page_concurrent(page_num):
+            sibling = clone_session(session)
+            try:
+                return fetch_page(page_num, sibling)
+            finally:
+                sibling.close()
+
+        all_records = RecordColumns()
         total_remaining = None
-        h6_tag = final_soup.find('h6')
-        if h6_tag:
-            spans = h6_tag.find_all('span', class_='number orange')
-            if len(spans) == 3:
-                total_remaining = spans[2].text.strip()
-        print(f"Parsed remaining: {total_remaining}")  # 添加日志：剩余电量
-
-        all_records = _parse_records_from_soup(final_soup)
-
-        # 处理分页
-        total_pages = 1
-        pageer_div = final_soup.find('div', class_='pageer')
-        if pageer_div:
-            match = re.search(r'共\s*(\d+)\s*页', pageer_div.text)
-            if match:
-                total_pages = int(match.group(1))
-
-        print(f"Total pages: {total_pages}")  # 添加日志：分页
-
-        if total_pages > 1:
-            for page_num in range(2, total_pages + 1):
-                time.sleep(REQUEST_DELAY)
-                next_page_url = f"{RESULTS_URL}?p={page_num}"
-                print(f"Fetching page {page_num}...")  # 添加日志
-                res_page = session.get(next_page_url, headers={'Referer': RESULTS_URL})
-                print(f"Page {page_num} status: {res_page.status_code}")  # 添加日志
-                res_page.raise_for_status()
-                soup_page = BeautifulSoup(res_page.text, 'html.parser')
-                records_from_page = _parse_records_from_soup(soup_page)
-                all_records.extend(records_from_page)
-
-        print(f"Total records scraped: {len(all_records)}")  # 添加日志：总记录
+        pages_done = pages_total = record_count = 0
+        for start_date, end_date in segments:
+            final_payload = {
+                **results_page_form_data,
+                'txtstart': start_date,
+                'txtend': end_date,
+                'btnser': '查询'
+            }
+
+            final_response = upstream_post(session, RESULTS_URL, 'query', data=final_payload,
+                                           headers={'Referer': RESULTS_URL})
+            final_response.raise_for_status()
+
+            final_page = parse_page(final_response.text)
+            results_page_form_data = final_page.hidden_inputs()
+
+            # 解析剩余电量
+            page_remaining = parse_number(final_page.remaining())
+            if page_remaining is not None:
+                total_remaining = page_remaining
+            pages_total += final_page.total_pages()
+            log.debug('scrape.segment', start_date=start_date, end_date=end_date, remaining=total_remaining,
+                      total_pages=final_page.total_pages())
+
+            # 处理分页：第 2..N 页按 PAGE_FANOUT 并发获取 (兄弟会话共用 cookie)，按页码顺序逐页合并
+            pages = iter_pages(final_page, fetch_page_concurrent, lambda page_num: fetch_page(page_num, session))
+            for page in chain([final_page], pages):
+                # 解析一次即转为列式数值，之后存储和统计都不再处理字符串
+                page_records = RecordColumns.from_rows(page.records())
+                if keep_records:
+                    all_records.extend(page_records)
+                pages_done += 1
+                record_count += len(page_records)
+                if on_page:
+                    on_page(total_remaining, page_records)
+                if on_progress:
+                    on_progress(pages_done, pages_total, record_count)
+
         return all_records, total_remaining
 
+    except (UpstreamUnavailable, StaleRoomForm):
+        raise
     except Exception as e:
-        print(f"爬取过程中发生错误: {e}")
-        import traceback
-        traceback.print_exc()  # 添加详细异常日志
+        log.exception('scrape.error', error=str(e))
         return None, None
 
 def get_buildings(session, max_retries=3):
     for attempt in range(1, max_retries + 1):
-        print(f"Getting buildings... (attempt {attempt}/{max_retries})")  # 添加日志
-        time.sleep(REQUEST_DELAY * attempt)  # 递增延迟
         try:
-            response = session.get(LOGIN_URL)
-            print(f"Buildings GET status: {response.status_code}, final URL: {response.url}")  # 简化日志
-            print(f"Response headers: {dict(response.headers)}")  # 新增：打印响应头，检查重定向或内容类型
-            if response.status_code >= 400:
-                print(f"Status >=400, text preview: {response.text[:500]}")  # 错误预览
+            response = upstream_get(session, LOGIN_URL, 'login')
             response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            select = soup.find('select', {'id': 'drlouming'})
-            print(f"Select tag found: {select is not None}, tag content if exists: {select.prettify()[:300] if select else 'None'}")  # 新增：详细 select 信息
-            if not select:
-                print(f"No select tag found, page preview: {soup.get_text()[:500]}")  # 修复格式
-                print(f"Full HTML length: {len(response.text)}, contains 'drlouming': {'drlouming' in response.text}")  # 新增：检查关键字
+            page = parse_page(response.text)
+            if not page.has_select('drlouming'):
+                # 隧道异常时常返回 200 的错误页，同样计为失败，下一次重试自动退避
+                log.warning('buildings.no_select', attempt=attempt, max_retries=max_retries, url=response.url,
+                            html_length=len(response.text), preview=page.text()[:200].strip())
+                upstream_throttle.record_failure()
                 if attempt < max_retries:
-                    print("Retrying...")
                     continue
-            options = parse_options_for_api(select)
-            print(f"Raw options from select: {[opt.get('value') for opt in select.find_all('option')]}")  # 新增：原始 options 值
-            print(f"Parsed {len(options)} building options")  # 添加日志：解析结果
+            options = page.select_options('drlouming')
+            log.debug('buildings.parsed', count=len(options), engine=page.engine)
             return options
         except requests.exceptions.HTTPError as e:
-            print(f"HTTP Error on attempt {attempt}: {e}, response preview: {response.text[:500] if 'response' in locals() else 'No response'}")
+            log.warning('buildings.http_error', attempt=attempt, max_retries=max_retries, error=str(e))
             if attempt < max_retries:
                 continue
             raise
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
-            print(f"Unexpected error on attempt {attempt}: {e}")
+            log.warning('buildings.error', attempt=attempt, max_retries=max_retries, error=str(e))
             if attempt < max_retries:
                 continue
             raise
     return []  # 如果所有重试失败，返回空
 
 def get_floors(session, building_value):
-    time.sleep(REQUEST_DELAY)
-    response = session.get(LOGIN_URL)
+    response = upstream_get(session, LOGIN_URL, 'login')
     response.raise_for_status()
-    soup = BeautifulSoup(response.text, 'html.parser')
-    initial_form_data = get_hidden_inputs(soup)
+    initial_form_data = parse_page(response.text).hidden_inputs()
 
-    time.sleep(REQUEST_DELAY)
-    res_floor = session.post(LOGIN_URL, data={**initial_form_data, '__EVENTTARGET': 'drlouming', 'drlouming': building_value})
+    res_floor = upstream_post(session, LOGIN_URL, 'building',
+                              data={**initial_form_data, '__EVENTTARGET': 'drlouming', 'drlouming': building_value})
     res_floor.raise_for_status()
 
-    soup_floor = BeautifulSoup(res_floor.text, 'html.parser')
-    select = soup_floor.find('select', {'id': 'drceng'})
-    return parse_options_for_api(select)
+    return parse_page(res_floor.text).select_options('drceng')
 
 def get_rooms(session, building_value, floor_value):
-    time.sleep(REQUEST_DELAY)
-    response = session.get(LOGIN_URL)
+    response = upstream_get(session, LOGIN_URL, 'login')
     response.raise_for_status()
-    soup = BeautifulSoup(response.text, 'html.parser')
-    initial_form_data = get_hidden_inputs(soup)
+    initial_form_data = parse_page(response.text).hidden_inputs()
 
-    time.sleep(REQUEST_DELAY)
-    res_floor = session.post(LOGIN_URL, data={**initial_form_data, '__EVENTTARGET': 'drlouming', 'drlouming': building_value})
+    res_floor = upstream_post(session, LOGIN_URL, 'building',
+                              data={**initial_form_data, '__EVENTTARGET': 'drlouming', 'drlouming': building_value})
     res_floor.raise_for_status()
 
-    soup_floor = BeautifulSoup(res_floor.text, 'html.parser')
-    floor_form_data = get_hidden_inputs(soup_floor)
+    floor_form_data = parse_page(res_floor.text).hidden_inputs()
 
-    time.sleep(REQUEST_DELAY)
-    res_room = session.post(LOGIN_URL, data={**floor_form_data, '__EVENTTARGET': 'drceng', 'drlouming': building_value, 'drceng': floor_value})
+    res_room = upstream_post(session, LOGIN_URL, 'floor',
+                             data={**floor_form_data, '__EVENTTARGET': 'drceng', 'drlouming': building_value, 'drceng': floor_value})
     res_room.raise_for_status()
 
-    soup_room = BeautifulSoup(res_room.text, 'html.parser')
-    room_form_data = get_hidden_inputs(soup_room)
-    select = soup_room.find('select', {'id': 'drfangjian'})
-    options = parse_options_for_api(select)
-    return options, room_form_data
+    page_room = parse_page(res_room.text)
+    return page_room.select_options('drfangjian'), page_room.hidden_inputs()
+
+def fetch_building_balances(building_value, floors):
+    """
+    余额快速路径 (watchlist.BalanceRefresher 调用)：一个会话内 GET 首页 -> 选择楼栋，之后每个楼层回发一次，
+    用该楼层页面的表单逐个选择 floors[floor_value] 中的房间，从跳转后的结果页解析剩余电量，不查询日期范围也不翻页。
+    返回 {(floor_value, room_value): 剩余电量或异常}；上游熔断时尚未刷新的房间都记为该异常。
+    """
+    session = PooledSession(HEADERS)
+    balances = {}
+    try:
+        response = upstream_get(session, LOGIN_URL, 'login')
+        response.raise_for_status()
+        res_building = upstream_post(session, LOGIN_URL, 'building', data={
+            **parse_page(response.text).hidden_inputs(), '__EVENTTARGET': 'drlouming', 'drlouming': building_value})
+        res_building.raise_for_status()
+        # 同一楼栋页面的表单可重复用于选择每个楼层，同一楼层页面的表单可重复用于选择每个房间
+        building_form = parse_page(res_building.text).hidden_inputs()
+        for floor_value, room_values in floors.items():
+            try:
+                res_floor = upstream_post(session, LOGIN_URL, 'floor', data={
+                    **building_form, '__EVENTTARGET': 'drceng', 'drlouming': building_value, 'drceng': floor_value})
+                res_floor.raise_for_status()
+                floor_form = parse_page(res_floor.text).hidden_inputs()
+            except UpstreamUnavailable:
+                raise
+            except Exception as e:
+                balances.update({(floor_value, room_value): e for room_value in room_values})
+                continue
+            for room_value in room_values:
+                try:
+                    page = parse_page(select_room(session, building_value, floor_value, room_value, floor_form).text)
+                    remaining = parse_number(page.remaining())
+                    balances[(floor_value, room_value)] = (
+                        remaining if remaining is not None else ValueError("结果页中没有剩余电量"))
+                except UpstreamUnavailable:
+                    raise
+                except Exception as e:
+                    balances[(floor_value, room_value)] = e
+    except UpstreamUnavailable as e:
+        for floor_value, room_values in floors.items():
+            for room_value in room_values:
+                balances.setdefault((floor_value, room_value), e)
+    finally:
+        session.close()
+    log.debug('watchlist.building', building_value=building_value,
+              rooms=sum(len(room_values) for room_values in floors.values()),
+              failed=sum(1 for value in balances.values() if isinstance(value, Exception)))
+    return balances
+
+class RoomNotFound(ValueError):
+    pass
+
+ROOM_LEVELS = (
+    # (层级, 下拉框 id, 中文名)
+    ('building', 'drlouming', '楼栋'),
+    ('floor', 'drceng', '楼层'),
+    ('room', 'drfangjian', '房间'),
+)
+
+def _resolve_level(target, level, select_id, label, page, cache_key):
+    # 用当前页面的下拉选项补全 target 中该层级的 value / 名称，并顺带写入拓扑缓存
+    options = page.select_options(select_id)
+    topology_cache.put(cache_key, options)
+    value_key = f"{level}_value"
+    if target.get(value_key) and options and target[value_key] not in {opt['value'] for opt in options}:
+        log.info('topology.stale_value', level=level, value=target[value_key])
+        target[value_key] = None
+    if not target.get(value_key):
+        target[value_key] = find_value(options, target.get(level))
+        log.debug('topology.resolved', level=level, name=target.get(level), value=target[value_key])
+        if not target[value_key]:
+            raise RoomNotFound(f"未找到{label} {target.get(level)} 的 value")
+    elif not target.get(level):
+        target[level] = next((opt['text'] for opt in options if opt['value'] == target[value_key]), None)
+
+def walk_to_room(session, target):
+    """
+    单会话线性回发：GET 首页 -> 选择楼栋 -> 选择楼层，每一步都沿用上一步页面的 VIEWSTATE。
+    target 含 building/floor/room 名称和(可选的) *_value；缺少的 value 直接从当前页面的下拉选项解析。
+    返回 (补全后的 target, 选择楼层后的表单隐藏字段)，之后交给 scrape_room_data 选择房间并查询。
+    """
+    target = dict(target)
+    response = upstream_get(session, LOGIN_URL, 'login')
+    response.raise_for_status()
+    page = parse_page(response.text)
+    _resolve_level(target, 'building', 'drlouming', '楼栋', page, buildings_key())
+    building_value = target['building_value']
+
+    res_floor = upstream_post(session, LOGIN_URL, 'building',
+                              data={**page.hidden_inputs(), '__EVENTTARGET': 'drlouming', 'drlouming': building_value})
+    res_floor.raise_for_status()
+    page = parse_page(res_floor.text)
+    _resolve_level(target, 'floor', 'drceng', '楼层', page, floors_key(building_value))
+    floor_value = target['floor_value']
+
+    res_room = upstream_post(session, LOGIN_URL, 'floor',
+                             data={**page.hidden_inputs(), '__EVENTTARGET': 'drceng', 'drlouming': building_value, 'drceng': floor_value})
+    res_room.raise_for_status()
+    page = parse_page(res_room.text)
+    _resolve_level(target, 'room', 'drfangjian', '房间', page, rooms_key(building_value, floor_value))
+    topology_cache.put(room_form_key(building_value, floor_value), page.hidden_inputs())
+    return target, page.hidden_inputs()
+
+def cached_room_form(target):
+    """
+    三级 value 和名称都已知 (请求或数据库中) 且缓存了该楼层未过期的表单时，返回 (补全名称的 target, 表单隐藏字段)：
+    直接选择房间，一次查询只需 选择房间 + 查询 两次回发。否则返回 None，走 walk_to_room。
+    """
+    if not all(target.get(f"{level}_value") for level, _, _ in ROOM_LEVELS):
+        return None
+    form_data = topology_cache.peek(room_form_key(target['building_value'], target['floor_value']), fresh_only=True)
+    if not form_data:
+        return None
+    if not all(target.get(level) for level, _, _ in ROOM_LEVELS):
+        stored = store.get_room(target['building_value'], target['floor_value'], target['room_value'])
+        if not stored:
+            return None
+        target = {**target, **{level: target.get(level) or stored[level] for level, _, _ in ROOM_LEVELS}}
+    return target, form_data
+
+def resolve_known_values(target):
+    # 不访问上游：优先用请求里给出的 value，其次是数据库中保存的房间，最后是拓扑缓存
+    target = dict(target)
+    if all(target.get(f"{level}_value") for level, _, _ in ROOM_LEVELS):
+        return target
+    stored = store.find_room(target.get('building'), target.get('floor'), target.get('room'))
+    if stored:
+        for level, _, _ in ROOM_LEVELS:
+            target[f"{level}_value"] = stored[f"{level}_value"]
+        return target
+    options = topology_cache.peek(buildings_key()) or []
+    target['building_value'] = target.get('building_value') or find_value(options, target.get('building'))
+    if target['building_value']:
+        options = topology_cache.peek(floors_key(target['building_value'])) or []
+        target['floor_value'] = target.get('floor_value') or find_value(options, target.get('floor'))
+    if target.get('floor_value'):
+        options = topology_cache.peek(rooms_key(target['building_value'], target['floor_value'])) or []
+        target['room_value'] = target.get('room_value') or find_value(options, target.get('room'))
+    return target
 
 @app.route('/')
 def index():
@@ -231,191 +453,637 @@ def index():
 def dashboard():
     return render_template('dashboard.html')
 
+def _fetch_with_session(fetch, *args):
+    session = PooledSession(HEADERS)
+    try:
+        return fetch(session, *args)
+    finally:
+        session.close()
+
+def cached_buildings():
+    return topology_cache.get(buildings_key(), lambda: _fetch_with_session(get_buildings))
+
+def cached_floors(building_value):
+    return topology_cache.get(floors_key(building_value), lambda: _fetch_with_session(get_floors, building_value))
+
+def cached_rooms(building_value, floor_value):
+    return topology_cache.get(rooms_key(building_value, floor_value),
+                              lambda: _fetch_with_session(get_rooms, building_value, floor_value)[0])
+
 @app.route('/api/options/<string:type_>', methods=['GET'])
 def api_options(type_):
-    print(f"API Options called: type={type_}, args={request.args.to_dict()}")  # 添加日志：API调用
-    session = requests.Session()
-    session.headers.update(HEADERS)
     try:
         if type_ == 'buildings':
-            options = get_buildings(session)
-            print(f"Buildings options length: {len(options)}")  # 添加日志：options长度
+            options = cached_buildings()
         elif type_ == 'floors':
             parent = request.args.get('building')
             if not parent:
-                print("Error: 缺少 parent for floors")  # 添加日志
                 return jsonify({"error": "缺少 parent (楼栋 value)"}), 400
-            options = get_floors(session, parent)
-            print(f"Floors options length: {len(options)}")  # 添加日志
+            options = cached_floors(parent)
         elif type_ == 'rooms':
             parent = request.args.get('parent')  # floor_value
             building = request.args.get('building')  # building_value
             if not parent or not building:
-                print("Error: 缺少 building 和 parent for rooms")  # 添加日志
                 return jsonify({"error": "缺少 building 和 parent (楼层 value)"}), 400
-            options, _ = get_rooms(session, building, parent)
-            print(f"Rooms options length: {len(options)}")  # 添加日志
+            options = cached_rooms(building, parent)
         else:
-            print(f"Error: 无效的 type {type_}")  # 添加日志
             return jsonify({"error": "无效的 type"}), 400
-        response_data = {"options": options}
-        print(f"Returning options: {response_data}")  # 添加日志：返回数据
-        return jsonify(response_data)
+        log.debug('options', sample=LOG_SAMPLE_RATE, type=type_, count=len(options))
+        response = jsonify({"options": options})
+        return conditional_response(lambda: response, content_etag(response.get_data()), policy='options')
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
     except Exception as e:
-        print(f"API Options error: {str(e)}")  # 添加日志：异常
-        import traceback
-        traceback.print_exc()
+        log.exception('options.error', type=type_, error=str(e))
         return jsonify({"error": str(e)}), 500
+
+@app.route('/api/options/invalidate', methods=['POST'])
+def api_options_invalidate():
+    # 不带参数清空全部；type=floors&building=X 或 type=rooms&building=X[&parent=Y] 只清空对应子树
+    type_ = request.args.get('type')
+    building = request.args.get('building')
+    parent = request.args.get('parent')
+    if type_ is None:
+        prefix = None
+    elif type_ == 'buildings':
+        prefix = buildings_key()
+    elif type_ == 'floors' and building:
+        prefix = floors_key(building)
+    elif type_ == 'rooms' and building:
+        prefix = rooms_key(building, parent) if parent else f"rooms:{building}"
+    else:
+        return jsonify({"error": "无效的 type 或缺少 building"}), 400
+    removed = topology_cache.invalidate(prefix)
+    log.info('topology.invalidated', prefix=prefix, removed=removed)
+    return jsonify({"success": True, "removed": removed, "cache": topology_cache.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus 抓取入口；熔断器状态在抓取时读出 (连接池计数在发生时累计)
+    throttle = upstream_throttle.snapshot()
+    CIRCUIT_OPEN.set(0 if throttle['state'] == 'closed' else 1)
+    THROTTLE_DELAY.set(throttle['delay'])
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE, headers={'Cache-Control': 'no-store'})
+
+@app.route('/api/upstream/pool', methods=['GET'])
+def api_upstream_pool():
+    # 上游连接池复用情况：reused / requests 越接近 1，握手开销越小；throttle 为当前限速/熔断状态，hedge 为对冲次数和各阶段延迟
+    return jsonify({**pool_stats.snapshot(), "throttle": upstream_throttle.snapshot(), "hedge": hedger.snapshot()})
+
+def shift_day(day, days):
+    return (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=days)).strftime('%Y-%m-%d')
+
+def stored_coverage(room_info):
+    """已存历史覆盖的日期范围 (history_start, history_end)；没有记录时为 (None, None)。"""
+    if not room_info or not room_info.get('history_start'):
+        return None, None
+    # 旧数据没有 history_end：当时每次都抓取到爬取当天
+    history_end = room_info.get('history_end') or (room_info.get('scrape_time') or '')[:10] or None
+    return room_info['history_start'], history_end
+
+def plan_segments(room_info, start_date, end_date, refresh_tail=True):
+    """
+    按已存历史规划需要向上游请求的日期段，返回 (segments, 新 history_start, 新 history_end)。
+    只请求未覆盖的部分：start_date 早于 history_start 时补前段，end_date 晚于 history_end 时补后段；
+    与已存历史之间有空档时空档一并获取，覆盖范围始终连续。
+    history_end 当天在爬取时数据可能不完整，refresh_tail=True 时请求涉及该日就从该日重新获取。
+    """
+    end_date = min(end_date, date.today().isoformat())
+    history_start, history_end = stored_coverage(room_info)
+    if not history_start or not INCREMENTAL_SCRAPE:
+        return [(start_date, end_date)], start_date, end_date
+    segments = []
+    if start_date < history_start:
+        segments.append((start_date, shift_day(history_start, -1)))
+    tail_from = history_end if refresh_tail else shift_day(history_end, 1)
+    if end_date >= tail_from:
+        segments.append((tail_from, end_date))
+    return segments, min(history_start, start_date), max(history_end, end_date)
+
+def save_room_data(room_info, records, remaining, scrape_time, history_start=None, history_end=None):
+    # room_info 需包含 building/floor/room 以及对应的 value；记录按 (date, meter_name) 合并进已有历史
+    info = {
+        "building": room_info["building"],
+        "floor": room_info["floor"],
+        "room": room_info["room"],
+        "building_value": room_info["building_value"],
+        "floor_value": room_info["floor_value"],
+        "room_value": room_info["room_value"],
+        "scrape_time": scrape_time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+    if remaining is not None:
+        info["remaining_electricity"] = remaining
+    if history_start:
+        info["history_start"] = history_start
+    if history_end:
+        info["history_end"] = history_end
+    info["id"] = store.save_room(info, records, merge=True)
+    return info
+
+def save_page(room_info, on_page):
+    # 流式爬取的 on_page：先把这一页合并写入数据库 (不带 scrape_time，不改变缓存是否新鲜)，再转交给 on_page
+    info = {key: room_info.get(key) for key in ('building', 'floor', 'room', 'building_value', 'floor_value',
+                                                 'room_value')}
+
+    def on_saved_page(remaining, page_records):
+        if page_records:
+            store.save_room(info, page_records, merge=True)
+        on_page(remaining, page_records)
+    return on_saved_page
+
+def scrape_target(target, start_date, end_date, on_page=None, on_progress=None):
+    """
+    单会话完成一次房间查询：walk_to_room (3 次请求，已缓存该楼层表单时跳过) + scrape_room_data (选择房间、查询、分页)。
+    返回 (保存后的 info, 错误信息)。on_page、on_progress 同 scrape_room_data。
+    流式模式 (传入 on_page) 下每一页先合并写入数据库再交给 on_page，内存中不保留全部记录；
+    scrape_time 和 history_start / history_end 仍在整次爬取成功后才更新，中途失败时已写入的页不会被视为已覆盖。
+    """
+    session = PooledSession(HEADERS)
+    started = time.perf_counter()
+    outcome = 'error'
+    SCRAPES_IN_FLIGHT.inc(mode='sync')
+    try:
+        cached = cached_room_form(resolve_known_values(target))
+        # 先用缓存的楼层表单直接选择房间；表单被拒绝时清除缓存，重新回发到该楼层再试一次
+        for use_cached in ((True, False) if cached else (False,)):
+            if use_cached:
+                target, room_form_data = cached
+            else:
+                target, room_form_data = walk_to_room(session, target)
+            room_values = (target['building_value'], target['floor_value'], target['room_value'])
+            # 已经要访问上游，顺带刷新 history_end 当天可能不完整的数据
+            segments, history_start, history_end = plan_segments(store.get_room(*room_values), start_date, end_date)
+            log.debug('scrape.start', room=room_values, segments=segments, cached_form=use_cached)
+            try:
+                records, remaining = scrape_room_data(session, *room_values, room_form_data, segments,
+                                                      save_page(target, on_page) if on_page else None, on_progress,
+                                                      keep_records=on_page is None)
+                break
+            except StaleRoomForm as e:
+                log.info('scrape.stale_form', room=room_values, cached_form=use_cached, error=str(e))
+                topology_cache.invalidate(room_form_key(*room_values[:2]))
+                session.cookies.clear()
+                records = remaining = None
+        if records is None:
+            outcome = 'failed'
+            log.warning('scrape.failed', room=room_values, segments=segments)
+            return None, "爬取失败"
+        outcome = 'ok'
+        log.info('scrape.done', room=room_values, segments=segments, records=len(records), remaining=remaining,
+                 streamed=on_page is not None, elapsed=round(time.perf_counter() - started, 3))
+        return save_room_data(target, records, remaining, datetime.now(), history_start, history_end), None
     finally:
         session.close()
-
-@app.route('/api/query', methods=['POST'])
+        SCRAPES_IN_FLIGHT.dec(mode='sync')
+        SCRAPE_SECONDS.observe(time.perf_counter() - started, mode='sync', outcome=outcome)
+
+def stored_room(target):
+    if all(target.get(f"{level}_value") for level, _, _ in ROOM_LEVELS):
+        return store.get_room(target['building_value'], target['floor_value'], target['room_value'])
+    return store.find_room(target.get('building'), target.get('floor'), target.get('room'))
+
+def scrape_flight_key(target, start_date, end_date):
+    # target 应已经过 resolve_known_values：按 value 生成 key，按名称和按 value 查询同一房间的请求合并为一次爬取；
+    # 本地还解析不出 value (拓扑缓存和数据库都没有) 时才按名称
+    if all(target.get(f"{level}_value") for level, _, _ in ROOM_LEVELS):
+        room_key = 'value:' + ':'.join(target[f"{level}_value"] for level, _, _ in ROOM_LEVELS)
+    else:
+        room_key = 'name:' + ':'.join(target.get(level) or '' for level, _, _ in ROOM_LEVELS)
+    return f"{room_key}:{start_date}:{end_date}"
+
+def stored_result_since(target, wait_start):
+    # single-flight 的 after_wait：其他 worker 刚爬完时直接使用它写入数据库的结果
+    wait_start = wait_start.strftime("%Y-%m-%d %H:%M:%S")
+
+    def after_wait():
+        info = stored_room(target)
+        if info and (info.get('scrape_time') or '') >= wait_start:
+            return info, None
+        return None
+    return after_wait
+
+def scrape_target_once(target, start_date, end_date, on_page=None, on_progress=None):
+    """
+    同 scrape_target，但对同一房间、同一日期范围的并发请求只向上游爬取一次。
+    与其他请求共享结果时本次的 on_page / on_progress 不会被调用。
+    """
+    target = resolve_known_values(target)
+    key = scrape_flight_key(target, start_date, end_date)
+    (info, error), shared = scrape_flight.do(
+        key, lambda: scrape_target(target, start_date, end_date, on_page, on_progress),
+        stored_result_since(target, datetime.now()))
+    if shared:
+        log.debug('scrape.shared', key=key)
+    return info, error
+
+def default_date_range():
+    return (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d'), datetime.now().strftime('%Y-%m-%d')
+
+def background_refresh(target, start_date=None, end_date=None):
+    default_start, default_end = default_date_range()
+    _, error = scrape_target_once(target, start_date or default_start, end_date or default_end)
+    if error:
+        log.warning('refresh.failed', room=scrape_flight_key(target, start_date or default_start, end_date or default_end),
+                    error=error)
+    return error
+
+refresh_scheduler = RefreshScheduler(store, background_refresh, CACHE_MAX_AGE, REFRESH_ACTIVE_WINDOW,
+                                     REFRESH_CONCURRENCY, REFRESH_TICK, retry_base=REFRESH_RETRY_BASE,
+                                     retry_max=REFRESH_RETRY_MAX)
+if SCHEDULER_ENABLED:
+    refresh_scheduler.start()
+
+job_runner = JobRunner(store, lambda target, start_date, end_date, on_progress: scrape_target_once(
+    target, start_date, end_date, on_progress=on_progress))
+
+balance_refresher = BalanceRefresher(store, fetch_building_balances)
+if SCHEDULER_ENABLED and WATCHLIST_ENABLED:
+    balance_refresher.start()
+
+def job_key(target, start_date, end_date):
+    # 任务按房间 + 日期范围去重 (与 single-flight 相同的 key)：同一房间不同范围的任务各自执行，不会返回范围不符的结果
+    return scrape_flight_key(target, start_date, end_date)
+
+def submit_job(target, start_date, end_date):
+    """登记刷新任务，返回 202 响应 (Location 指向任务查询地址)；同一房间、同一日期范围已有未完成任务时返回该任务。"""
+    target = resolve_known_values(target)
+    job, created = job_runner.submit(job_key(target, start_date, end_date), target, start_date, end_date)
+    return jsonify({**job_payload(job), "created": created}), 202, {'Location': f"/api/jobs/{job['id']}"}
+
+def wants_async():
+    # RFC 7240：客户端带 Prefer: respond-async 时，需要爬取的请求改为登记任务并立即返回 202
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+class ScrapeFailed(RuntimeError):
+    pass
+
+def unavailable_response(e):
+    # 上游熔断中：不等待超时，直接返回 503 并告知客户端何时重试
+    return jsonify({"error": str(e)}), 503, {'Retry-After': str(int(e.retry_after) + 1)}
+
+def conditional_response(build, etag, last_modified=None, policy='room'):
+    """
+    GET/HEAD 请求的 If-None-Match / If-Modified-Since 与验证器匹配时返回 304 (不调用 build)，
+    否则返回 build() 生成的响应；两种情况都带上 ETag、Last-Modified 和 Cache-Control。
+    """
+    headers = cache_headers(etag, last_modified, policy)
+    if request.method in ('GET', 'HEAD') and is_not_modified(
+            request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since'), etag, last_modified):
+        return Response(status=304, headers=headers)
+    response = make_response(build())
+    response.headers.update(headers)
+    return response
+
+def room_version(info):
+    # 房间数据在重新爬取 (scrape_time) 或余额批量刷新 (balance_time) 时变化
+    return max(info['scrape_time'], info.get('balance_time') or '')
+
+def room_etag(kind, info, stale, start_date, end_date):
+    # 统计还与当天日期有关
+    today = date.today().isoformat() if kind == 'stats' else ''
+    return make_etag(kind, info['id'], room_version(info), stale, start_date, end_date, today)
+
+def room_last_modified(info):
+    return http_date(room_version(info))
+
+def stats_last_modified(info):
+    # 统计中的今日/昨日随日期变化：最后修改时间不早于今天零点
+    return http_date(max(room_version(info), f"{date.today().isoformat()} 00:00:00"))
+
+@app.after_request
+def compress_response(response):
+    # 流式响应和文件 (direct_passthrough) 不压缩；未显式设置缓存策略的 API 响应不缓存
+    if request.path.startswith('/api/') and 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = 'no-store'
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+        return response
+    if not should_compress(response.mimetype, response.content_length or 0, response.headers.get('Content-Encoding')):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding:
+        response.set_data(compress_body(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def room_payload(info, stale=False):
+    return {
+        "info": {
+            "building": info["building"],
+            "floor": info["floor"],
+            "room": info["room"],
+            "scrape_time": info["scrape_time"]
+        },
+        "remaining_electricity": info.get('remaining_electricity') or 0.0,
+        "stale": stale
+    }
+
+def room_response(info, records, stale=False):
+    # records 为 RecordColumns，只在这里转换为 JSON 记录列表
+    return jsonify({**room_payload(info, stale), "records": records.to_json()})
+
+class InvalidRequest(ValueError):
+    pass
+
+def parse_room_request(data):
+    """
+    从请求参数中取出 (target, start_date, end_date, refresh_interval)，缺少房间时返回 None；
+    refresh_interval 不是整数时抛出 InvalidRequest (由路由返回 400)。
+    """
+    # 可以直接传 building_value/floor_value/room_value，跳过名称解析
+    target = {key: data.get(key) for key in ('building', 'floor', 'room', 'building_value', 'floor_value', 'room_value')}
+    if not all(target.get(level) or target.get(f"{level}_value") for level, _, _ in ROOM_LEVELS):
+        return None
+    default_start, default_end = default_date_range()
+    refresh_interval = data.get('refresh_interval')
+    if refresh_interval not in (None, ''):
+        try:
+            refresh_interval = max(int(refresh_interval), MIN_REFRESH_INTERVAL)
+        except (TypeError, ValueError):
+            raise InvalidRequest(f"refresh_interval 必须是整数: {refresh_interval!r}")
+    else:
+        refresh_interval = None
+    return target, data.get('start_date', default_start), data.get('end_date', default_end), refresh_interval
+
+def lookup_cached_room(target, start_date, end_date, refresh_interval=None, endpoint='query'):
+    """
+    只查缓存，不访问上游。返回 (补全 value 后的 target, (info, stale) 或 None)：
+    已存历史覆盖请求范围时直接返回，记录由 store.get_records 按请求范围切片；
+    缓存新鲜时 stale=False；过期且请求涉及最近一天时返回旧数据并在后台刷新；
+    无缓存或请求范围有未覆盖的日期时为 None，由调用方只爬取缺失的日期段。
+    结果按 endpoint 记入 electricity_cache_lookups_total (hit / stale / miss)。
+    """
+    target = resolve_known_values(target)
+    cached_info = None
+    if all(target.get(f"{level}_value") for level, _, _ in ROOM_LEVELS):
+        cached_info = store.get_room(target['building_value'], target['floor_value'], target['room_value'])
+    queried_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if cached_info and cached_info.get('scrape_time'):
+        missing, _, _ = plan_segments(cached_info, start_date, end_date, refresh_tail=False)
+        if missing:
+            CACHE_LOOKUPS.inc(endpoint=endpoint, result='miss')
+            log.debug('cache.partial', sample=LOG_SAMPLE_RATE, endpoint=endpoint, room_id=cached_info['id'],
+                      missing=missing)
+            return target, None
+        store.touch_room(cached_info['id'], queried_at, refresh_interval)
+        scrape_time = datetime.strptime(cached_info['scrape_time'], "%Y-%m-%d %H:%M:%S")
+        cache_age = (datetime.now() - scrape_time).total_seconds()
+        # 请求范围全部是已经定型的历史日期时，旧数据不会再变化
+        if cache_age < CACHE_MAX_AGE or not plan_segments(cached_info, start_date, end_date)[0]:
+            CACHE_LOOKUPS.inc(endpoint=endpoint, result='hit')
+            log.debug('cache.hit', sample=LOG_SAMPLE_RATE, endpoint=endpoint, room_id=cached_info['id'],
+                      age=round(cache_age))
+            return target, (cached_info, False)
+        # 缓存过期：先返回旧数据，后台刷新
+        refresh_scheduler.trigger(cached_info, start_date, end_date)
+        CACHE_LOOKUPS.inc(endpoint=endpoint, result='stale')
+        log.debug('cache.stale', endpoint=endpoint, room_id=cached_info['id'], age=round(cache_age))
+        return target, (cached_info, True)
+    CACHE_LOOKUPS.inc(endpoint=endpoint, result='miss')
+    return target, None
+
+def load_room(target, start_date, end_date, refresh_interval=None, endpoint='query'):
+    """
+    返回 (info, stale)：缓存命中时同 lookup_cached_room；无缓存时同步爬取。
+    名称无法解析时抛出 RoomNotFound，爬取失败时抛出 ScrapeFailed。
+    """
+    target, cached = lookup_cached_room(target, start_date, end_date, refresh_interval, endpoint)
+    if cached:
+        return cached
+
+    info, error = scrape_target_once(target, start_date, end_date)
+    if error:
+        raise ScrapeFailed(error)
+    store.touch_room(info["id"], datetime.now().strftime("%Y-%m-%d %H:%M:%S"), refresh_interval)
+    return info, False
+
+def room_stats(info, start_date, end_date):
+    # 统计与日期相关 (今日/昨日)，缓存 key 同时包含数据版本和当天日期
+    stats_key = f"{info['scrape_time']}|{date.today().isoformat()}|{start_date}|{end_date}"
+    stats = store.get_cached_stats(info['id'], stats_key)
+    if stats is None:
+        # 每日汇总 + 最近 4 周的原始记录 (分电表趋势)，不再读取整个范围的记录
+        today = date.today()
+        recent_start = max(filter(None, [start_date, (today - timedelta(days=7 * len(WEEK_LABELS) - 1)).isoformat()]))
+        stats = rollup_stats(store.get_daily_rollups(info['id'], start_date, end_date),
+                             store.get_records(info['id'], recent_start, end_date), today)
+        store.save_cached_stats(info['id'], stats_key, stats)
+    return stats
+
+@app.route('/api/query', methods=['GET', 'POST'])
 def api_query():
-    print("API Query called with data:", request.json)  # 添加日志：打印请求数据
+    # GET 查询参数或 POST JSON；GET 请求可以用 ETag 重新验证，数据未更新时返回 304
+    data = request.get_json(silent=True) or request.args.to_dict()
     try:
-        data = request.json
         if not data:
-            print("Error: 缺少 JSON body")  # 添加日志
             return jsonify({"error": "缺少 JSON body"}), 400
 
-        building_text = data.get('building')
-        floor_text = data.get('floor')
-        room_text = data.get('room')
-        start_date = data.get('start_date', (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d'))
-        end_date = data.get('end_date', datetime.now().strftime('%Y-%m-%d'))
+        parsed = parse_room_request(data)
+        if parsed is None:
+            return jsonify({"error": "缺少 building、floor 或 room"}), 400
+        target, start_date, end_date, refresh_interval = parsed
+        log.debug('query', sample=LOG_SAMPLE_RATE, target=target, start_date=start_date, end_date=end_date)
 
-        print(f"Query params: building={building_text}, floor={floor_text}, room={room_text}, dates={start_date} to {end_date}")  # 添加日志：打印参数
+        try:
+            if wants_async():
+                # 缓存未命中时不在请求中爬取，返回任务 (202)，客户端轮询 /api/jobs/<id> 完成后再查询
+                target, cached = lookup_cached_room(target, start_date, end_date, refresh_interval)
+                if not cached:
+                    return submit_job(target, start_date, end_date)
+                info, stale = cached
+            else:
+                info, stale = load_room(target, start_date, end_date, refresh_interval)
+        except RoomNotFound as e:
+            log.info('query.room_not_found', target=target, error=str(e))
+            return jsonify({"error": str(e)}), 400
+        except ScrapeFailed as e:
+            return jsonify({"error": str(e)}), 500
+        except UpstreamUnavailable as e:
+            return unavailable_response(e)
 
-        if not all([building_text, floor_text, room_text]):
-            print("Error: 缺少 building、floor 或 room")  # 添加日志
-            return jsonify({"error": "缺少 building、floor 或 room"}), 400
+        return conditional_response(
+            lambda: room_response(info, store.get_records(info["id"], start_date, end_date), stale),
+            room_etag('query', info, stale, start_date, end_date), room_last_modified(info))
 
-        # 检查缓存
-        now = datetime.now()
-        use_cache = False
-        cached_data = None
-        if os.path.exists(JSON_DATABASE_FILE):
-            try:
-                with open(JSON_DATABASE_FILE, 'r', encoding='utf-8') as f:
-                    cached_data = json.load(f)
-                print(f"Cache file exists, data keys: {list(cached_data.keys()) if cached_data else 'None'}")  # 日志：缓存存在
-                cached_info = cached_data.get('info', {})
-                print(f"Cached info: building={cached_info.get('building')}, floor={cached_info.get('floor')}, room={cached_info.get('room')}")  # 日志：缓存匹配
-                if (cached_info.get('building') == building_text and
-                    cached_info.get('floor') == floor_text and
-                    cached_info.get('room') == room_text):
-                    scrape_time_str = cached_info.get('scrape_time')
-                    if scrape_time_str:
-                        scrape_time = datetime.strptime(scrape_time_str, "%Y-%m-%d %H:%M:%S")
-                        cache_age = now - scrape_time
-                        print(f"Cache age: {cache_age}, threshold: 1 hour")  # 日志：缓存年龄
-                        if cache_age < timedelta(hours=1):
-                            use_cache = True
-                            remaining_str = cached_info.get('remaining_electricity')
-                            remaining = float(remaining_str) if remaining_str else 0.0
-                            records = cached_data.get('records', [])
-                            print(f"Using cache data, records length: {len(records)}")  # 添加日志：使用缓存
-                            return jsonify({
-                                "info": {
-                                    "building": building_text,
-                                    "floor": floor_text,
-                                    "room": room_text,
-                                    "scrape_time": scrape_time_str
-                                },
-                                "records": records,
-                                "remaining_electricity": remaining
-                            })
-                        else:
-                            print("Cache too old, scraping fresh data")  # 日志：缓存过期
-                    else:
-                        print("No scrape_time in cache, scraping fresh")  # 日志：无时间
-                else:
-                    print("Cache mismatch, scraping fresh")  # 日志：不匹配
-            except (json.JSONDecodeError, ValueError, KeyError) as e:
-                print(f"缓存解析错误: {e}")
-        else:
-            print("No cache file, scraping fresh")  # 日志：无缓存
+    except InvalidRequest as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        log.exception('query.error', error=str(e))
+        return jsonify({"error": str(e)}), 500
 
-        if use_cache:
-            pass  # 已返回
+def balance_frame(info, stale, source):
+    return {"type": "balance", **room_payload(info, stale), "source": source}
+
+def records_frame(records):
+    return {"type": "records", "records": records.to_json()}
+
+def room_stream_frames(target, cached, start_date, end_date, refresh_interval=None):
+    """
+    /api/query/stream 的帧序列：balance -> records 批次 -> summary (出错时以 error 帧结束)。
+    cached 为 lookup_cached_room 的结果。已存历史覆盖的部分从数据库分批读出，立即发送；
+    未覆盖的日期段在后台爬取，每解析完一页上游结果就发送一批，之后再发一次 balance 更新剩余电量。
+    最近一天会重新获取，不同批次可能出现同一 (date, meter_name)，客户端以后到的为准。
+    """
+    started = time.monotonic()
+    sent = {"records": 0, "batches": 0}
+
+    def send_records(records):
+        sent["records"] += len(records)
+        sent["batches"] += 1
+        return records_frame(records)
+
+    def summary(info, source):
+        return {"type": "summary", "source": source, "record_count": sent["records"], "batches": sent["batches"],
+                "scrape_time": info.get("scrape_time"), "elapsed": round(time.monotonic() - started, 3)}
+
+    if cached:
+        info, stale = cached
+        yield balance_frame(info, stale, "cache")
+        for batch in store.iter_records(info["id"], start_date, end_date, STREAM_BATCH_SIZE):
+            yield send_records(batch)
+        yield summary(info, "cache")
+        return
+
+    # 先发送已存历史中不需要重新获取的部分
+    stored = stored_room(target)
+    segments = plan_segments(stored, start_date, end_date)[0] if stored else [(start_date, end_date)]
+    segment_ordinals = [(parse_date(start), parse_date(end)) for start, end in segments]
+
+    def in_segments(ordinal):
+        return any(low <= ordinal <= high for low, high in segment_ordinals)
+
+    if stored:
+        yield balance_frame(stored, True, "cache")
+        for batch in store.iter_records(stored["id"], start_date, end_date, STREAM_BATCH_SIZE):
+            batch = batch.where(lambda ordinal: not in_segments(ordinal))
+            if batch:
+                yield send_records(batch)
+
+    relay = PageRelay()
+    relay.start(lambda: scrape_target_once(target, start_date, end_date, relay.on_page))
+    balance_sent = False
+    try:
+        for remaining, records in relay:
+            if not balance_sent:
+                yield {"type": "balance", **room_payload({**target, "scrape_time": None,
+                                                          "remaining_electricity": remaining}),
+                       "source": "upstream"}
+                balance_sent = True
+            if records:
+                yield send_records(records)
+    except UpstreamUnavailable as e:
+        yield {"type": "error", "error": str(e), "retry_after": int(e.retry_after) + 1}
+        return
+    except Exception as e:
+        yield {"type": "error", "error": str(e)}
+        return
+    finally:
+        relay.cancel()
+
+    info, error = relay.result
+    if error:
+        yield {"type": "error", "error": error}
+        return
+    if not relay.pages:
+        # 与其他请求共享了同一次爬取：本次没有收到逐页结果，改为从数据库读出刚写入的部分
+        yield balance_frame(info, False, "upstream")
+        for batch in store.iter_records(info["id"], start_date, end_date, STREAM_BATCH_SIZE):
+            batch = batch.where(in_segments)
+            if batch:
+                yield send_records(batch)
+    store.touch_room(info["id"], datetime.now().strftime("%Y-%m-%d %H:%M:%S"), refresh_interval)
+    yield summary(info, "upstream")
+
+@app.route('/api/query/stream', methods=['GET', 'POST'])
+def api_query_stream():
+    # 流式查询：参数同 /api/query，另加 format=ndjson|sse (也可用 Accept: text/event-stream 选择 SSE)
+    data = request.get_json(silent=True) or request.args.to_dict()
+    try:
+        parsed = parse_room_request(data)
+    except InvalidRequest as e:
+        return jsonify({"error": str(e)}), 400
+    if parsed is None:
+        return jsonify({"error": "缺少 building、floor 或 room"}), 400
+    target, start_date, end_date, refresh_interval = parsed
+    fmt = stream_format(data.get('format'), request.headers.get('Accept'))
 
-        # 获取 value 并爬取
-        session = requests.Session()
-        session.headers.update(HEADERS)
-        try:
-            # 获取 buildings value
-            buildings = get_buildings(session)
-            print(f"Available buildings options: {len(buildings)}, sample: {buildings[:2] if buildings else 'empty'}")  # 日志：可用选项
-            building_value = next((opt['value'] for opt in buildings if opt['text'] == building_text), None)
-            print(f"Matching building_text '{building_text}' to value: {building_value}")  # 日志：匹配结果
-            if not building_value:
-                print(f"Failed to match building: searched texts: {[opt['text'] for opt in buildings]}")  # 日志：搜索文本
-                return jsonify({"error": f"未找到楼栋 {building_text} 的 value"}), 400
-
-            # 获取 floors value
-            floors = get_floors(session, building_value)
-            print(f"Available floors for building {building_value}: {len(floors)}, sample: {floors[:2] if floors else 'empty'}")
-            floor_value = next((opt['value'] for opt in floors if opt['text'] == floor_text), None)
-            print(f"Matching floor_text '{floor_text}' to value: {floor_value}")
-            if not floor_value:
-                print(f"Failed to match floor: searched texts: {[opt['text'] for opt in floors]}")
-                return jsonify({"error": f"未找到楼层 {floor_text} 的 value"}), 400
-
-            # 获取 rooms value 和 form_data
-            rooms_opts, room_form_data = get_rooms(session, building_value, floor_value)
-            print(f"Available rooms for floor {floor_value}: {len(rooms_opts)}, sample: {rooms_opts[:2] if rooms_opts else 'empty'}")
-            room_value = next((opt['value'] for opt in rooms_opts if opt['text'] == room_text), None)
-            print(f"Matching room_text '{room_text}' to value: {room_value}")
-            if not room_value:
-                print(f"Failed to match room: searched texts: {[opt['text'] for opt in rooms_opts]}")
-                return jsonify({"error": f"未找到房间 {room_text} 的 value"}), 400
-
-            # 爬取数据
-            print("Starting scrape for room data...")  # 添加日志：开始爬取
-            records, remaining_str = scrape_room_data(session, building_value, floor_value, room_value, room_form_data, start_date, end_date)
-            if records is None:
-                print("Scrape failed, returning error")  # 添加日志：爬取失败
-                return jsonify({"error": "爬取失败"}), 500
-
-            remaining = float(remaining_str) if remaining_str else 0.0
-            print(f"Scrape success: {len(records)} records, remaining: {remaining_str}")  # 添加日志：爬取成功
-
-            # 保存更新
-            info = {
-                "building": building_text,
-                "floor": floor_text,
-                "room": room_text,
-                "building_value": building_value,
-                "floor_value": floor_value,
-                "room_value": room_value,
-                "scrape_time": now.strftime("%Y-%m-%d %H:%M:%S")
-            }
-            if remaining_str:
-                info["remaining_electricity"] = remaining_str
+    try:
+        target, cached = lookup_cached_room(target, start_date, end_date, refresh_interval, 'stream')
+    except RoomNotFound as e:
+        return jsonify({"error": str(e)}), 400
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    frames = room_stream_frames(target, cached, start_date, end_date, refresh_interval)
+    # X-Accel-Buffering 让 nginx 等反向代理不缓冲整个响应
+    return Response(encode_frames(frames, fmt), mimetype=FORMATS[fmt], headers={'X-Accel-Buffering': 'no'})
+
+def parse_sync_cursor(cursor, room_id):
+    """游标格式为 "<room_id>.<sync_version>"；无效或属于其他房间时返回 0 (全量同步)。"""
+    try:
+        cursor_room, version = (int(part) for part in str(cursor).split('.'))
+    except (TypeError, ValueError):
+        return 0
+    return version if cursor_room == room_id else 0
+
+@app.route('/api/sync', methods=['GET', 'POST'])
+def api_sync():
+    # 增量同步：参数同 /api/query，另加 since=<上次返回的 cursor>。
+    # 只返回该游标之后新增或数值变化的记录 (full=false，客户端按 (date, meter_name) 合并)；
+    # 没有游标、游标无效或服务端记录被整体替换过时返回范围内全部记录 (full=true，客户端替换本地副本)。
+    data = request.get_json(silent=True) or request.args.to_dict()
+    try:
+        parsed = parse_room_request(data)
+    except InvalidRequest as e:
+        return jsonify({"error": str(e)}), 400
+    if parsed is None:
+        return jsonify({"error": "缺少 building、floor 或 room"}), 400
+    target, start_date, end_date, refresh_interval = parsed
 
-            data_to_save = {
-                "info": info,
-                "records": records
-            }
+    try:
+        info, stale = load_room(target, start_date, end_date, refresh_interval, 'sync')
+    except RoomNotFound as e:
+        return jsonify({"error": str(e)}), 400
+    except ScrapeFailed as e:
+        return jsonify({"error": str(e)}), 500
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        log.exception('sync.error', error=str(e))
+        return jsonify({"error": str(e)}), 500
 
-            with open(JSON_DATABASE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data_to_save, f, ensure_ascii=False, indent=4)
-
-            # 返回
-            print("Returning query response")  # 添加日志：返回响应
-            return jsonify({
-                "info": {
-                    "building": building_text,
-                    "floor": floor_text,
-                    "room": room_text,
-                    "scrape_time": info["scrape_time"]
-                },
-                "records": records,
-                "remaining_electricity": remaining
-            })
-        finally:
-            session.close()
+    since = parse_sync_cursor(data.get('since'), info['id'])
+    version, reset_version, records = store.get_changes(info['id'], since, start_date, end_date)
+    full = since == 0 or since < reset_version or since > version
+    if full and since:
+        version, reset_version, records = store.get_changes(info['id'], 0, start_date, end_date)
+    log.debug('sync', sample=LOG_SAMPLE_RATE, room_id=info['id'], since=since, version=version, full=full,
+              records=len(records))
+    return jsonify({**room_payload(info, stale), "cursor": f"{info['id']}.{version}", "full": full,
+                    "records": records.to_json()})
+
+@app.route('/api/stats', methods=['GET', 'POST'])
+def api_stats():
+    # 面板统计：参数同 /api/query (GET 查询参数或 POST JSON)，只返回统计结果，不返回原始记录
+    data = request.get_json(silent=True) or request.args.to_dict()
+    try:
+        parsed = parse_room_request(data)
+    except InvalidRequest as e:
+        return jsonify({"error": str(e)}), 400
+    if parsed is None:
+        return jsonify({"error": "缺少 building、floor 或 room"}), 400
+    target, start_date, end_date, refresh_interval = parsed
 
+    try:
+        info, stale = load_room(target, start_date, end_date, refresh_interval, 'stats')
+        return conditional_response(
+            lambda: jsonify({**room_payload(info, stale), **room_stats(info, start_date, end_date)}),
+            room_etag('stats', info, stale, start_date, end_date), stats_last_modified(info))
+    except RoomNotFound as e:
+        return jsonify({"error": str(e)}), 400
+    except ScrapeFailed as e:
+        return jsonify({"error": str(e)}), 500
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -424,136 +1092,147 @@ def api_refresh():
     building_text = request.args.get('building')
     floor_text = request.args.get('floor')
     room_text = request.args.get('room')
+    default_start, default_end = default_date_range()
 
     if building_text and floor_text and room_text:
-        print(f"刷新指定房间: {building_text} - {floor_text} - {room_text}")
-        session = requests.Session()
-        session.headers.update(HEADERS)
-        try:
-            # 获取 buildings value
-            buildings = get_buildings(session)
-            building_value = next((opt['value'] for opt in buildings if opt['text'] == building_text), None)
-            if not building_value:
-                return jsonify({"error": "无效房间参数"}), 400
-
-            # 获取 floors value
-            floors = get_floors(session, building_value)
-            floor_value = next((opt['value'] for opt in floors if opt['text'] == floor_text), None)
-            if not floor_value:
-                return jsonify({"error": "无效房间参数"}), 400
-
-            # 获取 rooms options 和 form_data
-            rooms_opts, room_form_data = get_rooms(session, building_value, floor_value)
-            room_value = next((opt['value'] for opt in rooms_opts if opt['text'] == room_text), None)
-            if not room_value:
-                return jsonify({"error": "无效房间参数"}), 400
-
-            # 爬取数据 (默认90天)
-            default_start = (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d')
-            default_end = datetime.now().strftime('%Y-%m-%d')
-            records, remaining_str = scrape_room_data(session, building_value, floor_value, room_value, room_form_data, default_start, default_end)
-            if records is None:
-                return jsonify({"error": "刷新爬取失败"}), 500
-
-            # 保存更新
-            now = datetime.now()
-            new_info = {
-                "building": building_text,
-                "floor": floor_text,
-                "room": room_text,
-                "building_value": building_value,
-                "floor_value": floor_value,
-                "room_value": room_value,
-                "scrape_time": now.strftime("%Y-%m-%d %H:%M:%S")
-            }
-            if remaining_str:
-                new_info["remaining_electricity"] = remaining_str
-
-            new_data = {
-                "info": new_info,
-                "records": records
-            }
+        log.info('refresh.requested', building=building_text, floor=floor_text, room=room_text)
+        target = resolve_known_values({"building": building_text, "floor": floor_text, "room": room_text})
+        message = '数据已刷新'
+    else:
+        # 原逻辑 (基于缓存)：刷新最近一次爬取的房间
+        target = store.latest_room()
+        if not target:
+            return jsonify({"error": "无缓存数据可刷新"}), 400
+        if not all([target.get('building_value'), target.get('floor_value'), target.get('room_value')]):
+            return jsonify({"error": "缓存数据缺少必要 value"}), 400
+        message = '缓存已刷新'
 
-            with open(JSON_DATABASE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(new_data, f, ensure_ascii=False, indent=4)
+    if wants_async():
+        return submit_job(target, default_start, default_end)
 
-            return jsonify({'success': True, 'message': '数据已刷新'})
+    try:
+        # 爬取 (默认90天，增量模式下只抓取缺口)
+        _, error = scrape_target_once(target, default_start, default_end)
+        if error:
+            return jsonify({"error": "刷新爬取失败"}), 500
+        return jsonify({'success': True, 'message': message})
+    except RoomNotFound:
+        return jsonify({"error": "无效房间参数"}), 400
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+@app.route('/api/jobs', methods=['POST'])
+def api_jobs_create():
+    # 登记房间刷新任务并立即返回 (202)：参数同 /api/query (JSON 或查询参数)；
+    # 不带房间时与 /api/refresh 相同，刷新最近一次爬取的房间
+    data = request.get_json(silent=True) or request.args.to_dict()
+    try:
+        parsed = parse_room_request(data)
+        if parsed is None:
+            latest = store.latest_room()
+            parsed = parse_room_request({**latest, **data}) if latest else None
+    except InvalidRequest as e:
+        return jsonify({"error": str(e)}), 400
+    if parsed is None:
+        return jsonify({"error": "缺少 building、floor 或 room"}), 400
+    target, start_date, end_date, _ = parsed
+    return submit_job(target, start_date, end_date)
+
+@app.route('/api/jobs/<string:job_id>', methods=['GET'])
+def api_jobs_get(job_id):
+    # 任务状态：status 为 queued / running / done / failed，progress 为已完成页数 / 已知总页数，完成后 result 含房间信息
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在或已过期"}), 404
+    return jsonify(job_payload(job))
+
+def parse_threshold(value):
+    return None if value in (None, '') else float(value)
+
+def resolve_watch_target(data):
+    """监控登记：优先不访问上游补全 value，仍缺少时单会话回发解析 (同 walk_to_room)。"""
+    target = resolve_known_values({key: data.get(key) for key in (
+        'building', 'floor', 'room', 'building_value', 'floor_value', 'room_value')})
+    if not all(target.get(f"{level}_value") for level, _, _ in ROOM_LEVELS):
+        session = PooledSession(HEADERS)
+        try:
+            target, _ = walk_to_room(session, target)
         finally:
             session.close()
-    else:
-        # 原逻辑 (基于缓存)
-        if not os.path.exists(JSON_DATABASE_FILE):
-            return jsonify({"error": "无缓存数据可刷新"}), 400
-
+    return target
+
+@app.route('/api/watchlist', methods=['GET'])
+def api_watchlist():
+    # 监控房间按告警优先级排序：告警在前，其次按预计可用天数、剩余电量升序；alert=1 只返回告警房间，limit 限制条数
+    entries = load_watchlist(store)
+    alerts = sum(1 for entry in entries if entry['alert'])
+    if request.args.get('alert') == '1':
+        entries = [entry for entry in entries if entry['alert']]
+    limit = request.args.get('limit', type=int)
+    if limit:
+        entries = entries[:limit]
+    return jsonify({"rooms": entries, "count": len(entries), "alerts": alerts,
+                    "last_run": balance_refresher.last_run, "running": balance_refresher.running()})
+
+@app.route('/api/watchlist', methods=['POST'])
+def api_watchlist_add():
+    # 登记监控房间：单个房间 (参数同 /api/query) 或 {"rooms": [...]} 批量登记，threshold (度) / days_threshold (天)
+    # 可写在顶层作为默认值。history=true 时为最近 WATCHLIST_USAGE_DAYS 天还没有抓取的房间登记一次短范围刷新任务，
+    # 用于估算可用天数 (只请求 plan_segments 规划出的缺口)；单个房间默认开启，批量登记默认关闭，避免一次登记上百个爬取任务
+    data = request.get_json(silent=True) or request.args.to_dict()
+    items = data.get('rooms') or [data]
+    history = str(data.get('history', 'rooms' not in data)).lower() not in ('0', 'false')
+    usage_end = date.today().isoformat()
+    usage_start = (date.today() - timedelta(days=WATCHLIST_USAGE_DAYS - 1)).isoformat()
+    added, errors = [], []
+    for item in items:
+        room = {key: item.get(key) for key in ('building', 'floor', 'room')}
+        if not all(item.get(level) or item.get(f"{level}_value") for level, _, _ in ROOM_LEVELS):
+            errors.append({"room": room, "error": "缺少 building、floor 或 room"})
+            continue
         try:
-            with open(JSON_DATABASE_FILE, 'r', encoding='utf-8') as f:
-                cached_data = json.load(f)
-            info = cached_data.get('info', {})
-            building_value = info.get('building_value')
-            floor_value = info.get('floor_value')
-            room_value = info.get('room_value')
-            if not all([building_value, floor_value, room_value]):
-                return jsonify({"error": "缓存数据缺少必要 value"}), 400
-
-            session = requests.Session()
-            session.headers.update(HEADERS)
-            try:
-                # 重建选择流程获取 room_form_data
-                time.sleep(REQUEST_DELAY)
-                resp = session.get(LOGIN_URL)
-                resp.raise_for_status()
-                soup_init = BeautifulSoup(resp.text, 'html.parser')
-                initial_form = get_hidden_inputs(soup_init)
-
-                time.sleep(REQUEST_DELAY)
-                res_floor_sel = session.post(LOGIN_URL, data={**initial_form, '__EVENTTARGET': 'drlouming', 'drlouming': building_value})
-                res_floor_sel.raise_for_status()
-                soup_floor = BeautifulSoup(res_floor_sel.text, 'html.parser')
-                floor_form = get_hidden_inputs(soup_floor)
-
-                time.sleep(REQUEST_DELAY)
-                res_room_sel = session.post(LOGIN_URL, data={**floor_form, '__EVENTTARGET': 'drceng', 'drlouming': building_value, 'drceng': floor_value})
-                res_room_sel.raise_for_status()
-                soup_room = BeautifulSoup(res_room_sel.text, 'html.parser')
-                room_form_data = get_hidden_inputs(soup_room)
-
-                # 爬取 (默认90天)
-                default_start = (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d')
-                default_end = datetime.now().strftime('%Y-%m-%d')
-                records, remaining_str = scrape_room_data(session, building_value, floor_value, room_value, room_form_data, default_start, default_end)
-                if records is None:
-                    return jsonify({"error": "刷新爬取失败"}), 500
-
-                now = datetime.now()
-                new_info = {
-                    "building": info["building"],
-                    "floor": info["floor"],
-                    "room": info["room"],
-                    "building_value": building_value,
-                    "floor_value": floor_value,
-                    "room_value": room_value,
-                    "scrape_time": now.strftime("%Y-%m-%d %H:%M:%S")
-                }
-                if remaining_str:
-                    new_info["remaining_electricity"] = remaining_str
-
-                new_data = {
-                    "info": new_info,
-                    "records": records
-                }
-
-                with open(JSON_DATABASE_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(new_data, f, ensure_ascii=False, indent=4)
-
-                return jsonify({"success": True, "message": "缓存已刷新"})
-            finally:
-                session.close()
-
+            target = resolve_watch_target(item)
+            room_id = store.ensure_room(target)
+            store.watch_room(room_id, parse_threshold(item.get('threshold', data.get('threshold'))),
+                             parse_threshold(item.get('days_threshold', data.get('days_threshold'))))
+        except RoomNotFound as e:
+            errors.append({"room": room, "error": str(e)})
+            continue
+        except ValueError:
+            errors.append({"room": room, "error": "阈值必须是数字"})
+            continue
+        except UpstreamUnavailable as e:
+            return unavailable_response(e)
         except Exception as e:
-            return jsonify({"error": str(e)}), 500
+            errors.append({"room": room, "error": str(e)})
+            continue
+        if history and plan_segments(store.get_room(target['building_value'], target['floor_value'],
+                                                    target['room_value']), usage_start, usage_end,
+                                     refresh_tail=False)[0]:
+            job_runner.submit(job_key(target, usage_start, usage_end), target, usage_start, usage_end)
+        added.append({"room_id": room_id, "room": {key: target.get(key) for key in ('building', 'floor', 'room')}})
+    return jsonify({"added": added, "errors": errors}), 201 if added else 400
+
+@app.route('/api/watchlist', methods=['DELETE'])
+def api_watchlist_remove():
+    data = request.get_json(silent=True) or request.args.to_dict()
+    target = resolve_known_values({key: data.get(key) for key in (
+        'building', 'floor', 'room', 'building_value', 'floor_value', 'room_value')})
+    info = None
+    if all(target.get(f"{level}_value") for level, _, _ in ROOM_LEVELS):
+        info = store.get_room(target['building_value'], target['floor_value'], target['room_value'])
+    if info is None or not store.unwatch_room(info['id']):
+        return jsonify({"error": "该房间不在监控列表中"}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/watchlist/refresh', methods=['POST'])
+def api_watchlist_refresh():
+    # 立即在后台批量刷新一次监控房间的余额；进行中时不重复启动
+    started = balance_refresher.trigger()
+    return jsonify({"started": started, "running": balance_refresher.running(),
+                    "last_run": balance_refresher.last_run}), 202
 
 if __name__ == '__main__':
     app.run(debug=False, host='0.0.0.0', port=5000)
@@ -0,0 +1,202 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import (HEADERS, LOGIN_URL, RESULTS_URL, UPSTREAM_STAGES, InvalidRequest, RoomNotFound, ScrapeFailed,
+                 _resolve_level, app, cached_room_form, lookup_cached_room, parse_room_request, plan_segments, resolve_known_values,
+                 room_etag, room_last_modified, room_payload, room_stats, save_room_data, scrape_flight,
+                 scrape_flight_key, stage_timeout, stats_last_modified, store, stored_result_since, topology_cache)
+from async_upstream import AsyncUpstream
+from http_cache import cache_headers, choose_encoding, compress_body, is_not_modified, should_compress
+from logs import get_logger
+from metrics import SCRAPE_SECONDS, SCRAPES_IN_FLIGHT
+from throttle import UpstreamUnavailable
+from topology_cache import StaleRoomForm, buildings_key, floors_key, room_form_key, rooms_key
+
+# --- ASGI 入口 ---
+# 用法: uvicorn asgi:application --workers 1
+# /api/query 和 /api/stats 由协程直接处理 (ETag / 304 / 压缩规则同 Flask 路由)：缓存命中时立即返回，未命中时用 AsyncUpstream 爬取，
+# 等待上游期间不占用线程，单个进程可同时进行数百个房间的爬取。其余路由交给原 Flask 应用 (在线程池中运行)。
+# 数据库读写 (缓存查找、写入记录和每日汇总、生成响应) 都通过 asyncio.to_thread 执行，不阻塞事件循环；
+# 回发过程中的拓扑缓存写入已由 topology_cache 的后台线程完成。
+
+# 同时进行的异步爬取上限，超出的请求排队等待
+ASYNC_MAX_SCRAPES = int(os.environ.get('ASYNC_MAX_SCRAPES', 200))
+STAGE_TIMEOUTS = {stage: stage_timeout(timeout_stage) for stage, timeout_stage in UPSTREAM_STAGES.items()}
+
+log = get_logger('asgi')
+
+wsgi_application = WsgiToAsgi(app)
+_scrape_slots = None
+
+
+def _slots():
+    global _scrape_slots
+    if _scrape_slots is None:
+        _scrape_slots = asyncio.Semaphore(ASYNC_MAX_SCRAPES)
+    return _scrape_slots
+
+
+async def scrape_target_async(target, start_date, end_date):
+    """app.scrape_target 的异步版本，返回 (保存后的 info, 错误信息)。"""
+    async with _slots(), AsyncUpstream(LOGIN_URL, RESULTS_URL, HEADERS, stage_timeouts=STAGE_TIMEOUTS) as upstream:
+        started = time.perf_counter()
+        outcome = 'error'
+        SCRAPES_IN_FLIGHT.inc(mode='async')
+        try:
+            cached = await asyncio.to_thread(lambda: cached_room_form(resolve_known_values(target)))
+            for use_cached in ((True, False) if cached else (False,)):
+                if use_cached:
+                    target, room_form_data = cached
+                else:
+                    target, room_form_data = await upstream.walk_to_room(target, _resolve_level,
+                                                                         (buildings_key, floors_key, rooms_key))
+                    topology_cache.put(room_form_key(target['building_value'], target['floor_value']),
+                                       room_form_data)
+                room_values = (target['building_value'], target['floor_value'], target['room_value'])
+                stored = await asyncio.to_thread(store.get_room, *room_values)
+                segments, history_start, history_end = plan_segments(stored, start_date, end_date)
+                log.debug('scrape.start', room=room_values, segments=segments, cached_form=use_cached)
+                try:
+                    records, remaining = await upstream.scrape_room_data(*room_values, room_form_data, segments)
+                    break
+                except StaleRoomForm as e:
+                    log.info('scrape.stale_form', room=room_values, cached_form=use_cached, error=str(e))
+                    await asyncio.to_thread(topology_cache.invalidate, room_form_key(*room_values[:2]))
+                    upstream.client.cookies.clear()
+                    records = remaining = None
+            outcome = 'failed' if records is None else 'ok'
+        finally:
+            SCRAPES_IN_FLIGHT.dec(mode='async')
+            SCRAPE_SECONDS.observe(time.perf_counter() - started, mode='async', outcome=outcome)
+    if records is None:
+        log.warning('scrape.failed', room=room_values, segments=segments)
+        return None, "爬取失败"
+    log.info('scrape.done', room=room_values, segments=segments, records=len(records), remaining=remaining,
+             elapsed=round(time.perf_counter() - started, 3))
+    info = await asyncio.to_thread(save_room_data, target, records, remaining, datetime.now(), history_start,
+                                   history_end)
+    return info, None
+
+
+async def load_room_async(target, start_date, end_date, refresh_interval=None, endpoint='query'):
+    """app.load_room 的异步版本：缓存逻辑相同，未命中时通过异步 single-flight 爬取。"""
+    target, cached = await asyncio.to_thread(lookup_cached_room, target, start_date, end_date, refresh_interval,
+                                             endpoint)
+    if cached:
+        return cached
+    # lookup_cached_room 返回的 target 已补全 value，与同步流程使用相同的 single-flight key
+    key = scrape_flight_key(target, start_date, end_date)
+    (info, error), shared = await scrape_flight.do_async(
+        key, lambda: scrape_target_async(target, start_date, end_date), stored_result_since(target, datetime.now()))
+    if shared:
+        log.debug('scrape.shared', key=key)
+    if error:
+        raise ScrapeFailed(error)
+    await asyncio.to_thread(store.touch_room, info["id"], datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                            refresh_interval)
+    return info, False
+
+
+async def _read_json(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+
+def _request_header(scope, name):
+    name = name.lower().encode('latin-1')
+    for key, value in scope.get('headers', ()):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+async def _send_json(send, payload, status=200, extra_headers=(), scope=None):
+    # 传入 scope 时按请求的 Accept-Encoding 压缩响应体
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else b''
+    headers = [(b'access-control-allow-origin', b'*'), *extra_headers]
+    if payload is not None:
+        headers.append((b'content-type', b'application/json'))
+    if scope is not None and status == 200 and should_compress('application/json', len(body)):
+        headers.append((b'vary', b'Accept-Encoding'))
+        encoding = choose_encoding(_request_header(scope, 'Accept-Encoding'))
+        if encoding:
+            body = compress_body(body, encoding)
+            headers.append((b'content-encoding', encoding.encode()))
+    if not any(key == b'cache-control' for key, _ in headers):
+        headers.append((b'cache-control', b'no-store'))
+    headers.append((b'content-length', str(len(body)).encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _room_request(scope, receive, send, kind, build_payload, last_modified):
+    # /api/query 与 /api/stats 共用：解析参数 -> 加载房间 -> (验证器匹配时 304) -> build_payload(info, stale, start, end)
+    data = await _read_json(receive)
+    if not data and scope['method'] == 'GET':
+        data = dict(parse_qsl(scope.get('query_string', b'').decode('utf-8')))
+    if not data:
+        return await _send_json(send, {"error": "缺少 JSON body"}, 400)
+    try:
+        parsed = parse_room_request(data)
+    except InvalidRequest as e:
+        return await _send_json(send, {"error": str(e)}, 400)
+    if parsed is None:
+        return await _send_json(send, {"error": "缺少 building、floor 或 room"}, 400)
+    target, start_date, end_date, refresh_interval = parsed
+    try:
+        info, stale = await load_room_async(target, start_date, end_date, refresh_interval, kind)
+        etag, modified = room_etag(kind, info, stale, start_date, end_date), last_modified(info)
+        headers = [(key.lower().encode(), value.encode()) for key, value in cache_headers(etag, modified).items()]
+        if scope['method'] in ('GET', 'HEAD') and is_not_modified(
+                _request_header(scope, 'If-None-Match'), _request_header(scope, 'If-Modified-Since'), etag, modified):
+            return await _send_json(send, None, 304, headers)
+        payload = await asyncio.to_thread(build_payload, info, stale, start_date, end_date)
+        return await _send_json(send, payload, 200, headers, scope)
+    except RoomNotFound as e:
+        return await _send_json(send, {"error": str(e)}, 400)
+    except UpstreamUnavailable as e:
+        return await _send_json(send, {"error": str(e)}, 503, [(b'retry-after', str(int(e.retry_after) + 1).encode())])
+    except Exception as e:
+        log.exception(f'{kind}.error', error=str(e))
+        return await _send_json(send, {"error": str(e)}, 500)
+
+
+async def api_query(scope, receive, send):
+    await _room_request(scope, receive, send, 'query', lambda info, stale, start_date, end_date: {
+        **room_payload(info, stale), "records": store.get_records(info["id"], start_date, end_date).to_json()},
+        room_last_modified)
+
+
+async def api_stats(scope, receive, send):
+    await _room_request(scope, receive, send, 'stats', lambda info, stale, start_date, end_date: {
+        **room_payload(info, stale), **room_stats(info, start_date, end_date)}, stats_last_modified)
+
+
+ASYNC_ROUTES = {
+    ('GET', '/api/query'): api_query,
+    ('POST', '/api/query'): api_query,
+    ('GET', '/api/stats'): api_stats,
+    ('POST', '/api/stats'): api_stats,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+        if handler is not None:
+            return await handler(scope, receive, send)
+    await wsgi_application(scope, receive, send)
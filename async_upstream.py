@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import httpx
+
+from logs import get_logger
+from pagination import fetch_all_records_async
+from parsers import parse_page
+from records import RecordColumns, parse_number
+from throttle import UpstreamUnavailable, upstream_throttle
+from topology_cache import StaleRoomForm
+from upstream_pool import pool_stats, record_upstream, shared_async_transport, trace_connections
+
+
+# --- 异步上游客户端 ---
+# 与 app.py 中 get_buildings / get_floors / get_rooms / walk_to_room / scrape_room_data 相同的回发流程，
+# 改用 httpx.AsyncClient：等待上游时不占用线程，一个进程可以同时进行大量房间爬取。
+# 请求间隔和熔断与同步流程共用 upstream_throttle (等待用 asyncio.sleep)。
+# 一个 AsyncUpstream 实例对应一个上游会话 (cookies + VIEWSTATE 链)，不同房间的爬取各自使用独立实例，
+# 但都共用 upstream_pool 中的 keep-alive 连接池。
+# 页面解析交给线程执行 (PARSE_MODE=process 时再转交进程池)，不阻塞事件循环。
+# 回发阶段 (stage) 与 app.UPSTREAM_STAGES 相同，耗时和结果同样记入 metrics.py 的上游指标。
+
+log = get_logger('async_upstream')
+
+
+class AsyncUpstream:
+    def __init__(self, login_url, results_url, headers, timeout=30, stage_timeouts=None):
+        """stage_timeouts: {回发阶段: (连接超时, 读取超时)}，阶段同 app.UPSTREAM_STAGES；未列出的阶段使用 timeout。"""
+        self.login_url = login_url
+        self.results_url = results_url
+        self.stage_timeouts = stage_timeouts or {}
+        self.client = httpx.AsyncClient(headers=headers, timeout=timeout, follow_redirects=True,
+                                        transport=shared_async_transport())
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        # 不调用 client.aclose()：那会关闭共享的连接池，这里只丢弃本会话的 cookie
+        self.client.cookies.clear()
+
+    async def _page(self, method, url, stage, **kwargs):
+        if stage in self.stage_timeouts:
+            connect_timeout, read_timeout = self.stage_timeouts[stage]
+            kwargs['timeout'] = httpx.Timeout(read_timeout, connect=connect_timeout)
+        try:
+            await upstream_throttle.wait_async()
+        except UpstreamUnavailable as e:
+            record_upstream(stage, time.perf_counter(), error=e)
+            raise
+        pool_stats.incr('requests')
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, extensions={'trace': trace_connections}, **kwargs)
+        except httpx.TransportError as e:
+            upstream_throttle.record_failure()
+            record_upstream(stage, started, error=e)
+            raise
+        upstream_throttle.record(response.status_code, time.perf_counter() - started)
+        record_upstream(stage, started, response)
+        response.raise_for_status()
+        return await asyncio.to_thread(parse_page, response.text)
+
+    async def _select_building(self, page, building_value):
+        return await self._page('POST', self.login_url, 'building', data={
+            **page.hidden_inputs(), '__EVENTTARGET': 'drlouming', 'drlouming': building_value})
+
+    async def _select_floor(self, page, building_value, floor_value):
+        return await self._page('POST', self.login_url, 'floor', data={
+            **page.hidden_inputs(), '__EVENTTARGET': 'drceng', 'drlouming': building_value, 'drceng': floor_value})
+
+    async def get_buildings(self, max_retries=3):
+        for attempt in range(1, max_retries + 1):
+            page = await self._page('GET', self.login_url, 'login')
+            if page.has_select('drlouming'):
+                return page.select_options('drlouming')
+            log.warning('buildings.no_select', attempt=attempt, max_retries=max_retries)
+        return []
+
+    async def get_floors(self, building_value):
+        page = await self._page('GET', self.login_url, 'login')
+        page = await self._select_building(page, building_value)
+        return page.select_options('drceng')
+
+    async def get_rooms(self, building_value, floor_value):
+        page = await self._page('GET', self.login_url, 'login')
+        page = await self._select_building(page, building_value)
+        page = await self._select_floor(page, building_value, floor_value)
+        return page.select_options('drfangjian'), page.hidden_inputs()
+
+    async def walk_to_room(self, target, resolve_level, cache_keys):
+        """
+        同 app.walk_to_room：GET 首页 -> 选择楼栋 -> 选择楼层。
+        resolve_level(target, level, select_id, label, page, cache_key) 用页面选项补全 target (即 app._resolve_level)，
+        cache_keys 为三个层级的拓扑缓存 key 生成函数 (buildings_key, floors_key, rooms_key)。
+        """
+        buildings_key, floors_key, rooms_key = cache_keys
+        target = dict(target)
+        page = await self._page('GET', self.login_url, 'login')
+        resolve_level(target, 'building', 'drlouming', '楼栋', page, buildings_key())
+        building_value = target['building_value']
+
+        page = await self._select_building(page, building_value)
+        resolve_level(target, 'floor', 'drceng', '楼层', page, floors_key(building_value))
+        floor_value = target['floor_value']
+
+        page = await self._select_floor(page, building_value, floor_value)
+        resolve_level(target, 'room', 'drfangjian', '房间', page, rooms_key(building_value, floor_value))
+        return target, page.hidden_inputs()
+
+    async def scrape_room_data(self, building_value, floor_value, room_value, form_data, segments):
+        """同 app.scrape_room_data，返回 (RecordColumns, 剩余电量)，失败时返回 (None, None)。"""
+        try:
+            payload_select_room = {
+                **form_data,
+                'drlouming': building_value,
+                'drceng': floor_value,
+                'drfangjian': room_value,
+                'radio': 'usedR',
+                'ImageButton1.x': '30',
+                'ImageButton1.y': '10'
+            }
+            payload_select_room.pop('__EVENTTARGET', None)
+            try:
+                page = await self._page('POST', self.login_url, 'room', data=payload_select_room,
+                                        headers={'Referer': self.login_url})
+            except httpx.HTTPStatusError as e:
+                raise StaleRoomForm(str(e)) from e
+            if page.has_select('drfangjian'):
+                # 仍停留在首页：表单已失效或房间不存在
+                raise StaleRoomForm("选择房间后未进入查询结果页")
+
+            async def fetch_page(page_num):
+                return await self._page('GET', f"{self.results_url}?p={page_num}", 'page',
+                                        headers={'Referer': self.results_url})
+
+            all_records = []
+            remaining = None
+            for start_date, end_date in segments:
+                final_payload = {
+                    **page.hidden_inputs(),
+                    'txtstart': start_date,
+                    'txtend': end_date,
+                    'btnser': '查询'
+                }
+                page = await self._page('POST', self.results_url, 'query', data=final_payload,
+                                        headers={'Referer': self.results_url})
+                remaining = page.remaining() or remaining
+                # 剩余分页在同一会话 (共用 cookie) 中并发获取，结果不一致时回退为顺序获取
+                all_records.extend(await fetch_all_records_async(page, fetch_page, fetch_page))
+            return RecordColumns.from_rows(all_records), parse_number(remaining)
+        except (UpstreamUnavailable, StaleRoomForm):
+            raise
+        except Exception as e:
+            log.exception('scrape.error', error=str(e))
+            return None, None
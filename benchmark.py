@@ -0,0 +1,276 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from simulator import FIXTURES_DIR, SimulatorConfig, start_simulator
+
+# --- 基准测试 ---
+# 全部在本地完成，不访问线上站点：上游由 simulator.py 模拟，数据库和拓扑缓存使用临时文件。
+#   parse      : fixtures/*.html 每页的解析耗时 (lxml / bs4)
+#   scrape     : walk_to_room + scrape_room_data 端到端耗时和每次爬取的上游请求数
+#   api        : /api/query 冷启动 (需要爬取)、热缓存和 ETag 重新验证 (304) 的耗时
+#   throughput : 多线程并发请求 /api/query 的吞吐量和延迟分布
+# 结果写入 JSON 文件 (含 commit 和参数)，--compare 与另一次的结果逐项对比:
+#   python benchmark.py --output bench-new.json --compare bench-old.json
+
+RESULTS_FILE = 'benchmark_results.json'
+SECTIONS = ('parse', 'scrape', 'api', 'throughput')
+
+
+def _summary(samples):
+    """耗时样本 (秒) -> 毫秒统计。"""
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def bench_parse(args):
+    from parsers import extract_page, lxml
+
+    engines = ['lxml', 'bs4'] if lxml is not None else ['bs4']
+    results = {}
+    for path in sorted(glob.glob(os.path.join(args.fixtures, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            html = f.read()
+        name = os.path.splitext(os.path.basename(path))[0]
+        results[name] = {"bytes": len(html.encode('utf-8'))}
+        for engine in engines:
+            extract_page(html, engine)  # 预热
+            samples = [_timed(extract_page, html, engine)[0] for _ in range(args.parse_iterations)]
+            results[name][engine] = _summary(samples)
+    return results
+
+
+class Harness:
+    """启动模拟器并以临时数据库导入 app，供 scrape / api / throughput 共用。"""
+
+    def __init__(self, args):
+        config = SimulatorConfig(latency=args.latency, jitter=args.jitter, page_size=args.page_size,
+                                 buildings=args.buildings, floors=args.floors, rooms=args.rooms)
+        self.server, self.simulator, base_url = start_simulator(config)
+        self.workdir = tempfile.mkdtemp(prefix='bench-')
+        os.environ.update({
+            'UPSTREAM_BASE_URL': base_url,
+            'ELECTRICITY_DB': os.path.join(self.workdir, 'bench.db'),
+            'TOPOLOGY_CACHE_FILE': os.path.join(self.workdir, 'topology.json'),
+            'SCHEDULER_ENABLED': '0',
+        })
+        if not args.verbose:
+            os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        import app
+        self.app = app
+        self.config = config
+        self.days = args.days
+        self._next_room = 0
+
+    def rooms(self):
+        """模拟器中全部房间的 (楼栋, 楼层, 房间) 名称。"""
+        sim = self.simulator
+        for building_value, building in sim.buildings().items():
+            for floor_value, floor in sim.floors(building_value).items():
+                for room in sim.rooms(building_value, floor_value).values():
+                    yield {"building": building, "floor": floor, "room": room}
+
+    def fresh_rooms(self, count):
+        """取 count 个之前没有用过的房间 (保证冷启动)；房间不够时报错。"""
+        rooms = list(self.rooms())[self._next_room:self._next_room + count]
+        if len(rooms) < count:
+            raise SystemExit(f"模拟器房间数不足，请增大 --buildings / --floors / --rooms")
+        self._next_room += count
+        return rooms
+
+    def date_range(self):
+        today = date.today()
+        return (today - timedelta(days=self.days - 1)).isoformat(), today.isoformat()
+
+    def query_params(self, room):
+        start_date, end_date = self.date_range()
+        return {**room, "start_date": start_date, "end_date": end_date}
+
+    def close(self):
+        self.server.shutdown()
+
+
+def bench_scrape(harness, args):
+    app = harness.app
+    start_date, end_date = harness.date_range()
+    samples, requests_per_scrape, records = [], [], 0
+    for room in harness.fresh_rooms(args.repeat):
+        harness.simulator.reset_stats()
+        session = app.PooledSession(app.HEADERS)
+
+        def scrape():
+            target, form_data = app.walk_to_room(session, dict(room))
+            return app.scrape_room_data(session, target['building_value'], target['floor_value'],
+                                        target['room_value'], form_data, [(start_date, end_date)])
+
+        elapsed, (scraped, _) = _timed(scrape)
+        session.close()
+        samples.append(elapsed)
+        records = len(scraped)
+        requests_per_scrape.append(sum(v for k, v in harness.simulator.stats().items() if k != 'sessions'))
+    return {**_summary(samples), "records": records, "pages": -(-records // harness.config.page_size),
+            "upstream_requests": statistics.fmean(requests_per_scrape)}
+
+
+def bench_api(harness, args):
+    client = harness.app.app.test_client()
+    cold, warm, revalidate = [], [], []
+    for room in harness.fresh_rooms(args.repeat):
+        elapsed, response = _timed(client.get, '/api/query', query_string=harness.query_params(room))
+        assert response.status_code == 200, response.get_data(as_text=True)
+        cold.append(elapsed)
+    params = harness.query_params(room)
+    etag = client.get('/api/query', query_string=params).headers['ETag']
+    for _ in range(args.api_iterations):
+        warm.append(_timed(client.get, '/api/query', query_string=params)[0])
+        elapsed, response = _timed(client.get, '/api/query', query_string=params, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        revalidate.append(elapsed)
+    return {"cold": _summary(cold), "warm": _summary(warm), "revalidate_304": _summary(revalidate)}
+
+
+def bench_throughput(harness, args):
+    app = harness.app.app
+
+    def run(rooms, total):
+        def one(i):
+            client = app.test_client()
+            elapsed, response = _timed(client.get, '/api/query', query_string=harness.query_params(rooms[i % len(rooms)]))
+            return elapsed, response.status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(one, range(total)))
+        wall = time.perf_counter() - start
+        errors = sum(1 for _, status in results if status != 200)
+        return {**_summary([elapsed for elapsed, _ in results]), "requests": total, "errors": errors,
+                "req_per_s": round(total / wall, 2), "concurrency": args.concurrency}
+
+    cold_rooms = harness.fresh_rooms(args.concurrency * 2)
+    return {
+        # 每个房间都需要爬取：衡量上游并发能力
+        "cold": run(cold_rooms, len(cold_rooms)),
+        # 同一批房间重复请求：衡量缓存命中路径
+        "warm": run(cold_rooms, args.concurrency * args.api_iterations),
+    }
+
+
+def flatten(results, prefix=''):
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, name)
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+def compare(current, baseline):
+    """逐项打印与基线的差异 (只比较耗时和吞吐量指标)。"""
+    old = dict(flatten(baseline["results"]))
+    print(f"\n对比基线 {baseline['meta'].get('commit')} -> {current['meta'].get('commit')}")
+    for name, value in flatten(current["results"]):
+        if not name.endswith(('mean_ms', 'p50_ms', 'p95_ms', 'req_per_s')) or not old.get(name):
+            continue
+        change = (value - old[name]) / old[name] * 100
+        # 耗时变大或吞吐量变小为退化
+        worse = change < 0 if name.endswith('req_per_s') else change > 0
+        flag = '  <-- 退化' if worse and abs(change) >= 10 else ''
+        print(f"  {name:<45} {old[name]:>12.3f} -> {value:>12.3f}  ({change:+.1f}%){flag}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="离线基准测试 (上游使用 simulator.py 模拟)")
+    parser.add_argument('--only', default=','.join(SECTIONS), help=f"逗号分隔，可选 {', '.join(SECTIONS)}")
+    parser.add_argument('--output', default=RESULTS_FILE)
+    parser.add_argument('--compare', help="与之前的结果文件对比")
+    parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    parser.add_argument('--parse-iterations', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5, help="scrape / api 冷启动的重复次数 (每次一个新房间)")
+    parser.add_argument('--api-iterations', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--days', type=int, default=90, help="每次查询的天数")
+    parser.add_argument('--latency', type=float, default=0.02, help="模拟器每个请求的延迟 (秒)")
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--page-size', type=int, default=10)
+    parser.add_argument('--buildings', type=int, default=4)
+    parser.add_argument('--floors', type=int, default=6)
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--verbose', action='store_true', help="保留应用日志输出")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sections = [name for name in args.only.split(',') if name]
+    results = {}
+    harness = None
+    try:
+        for name in sections:
+            if name not in SECTIONS:
+                raise SystemExit(f"未知的测试项: {name}")
+            print(f"运行 {name} ...", file=sys.stderr)
+            quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with quiet:
+                if name == 'parse':
+                    results[name] = bench_parse(args)
+                    continue
+                harness = harness or Harness(args)
+                results[name] = {'scrape': bench_scrape, 'api': bench_api, 'throughput': bench_throughput}[name](
+                    harness, args)
+    finally:
+        if harness:
+            harness.close()
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "parser_engine": os.environ.get('PARSER_ENGINE', 'lxml'),
+            "parse_mode": os.environ.get('PARSE_MODE', 'thread'),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"结果已写入 {args.output}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,40 @@
 import requests
-from bs4 import BeautifulSoup
+import argparse
+import itertools
 import json
 import os
+import random
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-import re
+
+from parsers import parse_page
+from ratelimit import TokenBucket
+from storage import DEFAULT_DATABASE_FILE, ElectricityStore
+from throttle import ThrottledSession, ThrottledSessionMixin, UpstreamUnavailable
 
 # --- 全局配置 ---
-BASE_URL = "https://electricfee.vip.cpolar.cn"
+BASE_URL = os.environ.get('UPSTREAM_BASE_URL', "https://electricfee.vip.cpolar.cn")
 LOGIN_URL = f"{BASE_URL}/default.aspx"
 RESULTS_URL = f"{BASE_URL}/usedRecord.aspx"
-JSON_DATABASE_FILE = "electricity_data_single_room.json"
+DATABASE_FILE = DEFAULT_DATABASE_FILE
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
     'Origin': BASE_URL,
 }
-REQUEST_DELAY = 0.1
-
-# --- 辅助函数 (无变化) ---
-def get_hidden_inputs(soup):
-    form_data = {}
-    for input_tag in soup.find_all('input', {'type': 'hidden'}):
-        name, value = input_tag.get('name'), input_tag.get('value', '')
-        if name: form_data[name] = value
-    return form_data
-
-def parse_options(select_tag):
-    options = {}
-    if not select_tag: return options
-    for option in select_tag.find_all('option')[1:]:
-        value, text = option.get('value'), option.text.strip()
-        if value and text:
-            options[text] = value
-    return options
+# 全校批量爬取的断点文件
+CRAWL_CHECKPOINT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "crawl_checkpoint.json")
+# 本地查询时列出的最近天数
+RECENT_DAYS = 14
+# 批量爬取时单个房间失败后的重试等待 (秒)，每次失败翻倍
+CRAWL_RETRY_DELAY = float(os.environ.get('CRAWL_RETRY_DELAY', 1.0))
+
+# --- 辅助函数 ---
+def parse_options(page, select_id):
+    # 下拉框选项转换为 {名称: value}
+    return {option["text"]: option["value"] for option in page.select_options(select_id)}
 
 def get_user_choice(prompt, options_list):
     if not options_list:
@@ -53,22 +54,24 @@ def get_user_choice(prompt, options_list):
         except ValueError:
             print("请输入一个数字。")
 
-def _parse_records_from_soup(soup):
-    records = []
-    rows = soup.select('table.dataTable tr.contentLine')
-    for row in rows:
-        cols = [td.text.strip() for td in row.find_all('td')]
-        if len(cols) == 4:
-            records.append({
-                "date": cols[0], "meter_name": cols[1],
-                "usage": cols[2], "price": cols[3]
-            })
-    return records
+def incremental_start(store, room_values, days=90):
+    """
+    增量抓取：已存历史覆盖近 days 天时，只从最新记录日期开始抓取（当天数据可能不完整，所以包含最新一天）。
+    返回 (抓取起始日期, 合并后的 history_start)
+    """
+    window_start = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    room_info = store.get_room(*room_values)
+    if room_info and room_info.get("history_start"):
+        latest = store.latest_record_date(room_info["id"])
+        if latest and room_info["history_start"] <= window_start <= latest:
+            print(f"    [增量] 已有 {room_info['history_start']} 至 {latest} 的记录，只抓取 {latest} 之后的数据。")
+            return latest, room_info["history_start"]
+    return window_start, window_start
 
 # --- 核心爬取功能 (已修改) ---
-def scrape_room_data(session, building_value, floor_value, room_value, form_data):
+def scrape_room_data(session, building_value, floor_value, room_value, form_data, start_date=None, end_date=None):
     """
-    爬取一个指定房间过去90天的所有分页数据和剩余电量。
+    爬取一个指定房间在 [start_date, end_date] 内的所有分页数据和剩余电量，默认过去90天。
     返回: (记录列表, 剩余电量字符串) 的元组
     """
     try:
@@ -79,60 +82,47 @@ def scrape_room_data(session, building_value, floor_value, room_value, form_data
         res_after_select = session.post(LOGIN_URL, data=payload_select_room, headers={'Referer': LOGIN_URL})
         res_after_select.raise_for_status()
 
-        soup_results_page = BeautifulSoup(res_after_select.text, 'html.parser')
-        results_page_form_data = get_hidden_inputs(soup_results_page)
+        results_page_form_data = parse_page(res_after_select.text).hidden_inputs()
         
         today = datetime.now()
-        ninety_days_ago = today - timedelta(days=90)
-        final_payload = {**results_page_form_data, 'txtstart': ninety_days_ago.strftime('%Y-%m-%d'),
-                         'txtend': today.strftime('%Y-%m-%d'), 'btnser': '查询'}
+        start_date = start_date or (today - timedelta(days=90)).strftime('%Y-%m-%d')
+        end_date = end_date or today.strftime('%Y-%m-%d')
+        final_payload = {**results_page_form_data, 'txtstart': start_date,
+                         'txtend': end_date, 'btnser': '查询'}
                          
         final_response = session.post(RESULTS_URL, data=final_payload, headers={'Referer': RESULTS_URL})
         final_response.raise_for_status()
 
-        final_soup = BeautifulSoup(final_response.text, 'html.parser')
-        
-        # ==================== 修改：只解析总剩余电量 ====================
-        total_remaining = None
-        h6_tag = final_soup.find('h6')
-        if h6_tag:
-            spans = h6_tag.find_all('span', class_='number orange')
-            # 确保有三个span，我们取最后一个
-            if len(spans) == 3:
-                total_remaining = spans[2].text.strip()
-        # ==========================================================
+        final_page = parse_page(final_response.text)
+
+        # 只解析总剩余电量 (h6 中第三个 span)
+        total_remaining = final_page.remaining()
 
         # 解析用量记录
-        all_records = _parse_records_from_soup(final_soup)
-        
+        all_records = final_page.records()
+
         # 处理分页
-        total_pages = 1
-        pageer_div = final_soup.find('div', class_='pageer')
-        if pageer_div:
-            match = re.search(r'共\s*(\d+)\s*页', pageer_div.text)
-            if match:
-                total_pages = int(match.group(1))
+        total_pages = final_page.total_pages()
 
         if total_pages > 1:
             for page_num in range(2, total_pages + 1):
-                time.sleep(REQUEST_DELAY)
                 next_page_url = f"{RESULTS_URL}?p={page_num}"
                 res_page = session.get(next_page_url, headers={'Referer': RESULTS_URL})
                 res_page.raise_for_status()
-                soup_page = BeautifulSoup(res_page.text, 'html.parser')
-                records_from_page = _parse_records_from_soup(soup_page)
-                all_records.extend(records_from_page)
+                all_records.extend(parse_page(res_page.text).records())
         
         print(f"    [成功] 获取 {len(all_records)} 条用量记录 和 剩余电量信息。")
         return all_records, total_remaining
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         print(f"    [失败] 爬取过程中发生错误: {e}")
         return None, None
 
 # --- 交互式爬取功能 (保存逻辑已修改) ---
 def scrape_single_room_interactive():
-    session = requests.Session()
+    session = ThrottledSession()
     session.headers.update(HEADERS)
     
     try:
@@ -140,115 +130,330 @@ def scrape_single_room_interactive():
         print("正在获取楼栋列表...")
         response = session.get(LOGIN_URL)
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        initial_form_data = get_hidden_inputs(soup)
-        buildings = parse_options(soup.find('select', {'id': 'drlouming'}))
+        page = parse_page(response.text)
+        initial_form_data = page.hidden_inputs()
+        buildings = parse_options(page, 'drlouming')
         building_text = get_user_choice("楼栋", buildings.keys())
         if not building_text: return
         building_value = buildings[building_text]
 
         print(f"正在获取 '{building_text}' 的楼层列表...")
         res_floor = session.post(LOGIN_URL, data={**initial_form_data, '__EVENTTARGET': 'drlouming', 'drlouming': building_value})
-        soup_floor = BeautifulSoup(res_floor.text, 'html.parser')
-        floor_form_data = get_hidden_inputs(soup_floor)
-        floors = parse_options(soup_floor.find('select', {'id': 'drceng'}))
+        page_floor = parse_page(res_floor.text)
+        floor_form_data = page_floor.hidden_inputs()
+        floors = parse_options(page_floor, 'drceng')
         floor_text = get_user_choice("楼层", floors.keys())
         if not floor_text: return
         floor_value = floors[floor_text]
 
         print(f"正在获取 '{building_text} - {floor_text}' 的房间列表...")
         res_room = session.post(LOGIN_URL, data={**floor_form_data, '__EVENTTARGET': 'drceng', 'drlouming': building_value, 'drceng': floor_value})
-        soup_room = BeautifulSoup(res_room.text, 'html.parser')
-        room_form_data = get_hidden_inputs(soup_room)
-        rooms = parse_options(soup_room.find('select', {'id': 'drfangjian'}))
+        page_room = parse_page(res_room.text)
+        room_form_data = page_room.hidden_inputs()
+        rooms = parse_options(page_room, 'drfangjian')
         room_text = get_user_choice("房间", rooms.keys())
         if not room_text: return
         room_value = rooms[room_text]
 
         print(f"\n准备爬取: {building_text} - {floor_text} - {room_text}")
-        # ==================== 修改：接收单个返回值 ====================
-        records, remaining_electricity = scrape_room_data(session, building_value, floor_value, room_value, room_form_data)
+        store = ElectricityStore(DATABASE_FILE)
+        start_date, history_start = incremental_start(store, (building_value, floor_value, room_value))
+        records, remaining_electricity = scrape_room_data(session, building_value, floor_value, room_value, room_form_data, start_date)
 
         if records is not None:
-            # ==================== 修改：构建新的保存结构 ====================
             info_data = {
                 "building": building_text,
                 "floor": floor_text,
                 "room": room_text,
-                "scrape_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                "building_value": building_value,
+                "floor_value": floor_value,
+                "room_value": room_value,
+                "scrape_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "history_start": history_start,
+                "history_end": datetime.now().strftime("%Y-%m-%d")
             }
             # 如果爬取到了剩余电量，就添加到info字典中
             if remaining_electricity is not None:
                 info_data["remaining_electricity"] = remaining_electricity
 
-            data_to_save = {
-                "info": info_data,
-                "records": records
-            }
-            # ==========================================================
-            
-            with open(JSON_DATABASE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data_to_save, f, ensure_ascii=False, indent=4)
-            print(f"数据库 '{JSON_DATABASE_FILE}' 已被更新为该房间的数据！")
+            store.save_room(info_data, records, merge=True)
+            print(f"数据库 '{DATABASE_FILE}' 中该房间的数据已更新！")
 
     except requests.exceptions.RequestException as e:
         print(f"网络请求失败: {e}", file=sys.stderr)
     except Exception as e:
         print(f"发生未知错误: {e}", file=sys.stderr)
 
-# --- 查询功能 (已修改为显示单个剩余电量) ---
+# --- 查询功能 (从多房间数据库中选择房间) ---
 def query_local_data():
-    if not os.path.exists(JSON_DATABASE_FILE):
-        print(f"错误: 数据库文件 '{JSON_DATABASE_FILE}' 不存在。请先执行选项1爬取数据。")
+    store = ElectricityStore(DATABASE_FILE)
+    rooms = store.list_rooms()
+    if not rooms:
+        print(f"错误: 数据库 '{DATABASE_FILE}' 中还没有房间数据。请先执行选项1爬取数据。")
         return
 
-    try:
-        with open(JSON_DATABASE_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
-        print(f"错误: '{JSON_DATABASE_FILE}' 文件不存在、格式不正确或已损坏。")
+    labels = {f"{r['building']} - {r['floor']} - {r['room']}": r for r in rooms}
+    choice = get_user_choice("已保存的房间", labels.keys())
+    if not choice:
         return
+    info = labels[choice]
+    totals = store.get_usage_totals(info["id"])
 
-    info = data.get("info", {})
-    records = data.get("records", [])
-    
-    building = info.get("building", "未知楼栋")
-    floor = info.get("floor", "未知楼层")
-    room = info.get("room", "未知房间")
-    scrape_time = info.get("scrape_time", "未知时间")
+    building = info.get("building") or "未知楼栋"
+    floor = info.get("floor") or "未知楼层"
+    room = info.get("room") or "未知房间"
+    scrape_time = info.get("scrape_time") or "未知时间"
 
     print(f"\n--- 查询结果: {building} - {floor} - {room} ---")
     print(f"--- (数据更新于: {scrape_time}) ---")
 
-    # ==================== 修改：只显示总剩余电量 ====================
     remaining = info.get("remaining_electricity")
 
     if remaining is not None:
         print("\n【当前剩余电量】")
         print(f"  剩余电量: {remaining} 度\n")
-    # ==========================================================
-        
-    if not records:
+
+    if not totals or not totals["days"]:
         print("数据库中没有找到用量记录。")
         return
-        
-    print("【近期用量记录】")
-    print("-" * 75)
-    print(f"{'日期':<12} | {'电表名称':<22} | {'用量(度/吨)':<15} | {'单价(元/度/吨)':<15}")
-    print("-" * 75)
-    for r in records:
-        print(f"{r['date']:<12} | {r['meter_name']:<22} | {r['usage']:<15} | {r['price']:<15}")
-    print("-" * 75)
-    print(f"共找到 {len(records)} 条用量记录。")
-
-# --- 主程序入口 (无变化) ---
+
+    # 汇总均来自入库时维护的每日汇总表，不再逐条读取记录
+    print("【累计用量】")
+    print(f"  {totals['days']} 天共 {totals['usage']:.2f} 度/吨，电费 {totals['cost']:.2f} 元，"
+          f"日均 {totals['average_daily']:.2f} 度/吨\n")
+
+    print("【近期每日用量】")
+    print("-" * 60)
+    print(f"{'日期':<12} | {'用量(度/吨)':<12} | {'其中空调':<12} | {'电费(元)':<10}")
+    print("-" * 60)
+    for day in store.get_daily_rollups(info["id"])[:RECENT_DAYS]:
+        print(f"{day['date']:<12} | {day['usage']:<12.2f} | {day['ac_usage']:<12.2f} | {day['cost']:<10.2f}")
+    print("-" * 60)
+
+    print("\n【每月用量】")
+    print("-" * 60)
+    print(f"{'月份':<12} | {'用量(度/吨)':<12} | {'天数':<6} | {'电费(元)':<10}")
+    print("-" * 60)
+    for month in store.get_period_totals(info["id"], "month"):
+        print(f"{month['period']:<12} | {month['usage']:<12.2f} | {month['days']:<6} | {month['cost']:<10.2f}")
+    print("-" * 60)
+
+# --- 全校批量爬取 (非交互) ---
+class RateLimitedSession(ThrottledSessionMixin, requests.Session):
+    """每次请求前先从共享令牌桶取令牌，并统计总请求数；令牌桶限制平均速率，upstream_throttle 负责失败退避和熔断。"""
+    request_counter = itertools.count(1)
+
+    def __init__(self, bucket):
+        super().__init__()
+        self.bucket = bucket
+        self.headers.update(HEADERS)
+
+    def request(self, *args, **kwargs):
+        self.bucket.acquire()
+        next(self.request_counter)
+        return super().request(*args, **kwargs)
+
+
+def select_floor(session, building_value, floor_value):
+    """GET 首页 -> 选择楼栋 -> 选择楼层，返回选择楼层后的页面 (含房间下拉框和表单字段)。"""
+    response = session.get(LOGIN_URL)
+    response.raise_for_status()
+    page = parse_page(response.text)
+    res_floor = session.post(LOGIN_URL, data={**page.hidden_inputs(), '__EVENTTARGET': 'drlouming', 'drlouming': building_value})
+    res_floor.raise_for_status()
+    page_floor = parse_page(res_floor.text)
+    res_room = session.post(LOGIN_URL, data={**page_floor.hidden_inputs(), '__EVENTTARGET': 'drceng', 'drlouming': building_value, 'drceng': floor_value})
+    res_room.raise_for_status()
+    return parse_page(res_room.text)
+
+
+def enumerate_building(session, initial_form_data, building_text, building_value):
+    # 同一楼栋页面的表单可重复用于选择每个楼层，整栋楼只需 1 + 楼层数 次请求
+    res_floor = session.post(LOGIN_URL, data={**initial_form_data, '__EVENTTARGET': 'drlouming', 'drlouming': building_value})
+    res_floor.raise_for_status()
+    page_floor = parse_page(res_floor.text)
+    floor_form_data = page_floor.hidden_inputs()
+    rooms = []
+    for floor_text, floor_value in parse_options(page_floor, 'drceng').items():
+        res_room = session.post(LOGIN_URL, data={**floor_form_data, '__EVENTTARGET': 'drceng', 'drlouming': building_value, 'drceng': floor_value})
+        res_room.raise_for_status()
+        page_room = parse_page(res_room.text)
+        for room_text, room_value in parse_options(page_room, 'drfangjian').items():
+            rooms.append({
+                "building": building_text, "floor": floor_text, "room": room_text,
+                "building_value": building_value, "floor_value": floor_value, "room_value": room_value
+            })
+    return rooms
+
+
+def room_checkpoint_key(room):
+    return f"{room['building_value']}|{room['floor_value']}|{room['room_value']}"
+
+
+class CampusCrawler:
+    """
+    遍历全校 楼栋 -> 楼层 -> 房间 并逐个爬取，结果写入数据库。
+    每个工作线程使用独立会话，所有线程共用一个令牌桶限速；每完成一个房间就写一次断点文件，
+    中断后用 resume=True 重新运行会跳过已完成的房间。
+    """
+
+    def __init__(self, store, workers=4, rate=5.0, retries=3, days=90, checkpoint_file=CRAWL_CHECKPOINT_FILE,
+                 retry_delay=CRAWL_RETRY_DELAY):
+        self.store = store
+        self.workers = workers
+        self.bucket = TokenBucket(rate, capacity=workers)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.days = days
+        self.checkpoint_file = checkpoint_file
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.checkpoint = None
+
+    def _session(self, reset=False):
+        session = getattr(self._local, 'session', None)
+        if session is None or reset:
+            if session is not None:
+                session.close()
+            session = self._local.session = RateLimitedSession(self.bucket)
+        return session
+
+    def _load_checkpoint(self, resume):
+        if resume and os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            print(f"从断点继续: 已完成 {len(checkpoint['done'])}/{len(checkpoint['rooms'])} 个房间")
+            return checkpoint
+        return None
+
+    def _save_checkpoint(self):
+        # 调用方需持有 self._lock
+        tmp_path = f"{self.checkpoint_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.checkpoint, f, ensure_ascii=False)
+        os.replace(tmp_path, self.checkpoint_file)
+
+    def enumerate_rooms(self, pool):
+        session = self._session()
+        response = session.get(LOGIN_URL)
+        response.raise_for_status()
+        page = parse_page(response.text)
+        initial_form_data = page.hidden_inputs()
+        buildings = parse_options(page, 'drlouming')
+        print(f"共 {len(buildings)} 栋楼，正在获取楼层和房间列表...")
+        futures = [pool.submit(lambda t, v: enumerate_building(self._session(), initial_form_data, t, v), text, value)
+                   for text, value in buildings.items()]
+        rooms = []
+        for future in futures:
+            rooms.extend(future.result())
+        return rooms
+
+    def crawl_room(self, room):
+        room_values = (room['building_value'], room['floor_value'], room['room_value'])
+        for attempt in range(1, self.retries + 1):
+            try:
+                session = self._session(reset=attempt > 1)
+                page_room = select_floor(session, *room_values[:2])
+                start_date, history_start = incremental_start(self.store, room_values, self.days)
+                records, remaining = scrape_room_data(session, *room_values, page_room.hidden_inputs(), start_date)
+                if records is None:
+                    raise RuntimeError("爬取失败")
+                info = {**room, "scrape_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        "history_start": history_start, "history_end": datetime.now().strftime("%Y-%m-%d")}
+                if remaining is not None:
+                    info["remaining_electricity"] = remaining
+                self.store.save_room(info, records, merge=True)
+                return len(records)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                # 每个房间按 retry_delay * 2^(attempt-1) 退避 (带随机抖动，避免多个线程同时重试)，
+                # 与 upstream_throttle 的全局退避叠加：解析失败 (records 为 None) 等上游返回 200 的失败不会被节流器计入；
+                # 熔断时至少等到下一次探测
+                delay = random.uniform(0.5, 1.0) * self.retry_delay * 2 ** (attempt - 1)
+                if isinstance(e, UpstreamUnavailable):
+                    delay = max(delay, e.retry_after)
+                print(f"    [重试] {room['building']} - {room['floor']} - {room['room']} 第 {attempt} 次失败: {e}，{delay:.1f} 秒后重试")
+                time.sleep(delay)
+
+    def run(self, resume=False):
+        start_time = time.time()
+        first_request = next(RateLimitedSession.request_counter)
+        summary = {"ok": 0, "failed": 0, "skipped": 0, "records": 0}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='crawl') as pool:
+            self.checkpoint = self._load_checkpoint(resume)
+            if self.checkpoint is None:
+                rooms = self.enumerate_rooms(pool)
+                self.checkpoint = {"started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                                   "rooms": rooms, "done": [], "failed": {}}
+                with self._lock:
+                    self._save_checkpoint()
+            done = set(self.checkpoint["done"])
+            todo = [room for room in self.checkpoint["rooms"] if room_checkpoint_key(room) not in done]
+            summary["skipped"] = len(self.checkpoint["rooms"]) - len(todo)
+            print(f"共 {len(self.checkpoint['rooms'])} 个房间，本次需爬取 {len(todo)} 个")
+
+            futures = {pool.submit(self.crawl_room, room): room for room in todo}
+            try:
+                for future in as_completed(futures):
+                    room = futures[future]
+                    key = room_checkpoint_key(room)
+                    with self._lock:
+                        try:
+                            summary["records"] += future.result()
+                            summary["ok"] += 1
+                            self.checkpoint["done"].append(key)
+                            self.checkpoint["failed"].pop(key, None)
+                        except Exception as e:
+                            summary["failed"] += 1
+                            self.checkpoint["failed"][key] = str(e)
+                        self._save_checkpoint()
+                        finished = summary["ok"] + summary["failed"]
+                        if finished % 50 == 0:
+                            print(f"进度: {finished}/{len(todo)}，失败 {summary['failed']}")
+            except KeyboardInterrupt:
+                print("\n已中断，正在等待进行中的房间完成；使用 --resume 可从断点继续。")
+                for future in futures:
+                    future.cancel()
+
+        if summary["failed"] == 0 and summary["ok"] == len(todo):
+            os.remove(self.checkpoint_file)
+
+        elapsed = time.time() - start_time
+        requests_sent = next(RateLimitedSession.request_counter) - first_request - 1
+        print("\n===== 批量爬取完成 =====")
+        print(f"成功 {summary['ok']} 个房间，失败 {summary['failed']} 个，断点跳过 {summary['skipped']} 个")
+        print(f"共写入 {summary['records']} 条用量记录，发送 {requests_sent} 个请求")
+        print(f"耗时 {elapsed:.1f} 秒，{summary['ok'] / elapsed if elapsed else 0:.2f} 房间/秒，{requests_sent / elapsed if elapsed else 0:.2f} 请求/秒")
+        if summary["failed"]:
+            print(f"失败房间已记录在 '{self.checkpoint_file}'，使用 --resume 重试。")
+        return summary
+
+# --- 主程序入口 ---
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="电费查询系统")
+    parser.add_argument('--crawl', action='store_true', help="非交互地爬取全校所有房间")
+    parser.add_argument('--resume', action='store_true', help="从上次中断的断点继续")
+    parser.add_argument('--workers', type=int, default=4, help="并发会话数")
+    parser.add_argument('--rate', type=float, default=5.0, help="全局限速 (请求/秒)")
+    parser.add_argument('--retries', type=int, default=3, help="每个房间的最大尝试次数")
+    parser.add_argument('--days', type=int, default=90, help="爬取最近多少天")
+    return parser.parse_args(argv)
+
 def main():
+    args = parse_args(sys.argv[1:])
+    if args.crawl or args.resume:
+        crawler = CampusCrawler(ElectricityStore(DATABASE_FILE), args.workers, args.rate, args.retries, args.days)
+        crawler.run(resume=args.resume)
+        return
+
     while True:
-        print("\n===== 电费查询系统 (单房间数据库版) =====")
+        print("\n===== 电费查询系统 (多房间数据库版) =====")
         print("1. 更新/爬取指定房间的数据(含剩余电量, 近90天)")
         print("2. 查询本地已保存的数据")
-        print("3. 退出")
-        choice = input("请输入你的选择 (1/2/3): ")
+        print("3. 全校批量爬取 (可断点续爬)")
+        print("4. 退出")
+        choice = input("请输入你的选择 (1/2/3/4): ")
 
         if choice == '1':
             start_time = time.time()
@@ -258,6 +463,9 @@ def main():
         elif choice == '2':
             query_local_data()
         elif choice == '3':
+            resume = os.path.exists(CRAWL_CHECKPOINT_FILE) and input("发现未完成的断点，是否继续? (y/n): ").lower() == 'y'
+            CampusCrawler(ElectricityStore(DATABASE_FILE)).run(resume=resume)
+        elif choice == '4':
             print("感谢使用，再见！")
             break
         else:
@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# --- 请求对冲 (hedged requests) ---
+# 对幂等的 GET (首页、结果分页)：首个请求超过该阶段最近延迟的 p95 仍未返回时，再发一个相同的请求，取先返回的结果。
+# 两个请求各用一个复制了 cookie 的兄弟会话发送，获胜者的 cookie 再写回原会话，
+# 落败的请求在后台结束，不会用它的 Set-Cookie 覆盖原会话。
+# 每个请求 (包括对冲请求和落败的请求) 在自己返回时记录自己的耗时，p95 反映的是单个请求的延迟分布，
+# 而不是 "对冲后" 的延迟——否则对冲越多 p95 越低，触发对冲的门槛也会随之下降。
+
+
+class LatencyTracker:
+    """按阶段记录最近 window 次请求的延迟，样本不足 min_samples 时不给出 p95。"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, stage, latency):
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self.window)).append(latency)
+
+    def percentile(self, stage, q=0.95):
+        with self._lock:
+            samples = sorted(self._samples.get(stage, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def snapshot(self):
+        with self._lock:
+            stages = list(self._samples)
+        return {stage: {"p95": self.percentile(stage), "samples": len(self._samples[stage])} for stage in stages}
+
+
+class Hedger:
+    def __init__(self, tracker, session_factory, max_workers=16, min_delay=0.2, default_delay=1.0):
+        """
+        session_factory(session) 返回一个与 session 请求头、cookie 相同但 cookie jar 独立的新会话。
+        对冲等待时间为该阶段的 p95 (不低于 min_delay)；样本不足时使用 default_delay。
+        """
+        self.tracker = tracker
+        self.session_factory = session_factory
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+        self._lock = threading.Lock()
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _attempt(self, session, url, stage, kwargs):
+        sibling = self.session_factory(session)
+        started = time.monotonic()
+        try:
+            response = sibling.get(url, **kwargs)
+        except Exception:
+            sibling.close()
+            raise
+        self.tracker.record(stage, time.monotonic() - started)
+        return response, sibling
+
+    @staticmethod
+    def _discard(future):
+        # 落败的请求结束后关闭它的兄弟会话
+        if not future.cancelled() and future.exception() is None:
+            future.result()[1].close()
+
+    def get(self, session, url, stage, **kwargs):
+        delay = self.tracker.percentile(stage)
+        delay = self.default_delay if delay is None else max(delay, self.min_delay)
+        primary = self._executor.submit(self._attempt, session, url, stage, kwargs)
+        done, _ = wait([primary], timeout=delay)
+        futures = [primary]
+        if not done:
+            with self._lock:
+                self.hedged += 1
+            futures.append(self._executor.submit(self._attempt, session, url, stage, kwargs))
+
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response, sibling = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is not primary:
+                    with self._lock:
+                        self.hedge_wins += 1
+                session.cookies.update(sibling.cookies)
+                sibling.close()
+                for other in futures:
+                    if other is not future:
+                        other.add_done_callback(self._discard)
+                return response
+        raise error
+
+    def snapshot(self):
+        with self._lock:
+            return {"hedged": self.hedged, "hedge_wins": self.hedge_wins, "latency": self.tracker.snapshot()}
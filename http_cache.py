@@ -0,0 +1,103 @@
+import gzip
+import hashlib
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+try:
+    import brotli
+except ImportError:  # 未安装 brotli 时只使用 gzip
+    brotli = None
+
+# --- HTTP 条件缓存与压缩 ---
+# 房间数据 (/api/query、/api/stats) 的版本由 rooms.scrape_time 决定：ETag 由 scrape_time 与请求参数计算，
+# 不需要先读出记录；客户端带 If-None-Match / If-Modified-Since 重复请求时直接返回 304，只传输响应头。
+# 选项列表 (/api/options) 按内容哈希生成 ETag，并允许浏览器缓存 OPTIONS_MAX_AGE 秒。
+# ETag 使用弱校验 (W/"...")，同一份内容的 gzip / br / 未压缩版本共用一个 ETag。
+# 文本类响应超过 COMPRESS_MIN_SIZE 字节时按 Accept-Encoding 压缩 (优先 br，其次 gzip)。
+# 这里只放与框架无关的逻辑，Flask (app.py) 与 ASGI (asgi.py) 各自调用。
+
+OPTIONS_MAX_AGE = int(os.environ.get('OPTIONS_MAX_AGE', 3600))
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 512))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+
+CACHE_POLICIES = {
+    # 选项列表很少变化：直接缓存，过期后凭 ETag 重新验证
+    'options': f'public, max-age={OPTIONS_MAX_AGE}',
+    # 房间数据：浏览器可以保存，但每次使用前都要重新验证 (未变化时得到 304)
+    'room': 'private, no-cache',
+    # 运行状态、刷新操作等不缓存
+    'none': 'no-store',
+}
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/css', 'text/plain', 'application/javascript',
+                      'text/javascript')
+
+
+def make_etag(*parts):
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def content_etag(body):
+    return make_etag(hashlib.sha1(body).hexdigest())
+
+
+def http_date(timestamp):
+    """'YYYY-MM-DD HH:MM:SS' (服务器本地时间) -> HTTP 日期，无法解析时返回 None。"""
+    try:
+        local_time = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").astimezone()
+    except (TypeError, ValueError):
+        return None
+    return format_datetime(local_time.astimezone(timezone.utc), usegmt=True)
+
+
+def _strip_weak(tag):
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def is_not_modified(if_none_match, if_modified_since, etag, last_modified=None):
+    """按 RFC 7232 判断能否返回 304：有 If-None-Match 时只比较 ETag (弱比较)，否则比较 If-Modified-Since。"""
+    if if_none_match:
+        if if_none_match.strip() == '*':
+            return True
+        return _strip_weak(etag) in {_strip_weak(tag) for tag in if_none_match.split(',')}
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cache_headers(etag, last_modified=None, policy='room'):
+    headers = {'ETag': etag, 'Cache-Control': CACHE_POLICIES[policy]}
+    if last_modified:
+        headers['Last-Modified'] = last_modified
+    return headers
+
+
+def choose_encoding(accept_encoding):
+    """按 Accept-Encoding 选择压缩方式 ('br' / 'gzip')，都不接受时返回 None。"""
+    accepted = set()
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and ('br' in accepted or '*' in accepted):
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=min(COMPRESS_LEVEL, 11))
+    return gzip.compress(body, compresslevel=min(COMPRESS_LEVEL, 9))
+
+
+def should_compress(content_type, size, content_encoding=None):
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    return not content_encoding and size >= COMPRESS_MIN_SIZE and mimetype in COMPRESSIBLE_TYPES
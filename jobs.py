@@ -0,0 +1,142 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from logs import get_logger
+from metrics import JOBS
+
+# --- 异步刷新任务 ---
+# POST /api/jobs 只登记任务并立即返回任务 id，实际爬取在本进程的线程池中进行，HTTP worker 不再被长时间占用；
+# GET /api/jobs/<id> 返回状态 (queued / running / done / failed)、分页进度和结果。
+# 任务保存在数据库 (storage.jobs) 中，多 worker 部署时任一 worker 都能查询；
+# 同一房间、同一日期范围已有未完成的任务时直接返回该任务 (去重 key 由调用方按房间 + 日期范围生成)；
+# 日期范围不同的任务各自执行，返回的任务与请求的范围总是一致。
+# 登记任务的进程在任务排队和执行期间每 stale_after / 3 秒刷新一次心跳 (updated_at)，排队等待线程池的任务也不会被误判；
+# 进程退出后心跳停止：超过 stale_after 秒没有更新的任务视为中断，查询时标记为 failed，也不再参与去重。
+# 已结束 (done / failed) 的任务不会再被改回 running 或 done：被标记为中断的任务即使之后轮到执行也直接跳过。
+
+JOB_CONCURRENCY = int(os.environ.get('JOB_CONCURRENCY', 2))
+JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', 300))
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 24 * 3600))
+
+ACTIVE_STATES = ('queued', 'running')
+
+log = get_logger('jobs')
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S") if timestamp else None
+
+
+class JobRunner:
+    def __init__(self, store, run_fn, max_concurrency=JOB_CONCURRENCY, stale_after=JOB_STALE_AFTER,
+                 retention=JOB_RETENTION):
+        """
+        run_fn(target, start_date, end_date, on_progress) 执行一次爬取并返回 (info, 错误信息)，
+        on_progress(已完成页数, 已知总页数, 已解析记录数) 在每解析完一页时调用。
+        """
+        self.store = store
+        self.run_fn = run_fn
+        self.stale_after = stale_after
+        self.retention = retention
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._active = set()
+        self._heartbeat = None
+
+    def submit(self, job_key, target, start_date, end_date):
+        """登记并排队一个任务，返回 (任务, 是否新建)；job_key 相同 (同一房间和日期范围) 的未完成任务存在时返回该任务。"""
+        now = time.time()
+        self.store.prune_jobs(now - self.retention)
+        job, created = self.store.create_job(uuid.uuid4().hex, job_key, target, start_date, end_date,
+                                             now - self.stale_after, self.owner)
+        JOBS.inc(event='created' if created else 'deduplicated')
+        if created:
+            log.info('job.queued', job=job['id'], key=job_key, start_date=start_date, end_date=end_date)
+            self._track(job['id'])
+            self._executor.submit(self._run, job['id'], target, start_date, end_date)
+        return job, created
+
+    def _track(self, job_id):
+        with self._lock:
+            self._active.add(job_id)
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._heartbeat_loop, name='job-heartbeat', daemon=True)
+                self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.stale_after / 3)
+            with self._lock:
+                job_ids = list(self._active)
+            try:
+                self.store.heartbeat_jobs(job_ids)
+            except Exception as e:
+                log.exception('job.heartbeat_error', error=str(e))
+
+    def get(self, job_id):
+        job = self.store.get_job(job_id)
+        if job and job['status'] in ACTIVE_STATES and time.time() - job['updated_at'] > self.stale_after:
+            self._finish(job_id, 'failed', error="任务已中断 (执行任务的进程已退出)")
+            job = self.store.get_job(job_id)
+        return job
+
+    def _finish(self, job_id, status, **fields):
+        if self.store.update_job(job_id, status=status, finished_at=time.time(), **fields):
+            JOBS.inc(event=status)
+
+    def _run(self, job_id, target, start_date, end_date):
+        try:
+            self._execute(job_id, target, start_date, end_date)
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+    def _execute(self, job_id, target, start_date, end_date):
+        if not self.store.update_job(job_id, status='running'):
+            # 排队期间已被标记为中断 (或已由其他途径结束)
+            log.warning('job.skipped', job=job_id)
+            return
+
+        def on_progress(pages_done, pages_total, record_count):
+            self.store.update_job(job_id, pages_done=pages_done, pages_total=pages_total, record_count=record_count)
+
+        try:
+            info, error = self.run_fn(target, start_date, end_date, on_progress)
+        except Exception as e:
+            log.exception('job.error', job=job_id, error=str(e))
+            self._finish(job_id, 'failed', error=str(e))
+            return
+        if error:
+            log.warning('job.failed', job=job_id, error=error)
+            self._finish(job_id, 'failed', error=error)
+            return
+        log.info('job.done', job=job_id, room_id=info['id'])
+        self._finish(job_id, 'done', result={
+            "room_id": info['id'],
+            "info": {key: info.get(key) for key in ('building', 'floor', 'room', 'scrape_time')},
+            "remaining_electricity": info.get('remaining_electricity'),
+        })
+
+
+def job_payload(job):
+    """任务的 API 表示。"""
+    return {
+        "id": job['id'],
+        "status": job['status'],
+        "room": {key: job['target'].get(key) for key in ('building', 'floor', 'room')},
+        "start_date": job['start_date'],
+        "end_date": job['end_date'],
+        "progress": {"pages_done": job['pages_done'], "pages_total": job['pages_total'],
+                     "records": job['record_count']},
+        "result": job['result'],
+        "error": job['error'],
+        "created_at": _iso(job['created_at']),
+        "updated_at": _iso(job['updated_at']),
+        "finished_at": _iso(job['finished_at']),
+    }
@@ -0,0 +1,99 @@
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+# --- 结构化日志 ---
+# 替代原来散落在请求路径上的 print：每条日志是一个事件名加若干字段 (log.info('scrape.done', records=180))，
+# 按 LOG_LEVEL 过滤，按 LOG_FORMAT 输出 key=value 文本或 JSON 行 (写到 stderr)。
+# 级别未开启时在构造日志记录之前就返回，字段只在真正输出时才格式化，关闭的日志几乎没有开销。
+# 请求路径上每次都会触发的事件 (缓存命中、每个分页) 以 sample=LOG_SAMPLE_RATE 抽样输出，JSON 中带 sample_rate 字段。
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # text | json
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.1))
+
+ROOT_LOGGER = 'electricity'
+
+
+def _text_value(value):
+    if isinstance(value, str):
+        return value if value and ' ' not in value and '=' not in value else json.dumps(value, ensure_ascii=False)
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return json.dumps(value, ensure_ascii=False, default=str) if isinstance(value, (list, tuple, dict)) else str(value)
+
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, fmt=LOG_FORMAT):
+        super().__init__()
+        self.fmt = fmt
+
+    def format(self, record):
+        fields = dict(getattr(record, 'fields', {}))
+        sample = getattr(record, 'sample', 1.0)
+        if sample < 1.0:
+            fields['sample_rate'] = sample
+        if record.exc_info:
+            fields['exc'] = self.formatException(record.exc_info)
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))
+        logger = record.name[len(ROOT_LOGGER) + 1:] or record.name
+        if self.fmt == 'json':
+            return json.dumps({"ts": timestamp, "level": record.levelname.lower(), "logger": logger,
+                               "event": record.getMessage(), **fields}, ensure_ascii=False, default=str)
+        line = ' '.join(f"{key}={_text_value(value)}" for key, value in fields.items() if key != 'exc')
+        text = f"{timestamp} {record.levelname:<7} {logger} {record.getMessage()} {line}".rstrip()
+        return f"{text}\n{fields['exc']}" if 'exc' in fields else text
+
+
+class StructuredLogger:
+    """log.info(事件名, sample=抽样比例, **字段)；exception() 附带当前异常的堆栈。"""
+
+    def __init__(self, name):
+        self._logger = logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+    def enabled(self, level):
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level, event, sample, fields, exc_info=False):
+        if not self._logger.isEnabledFor(level):
+            return
+        if sample < 1.0 and random.random() >= sample:
+            return
+        self._logger.log(level, event, extra={'fields': fields, 'sample': sample}, exc_info=exc_info)
+
+    def debug(self, event, sample=1.0, **fields):
+        self._log(logging.DEBUG, event, sample, fields)
+
+    def info(self, event, sample=1.0, **fields):
+        self._log(logging.INFO, event, sample, fields)
+
+    def warning(self, event, sample=1.0, **fields):
+        self._log(logging.WARNING, event, sample, fields)
+
+    def error(self, event, sample=1.0, **fields):
+        self._log(logging.ERROR, event, sample, fields)
+
+    def exception(self, event, **fields):
+        self._log(logging.ERROR, event, 1.0, fields, exc_info=True)
+
+
+def _configure():
+    root = logging.getLogger(ROOT_LOGGER)
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(StructuredFormatter())
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    # 不再交给根 logger，避免与框架的日志配置重复输出
+    root.propagate = False
+
+
+def get_logger(name):
+    return StructuredLogger(name)
+
+
+_configure()
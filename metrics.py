@@ -0,0 +1,190 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# --- Prometheus 指标 ---
+# GET /metrics 以 Prometheus 文本格式 (0.0.4) 输出本进程的指标，不依赖 prometheus_client。
+# 指标在进程内累计：多 worker 部署时每个进程各自暴露一份，由 Prometheus 按实例抓取后汇总。
+#   electricity_upstream_request_duration_seconds  每个上游回发阶段的耗时直方图
+#       stage: login (GET 首页) / building / floor (选择楼栋、楼层的回发) / room (选择房间) / query (查询结果首页) / page (每个分页)
+#   electricity_upstream_requests_total            上游请求数，outcome: ok / http_4xx / http_5xx / timeout / connection_error / circuit_open / error
+#   electricity_parse_duration_seconds             页面解析耗时 (engine: lxml / bs4，@process 表示在解析进程池中完成)
+#   electricity_cache_lookups_total                房间缓存查找结果，endpoint 为接口，result: hit / stale / miss
+#   electricity_scrapes_in_flight                  正在进行的房间爬取数 (mode: sync / async)
+#   electricity_scrape_duration_seconds            单次房间爬取 (含回发和全部分页) 的总耗时
+#   electricity_jobs_total                         异步刷新任务 (event: created / deduplicated / done / failed)
+#   electricity_balance_checks_total               余额批量刷新的房间数 (outcome: ok / error)
+#   electricity_watchlist_alerts                   最近一次批量刷新后处于告警状态的监控房间数
+#   electricity_upstream_pool_events_total         共享连接池事件 (event: requests 请求数 / connections 新建连接即握手次数 /
+#                                                  idle_closed 空闲超时关闭)；连接复用率为
+#                                                  1 - rate(...{event="connections"}) / rate(...{event="requests"})
+# 以及在抓取时从熔断器读出的状态 (electricity_upstream_*)。
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30)
+PARSE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+SCRAPE_BUCKETS = (0.5, 1, 2, 5, 10, 20, 40, 80, 160)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = [*zip(self.labelnames, key), *extra]
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, self._copy(value)) for key, value in self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    def _samples(self, key, value):
+        yield f"{self.name}{self._labels(key)} {_number(value)}"
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track(self, **labels):
+        """with 块执行期间计数加一。"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=UPSTREAM_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [各桶计数 (非累计，最后一个为 +Inf), 总和, 次数]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[2] if state else 0
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+    def _samples(self, key, value):
+        counts, total, count = value
+        cumulative = 0
+        for bound, bucket_count in zip((*self.buckets, float('inf')), counts):
+            cumulative += bucket_count
+            yield f"{self.name}_bucket{self._labels(key, [('le', _number(bound))])} {cumulative}"
+        yield f"{self.name}_sum{self._labels(key)} {_number(total)}"
+        yield f"{self.name}_count{self._labels(key)} {count}"
+
+
+def render_metrics():
+    return '\n'.join(line for metric in REGISTRY for line in metric.render()) + '\n'
+
+
+UPSTREAM_SECONDS = Histogram('electricity_upstream_request_duration_seconds', '上游请求耗时 (按回发阶段)',
+                             ('stage',), UPSTREAM_BUCKETS)
+UPSTREAM_REQUESTS = Counter('electricity_upstream_requests_total', '上游请求数 (按回发阶段和结果)', ('stage', 'outcome'))
+PARSE_SECONDS = Histogram('electricity_parse_duration_seconds', '上游页面解析耗时', ('engine',), PARSE_BUCKETS)
+CACHE_LOOKUPS = Counter('electricity_cache_lookups_total', '房间缓存查找结果 (hit / stale / miss)', ('endpoint', 'result'))
+SCRAPES_IN_FLIGHT = Gauge('electricity_scrapes_in_flight', '正在进行的房间爬取数', ('mode',))
+SCRAPE_SECONDS = Histogram('electricity_scrape_duration_seconds', '单次房间爬取总耗时', ('mode', 'outcome'),
+                           SCRAPE_BUCKETS)
+JOBS = Counter('electricity_jobs_total', '异步刷新任务事件数 (created / deduplicated / done / failed)', ('event',))
+BALANCE_CHECKS = Counter('electricity_balance_checks_total', '余额批量刷新的房间数 (ok / error)', ('outcome',))
+WATCHLIST_ALERTS = Gauge('electricity_watchlist_alerts', '处于低余额告警状态的监控房间数')
+UPSTREAM_POOL_EVENTS = Counter('electricity_upstream_pool_events_total',
+                               '上游连接池事件数 (requests / connections / idle_closed)', ('event',))
+CIRCUIT_OPEN = Gauge('electricity_upstream_circuit_open', '上游熔断状态 (1 为熔断或探测中)')
+THROTTLE_DELAY = Gauge('electricity_upstream_throttle_delay_seconds', '当前上游退避间隔上限 (秒)')
@@ -0,0 +1,104 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from logs import get_logger
+
+# --- 并发分页 ---
+# 查询结果首页返回后，第 2..N 页原本在同一会话中逐页顺序获取，耗时与页数成正比。
+# 这里按 PAGE_FANOUT 的并发度同时获取剩余分页 (使用复制了 cookie 的兄弟会话)，再按页码顺序拼接。
+# 若上游的分页依赖服务端会话状态 (如并发请求得到重复页、空页或总页数不一致)，
+# 从出问题的那一页起回退到原会话中逐页顺序获取。PAGE_FANOUT=1 时始终顺序获取。
+# iter_pages 按页码顺序逐页产出 (供流式响应边取边发)，fetch_all_records 在其基础上一次性返回全部记录。
+
+PAGE_FANOUT = int(os.environ.get('PAGE_FANOUT', 4))
+
+log = get_logger('pagination')
+
+
+def _records_key(records):
+    return tuple(tuple(sorted(r.items())) for r in records)
+
+
+class PageChecker:
+    """
+    按页码顺序逐页检查并发获取的第 2..N 页是否像是独立、正确的分页：
+    总页数与首页一致、除最后一页外都有记录、不同页的记录互不相同。
+    """
+
+    def __init__(self, first_page):
+        self.total_pages = first_page.total_pages()
+        self.seen = {_records_key(first_page.records())}
+
+    def accept(self, page_num, page):
+        records = page.records()
+        if page.total_pages() != self.total_pages:
+            return False
+        if not records and page_num < self.total_pages:
+            return False
+        key = _records_key(records)
+        if records and key in self.seen:
+            return False
+        self.seen.add(key)
+        return True
+
+
+def pages_consistent(first_page, pages):
+    """pages 为第 2..N 页的解析结果 (按页码排列)，检查规则见 PageChecker。"""
+    checker = PageChecker(first_page)
+    return all(checker.accept(page_num, page) for page_num, page in enumerate(pages, start=2))
+
+
+def _merge(first_page, pages):
+    records = first_page.records()
+    for page in pages:
+        records.extend(page.records())
+    return records
+
+
+def iter_pages(first_page, fetch_concurrent, fetch_sequential, fanout=PAGE_FANOUT):
+    """
+    按页码顺序逐页产出第 2..N 页。fetch_concurrent(page_num) 用兄弟会话获取一页，
+    fetch_sequential(page_num) 在原会话中获取一页，两者都返回解析后的页面。
+    """
+    total_pages = first_page.total_pages()
+    next_page = 2
+    if fanout > 1 and total_pages > 2:
+        page_nums = range(2, total_pages + 1)
+        checker = PageChecker(first_page)
+        with ThreadPoolExecutor(max_workers=min(fanout, len(page_nums)), thread_name_prefix='page') as pool:
+            # map 按提交顺序返回结果，即页码顺序
+            for page_num, page in zip(page_nums, pool.map(fetch_concurrent, page_nums)):
+                if not checker.accept(page_num, page):
+                    # 上游分页依赖会话状态
+                    log.warning('pages.inconsistent', page=page_num, total_pages=total_pages, fallback='sequential')
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    break
+                next_page = page_num + 1
+                yield page
+    for page_num in range(next_page, total_pages + 1):
+        yield fetch_sequential(page_num)
+
+
+def fetch_all_records(first_page, fetch_concurrent, fetch_sequential, fanout=PAGE_FANOUT):
+    """返回按页码排列的全部记录，参数同 iter_pages。"""
+    return _merge(first_page, iter_pages(first_page, fetch_concurrent, fetch_sequential, fanout))
+
+
+async def fetch_all_records_async(first_page, fetch_concurrent, fetch_sequential, fanout=PAGE_FANOUT):
+    """fetch_all_records 的协程版本，fetch_concurrent / fetch_sequential 为协程函数。"""
+    page_nums = range(2, first_page.total_pages() + 1)
+    if not page_nums:
+        return first_page.records()
+    if fanout > 1 and len(page_nums) > 1:
+        slots = asyncio.Semaphore(fanout)
+
+        async def bounded(page_num):
+            async with slots:
+                return await fetch_concurrent(page_num)
+
+        pages = await asyncio.gather(*(bounded(page_num) for page_num in page_nums))
+        if pages_consistent(first_page, pages):
+            return _merge(first_page, pages)
+        log.warning('pages.inconsistent', total_pages=first_page.total_pages(), fallback='sequential')
+    return _merge(first_page, [await fetch_sequential(page_num) for page_num in page_nums])
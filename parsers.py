@@ -0,0 +1,264 @@
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from bs4 import BeautifulSoup
+
+from metrics import PARSE_SECONDS
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:  # lxml 不可用时只能使用 BeautifulSoup
+    lxml = None
+
+# --- 页面解析引擎 ---
+# 上游页面只需要提取几类固定结构：隐藏表单字段、<select> 选项、h6 中的剩余电量、分页器总页数、用量记录行。
+# LxmlPage 用 XPath 直接定位这些节点；Bs4Page 保留原来的 BeautifulSoup(html.parser) 实现作为后备。
+# 两者输出完全一致，可通过环境变量 PARSER_ENGINE=lxml|bs4 切换 (默认 lxml)。
+
+PARSER_ENGINE = os.environ.get('PARSER_ENGINE', 'lxml')
+# PARSE_MODE=thread 在请求线程内解析；PARSE_MODE=process 把解析交给子进程池，避免大页面解析占住 GIL 拖慢同进程的其他请求
+PARSE_MODE = os.environ.get('PARSE_MODE', 'thread')
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', os.cpu_count() or 2))
+SELECT_IDS = ('drlouming', 'drceng', 'drfangjian')
+PAGE_COUNT_PATTERN = re.compile(r'共\s*(\d+)\s*页')
+
+
+def _class_xpath(class_name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')"
+
+
+RECORD_ROWS_XPATH = f"//table[{_class_xpath('dataTable')}]//tr[{_class_xpath('contentLine')}]"
+
+
+class Bs4Page:
+    engine = 'bs4'
+
+    def __init__(self, html):
+        self.soup = BeautifulSoup(html, 'html.parser')
+
+    def hidden_inputs(self):
+        form_data = {}
+        for input_tag in self.soup.find_all('input', {'type': 'hidden'}):
+            name = input_tag.get('name')
+            value = input_tag.get('value', '')
+            if name:
+                form_data[name] = value
+        return form_data
+
+    def has_select(self, select_id):
+        return self.soup.find('select', {'id': select_id}) is not None
+
+    def select_options(self, select_id):
+        select_tag = self.soup.find('select', {'id': select_id})
+        if not select_tag:
+            return []
+        options = []
+        for option in select_tag.find_all('option')[1:]:
+            value = option.get('value')
+            text = option.text.strip()
+            if value and text:
+                options.append({"text": text, "value": value})
+        return options
+
+    def remaining(self):
+        h6_tag = self.soup.find('h6')
+        if h6_tag:
+            spans = h6_tag.find_all('span', class_='number orange')
+            if len(spans) == 3:
+                return spans[2].text.strip()
+        return None
+
+    def total_pages(self):
+        pageer_div = self.soup.find('div', class_='pageer')
+        if pageer_div:
+            match = PAGE_COUNT_PATTERN.search(pageer_div.text)
+            if match:
+                return int(match.group(1))
+        return 1
+
+    def records(self):
+        records = []
+        for row in self.soup.select('table.dataTable tr.contentLine'):
+            cols = [td.text.strip() for td in row.find_all('td')]
+            if len(cols) == 4:
+                records.append({
+                    "date": cols[0],
+                    "meter_name": cols[1],
+                    "usage": cols[2],
+                    "price": cols[3]
+                })
+        return records
+
+    def text(self):
+        return self.soup.get_text()
+
+
+class LxmlPage:
+    engine = 'lxml'
+
+    def __init__(self, html):
+        self.root = lxml.html.fromstring(html)
+
+    def hidden_inputs(self):
+        form_data = {}
+        for input_tag in self.root.xpath("//input[@type='hidden']"):
+            name = input_tag.get('name')
+            if name:
+                form_data[name] = input_tag.get('value', '')
+        return form_data
+
+    def _select(self, select_id):
+        selects = self.root.xpath("//select[@id=$id]", id=select_id)
+        return selects[0] if selects else None
+
+    def has_select(self, select_id):
+        return self._select(select_id) is not None
+
+    def select_options(self, select_id):
+        select_tag = self._select(select_id)
+        if select_tag is None:
+            return []
+        options = []
+        for option in select_tag.xpath(".//option")[1:]:
+            value = option.get('value')
+            text = option.text_content().strip()
+            if value and text:
+                options.append({"text": text, "value": value})
+        return options
+
+    def remaining(self):
+        h6_tags = self.root.xpath("//h6")
+        if h6_tags:
+            spans = h6_tags[0].xpath(".//span[@class='number orange']")
+            if len(spans) == 3:
+                return spans[2].text_content().strip()
+        return None
+
+    def total_pages(self):
+        pageer_divs = self.root.xpath(f"//div[{_class_xpath('pageer')}]")
+        if pageer_divs:
+            match = PAGE_COUNT_PATTERN.search(pageer_divs[0].text_content())
+            if match:
+                return int(match.group(1))
+        return 1
+
+    def records(self):
+        records = []
+        for row in self.root.xpath(RECORD_ROWS_XPATH):
+            cols = [td.text_content().strip() for td in row.xpath(".//td")]
+            if len(cols) == 4:
+                records.append({
+                    "date": cols[0],
+                    "meter_name": cols[1],
+                    "usage": cols[2],
+                    "price": cols[3]
+                })
+        return records
+
+    def text(self):
+        return self.root.text_content()
+
+
+def _build_page(html, engine=None):
+    """按配置的引擎解析页面；lxml 不可用或解析失败 (如空文档) 时退回 BeautifulSoup。"""
+    engine = engine or PARSER_ENGINE
+    if engine == 'lxml' and lxml is not None:
+        try:
+            return LxmlPage(html)
+        except (etree.ParserError, ValueError):
+            pass
+    return Bs4Page(html)
+
+
+def extract_page(html, engine=None):
+    """在解析进程中执行：一次性提取页面上所有需要的结构，返回可 pickle 的 dict。"""
+    page = _build_page(html, engine)
+    return {
+        "engine": page.engine,
+        "hidden_inputs": page.hidden_inputs(),
+        "selects": {select_id: page.select_options(select_id) for select_id in SELECT_IDS if page.has_select(select_id)},
+        "remaining": page.remaining(),
+        "total_pages": page.total_pages(),
+        "records": page.records(),
+    }
+
+
+class ExtractedPage:
+    """extract_page 结果的只读包装，接口与 LxmlPage / Bs4Page 相同。"""
+
+    def __init__(self, html, data):
+        self.html = html
+        self.data = data
+        self.engine = f"{data['engine']}@process"
+
+    def hidden_inputs(self):
+        return dict(self.data["hidden_inputs"])
+
+    def has_select(self, select_id):
+        return select_id in self.data["selects"]
+
+    def select_options(self, select_id):
+        return list(self.data["selects"].get(select_id, []))
+
+    def remaining(self):
+        return self.data["remaining"]
+
+    def total_pages(self):
+        return self.data["total_pages"]
+
+    def records(self):
+        return list(self.data["records"])
+
+    def text(self):
+        # 仅用于出错时打印页面预览，直接在当前线程解析
+        return _build_page(self.html).text()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _parse_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn 启动的子进程不继承父进程的线程和数据库连接，但会以 __mp_main__ 的名义重新执行入口模块
+            # (python app.py 时即 app.py)：app 在 multiprocessing 子进程中不启动后台调度 (见 SCHEDULER_ENABLED)
+            _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False)
+
+
+def parse_page(html, engine=None, mode=None):
+    """
+    解析上游页面。网络请求始终在调用线程中完成，这里只决定解析在哪里执行：
+    mode (默认 PARSE_MODE) 为 'process' 时把原始 HTML 发给解析进程池，只取回提取出的结构；
+    进程池异常退出时重建进程池，本次改为在当前线程解析。耗时按引擎记入 electricity_parse_duration_seconds。
+    """
+    start = time.perf_counter()
+    page = _parse(html, engine, mode or PARSE_MODE)
+    PARSE_SECONDS.observe(time.perf_counter() - start, engine=page.engine)
+    return page
+
+
+def _parse(html, engine, mode):
+    if mode == 'process':
+        pool = _parse_pool()
+        try:
+            return ExtractedPage(html, pool.submit(extract_page, html, engine).result())
+        except BrokenProcessPool:
+            _reset_pool(pool)
+    return _build_page(html, engine)
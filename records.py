@@ -0,0 +1,108 @@
+import sys
+from array import array
+from datetime import date
+from functools import lru_cache
+
+# --- 列式用量记录 ---
+# 上游页面解析出的记录是字符串字典 {"date", "meter_name", "usage", "price"}。
+# 爬取完成后立即转换为 RecordColumns：日期存为序数 (array 'i')，用量和单价存为 array 'd'，
+# 电表名称做字典编码 (每条记录只存一个编号，名称本身经 sys.intern 全进程共享)。
+# 存储、切片、统计都直接使用列数据，只在 API 边界 (rows / to_json) 才还原成字典。
+
+
+def parse_number(value):
+    """把上游的数字字符串解析为 float；已经是数字时原样返回，无法解析时返回 None。"""
+    if value is None or isinstance(value, float):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value):
+    """'YYYY-MM-DD' (可带时间) -> 日期序数，无法解析时返回 None。"""
+    try:
+        return date.fromisoformat(value[:10]).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=4096)
+def iso_date(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+
+class RecordColumns:
+    __slots__ = ('ordinals', 'usages', 'prices', 'meter_codes', 'meters', '_meter_index')
+
+    def __init__(self):
+        self.ordinals = array('i')
+        self.usages = array('d')
+        self.prices = array('d')
+        self.meter_codes = array('i')
+        self.meters = []
+        self._meter_index = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        """从记录字典 (字符串或数字均可) 构建；日期无法解析的记录丢弃。已是 RecordColumns 时原样返回。"""
+        if isinstance(rows, cls):
+            return rows
+        columns = cls()
+        for r in rows:
+            ordinal = parse_date(r['date'])
+            if ordinal is not None:
+                columns.append(ordinal, r['meter_name'], parse_number(r['usage']) or 0.0,
+                               parse_number(r['price']) or 0.0)
+        return columns
+
+    def meter_code(self, meter_name):
+        code = self._meter_index.get(meter_name)
+        if code is None:
+            code = self._meter_index[meter_name] = len(self.meters)
+            self.meters.append(sys.intern(meter_name))
+        return code
+
+    def append(self, ordinal, meter_name, usage, price):
+        self.ordinals.append(ordinal)
+        self.meter_codes.append(self.meter_code(meter_name))
+        self.usages.append(usage)
+        self.prices.append(price)
+
+    def extend(self, other):
+        for ordinal, code, usage, price in zip(other.ordinals, other.meter_codes, other.usages, other.prices):
+            self.append(ordinal, other.meters[code], usage, price)
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def where(self, keep):
+        """返回日期序数满足 keep(ordinal) 的记录，顺序不变。"""
+        result = RecordColumns()
+        for ordinal, code, usage, price in zip(self.ordinals, self.meter_codes, self.usages, self.prices):
+            if keep(ordinal):
+                result.append(ordinal, self.meters[code], usage, price)
+        return result
+
+    def slice(self, start_date=None, end_date=None):
+        """返回 [start_date, end_date] (ISO 日期，含两端，None 表示不限) 内的记录，顺序不变。"""
+        low = parse_date(start_date) if start_date else None
+        high = parse_date(end_date) if end_date else None
+        return self.where(lambda ordinal: (low is None or ordinal >= low) and (high is None or ordinal <= high))
+
+    def db_rows(self, room_id):
+        """写入 SQLite records 表的参数元组。"""
+        meters = self.meters
+        return [(room_id, iso_date(ordinal), meters[code], usage, price)
+                for ordinal, code, usage, price in zip(self.ordinals, self.meter_codes, self.usages, self.prices)]
+
+    def rows(self):
+        meters = self.meters
+        for ordinal, code, usage, price in zip(self.ordinals, self.meter_codes, self.usages, self.prices):
+            yield {"date": iso_date(ordinal), "meter_name": meters[code], "usage": usage, "price": price}
+
+    def to_json(self):
+        """API 边界：转换为可直接 jsonify 的记录列表。"""
+        return list(self.rows())
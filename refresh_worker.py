@@ -0,0 +1,13 @@
+import os
+
+# 独立的后台刷新进程：Web 进程设置 SCHEDULER_ENABLED=0 后，由本进程统一刷新活跃房间和监控房间的余额
+os.environ['SCHEDULER_ENABLED'] = '0'
+
+from app import WATCHLIST_ENABLED, balance_refresher, refresh_scheduler  # noqa: E402
+from logs import get_logger  # noqa: E402
+
+if __name__ == '__main__':
+    get_logger('refresh_worker').info('started')
+    if WATCHLIST_ENABLED:
+        balance_refresher.start()
+    refresh_scheduler.run_forever()
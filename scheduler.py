@@ -0,0 +1,125 @@
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from logs import get_logger
+
+# --- 后台刷新调度 ---
+# 周期性挑选最近有人查询过的房间，在缓存过期前提前刷新，查询请求因此几乎总能命中缓存；
+# 查询命中过期缓存时也通过 trigger() 异步刷新，请求本身立即返回旧数据。
+# 所有后台刷新共用一个线程池，max_concurrency 即后台任务对上游的并发预算。
+# 刷新失败的房间记录失败次数和时间 (storage.record_refresh_failure)，之后按 retry_base * 2^(失败次数-1)
+# (不超过 retry_max) 退避，不会每个 tick 都重新提交；成功爬取一次后清零。
+# 每个 gunicorn worker 都会启动调度线程，周期扫描通过数据库锁 (有效期一个 tick，不主动释放) 保证
+# 同一个 tick 内只有一个进程挑选并提交到期房间。
+
+log = get_logger('scheduler')
+
+
+def _room_key(target):
+    return tuple(target.get(f"{level}_value") or target.get(level) for level in ('building', 'floor', 'room'))
+
+
+class RefreshScheduler:
+    def __init__(self, store, refresh_fn, default_interval, active_window, max_concurrency=2, tick=60, lead=0.8,
+                 retry_base=60, retry_max=3600):
+        """
+        refresh_fn(target, start_date, end_date) 执行一次实际刷新，返回错误信息 (成功时为 None)；日期为 None 时使用默认范围。
+        房间在 scrape_time 之后经过 lead * 刷新间隔 即被视为需要刷新。
+        """
+        self.store = store
+        self.refresh_fn = refresh_fn
+        self.default_interval = default_interval
+        self.active_window = active_window
+        self.tick = tick
+        self.lead = lead
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='refresh')
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def trigger(self, target, start_date=None, end_date=None):
+        """提交一次异步刷新；同一房间已在队列或刷新中时忽略，返回是否提交。"""
+        key = _room_key(target)
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+        self._executor.submit(self._run, key, dict(target), start_date, end_date)
+        return True
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self, key, target, start_date, end_date):
+        try:
+            error = self.refresh_fn(target, start_date, end_date)
+        except Exception as e:
+            log.exception('refresh.error', key=key, error=str(e))
+            error = str(e)
+        try:
+            if error and target.get('id'):
+                self.store.record_refresh_failure(target['id'], datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        except Exception as e:
+            log.exception('refresh.record_error', key=key, error=str(e))
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def retry_delay(self, failures):
+        """连续失败 failures 次后距下一次重试的秒数。"""
+        return min(self.retry_base * 2 ** (failures - 1), self.retry_max)
+
+    def due_rooms(self, now=None):
+        now = now or datetime.now()
+        active_since = (now - timedelta(seconds=self.active_window)).strftime("%Y-%m-%d %H:%M:%S")
+        due = []
+        for room in self.store.active_rooms(active_since):
+            failures = room.get('refresh_failures') or 0
+            if failures and room.get('refresh_failed_at'):
+                failed_at = datetime.strptime(room['refresh_failed_at'], "%Y-%m-%d %H:%M:%S")
+                if (now - failed_at).total_seconds() < self.retry_delay(failures):
+                    continue
+            interval = room.get('refresh_interval') or self.default_interval
+            scrape_time = room.get('scrape_time')
+            if not scrape_time:
+                due.append(room)
+                continue
+            age = now - datetime.strptime(scrape_time, "%Y-%m-%d %H:%M:%S")
+            if age.total_seconds() >= interval * self.lead:
+                due.append(room)
+        return due
+
+    def run_once(self):
+        # 锁在到期前不释放：其他 worker 本 tick 内拿不到锁，不会重复提交同一批房间
+        if not self.store.try_lock('refresh:schedule', self.owner, self.tick):
+            return 0
+        submitted = sum(1 for room in self.due_rooms() if self.trigger(room))
+        if submitted:
+            log.info('refresh.submitted', rooms=submitted)
+        return submitted
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                log.exception('refresh.schedule_error', error=str(e))
+            self._stop.wait(self.tick)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run_forever, name='refresh-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,451 @@
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# --- 离线上游模拟器 ---
+# 本地模拟 fee.vip.cpolar.cn 的 default.aspx / usedRecord.aspx，用于不访问线上站点的开发、压测和基准测试：
+#   GET  default.aspx                         -> 楼栋下拉框 drlouming
+#   POST default.aspx (__EVENTTARGET=drlouming) -> 楼层下拉框 drceng
+#   POST default.aspx (__EVENTTARGET=drceng)    -> 房间下拉框 drfangjian
+#   POST default.aspx (ImageButton1.x/y)        -> 302 到 usedRecord.aspx (会话记住所选房间)
+#   POST usedRecord.aspx (txtstart/txtend/btnser) -> 查询结果第 1 页 (会话记住日期范围)
+#   GET  usedRecord.aspx?p=N                    -> 第 N 页
+# 会话用 ASP.NET_SessionId cookie 区分；回发时校验 __VIEWSTATE，伪造或过期的 VIEWSTATE 返回 500。
+# 用量数据由 (房间, 日期, 电表) 确定性生成，同一房间多次查询结果一致。
+# 可注入延迟 (latency / jitter / 慢请求)、5xx 失败和隧道错误页 (200 但没有下拉框)。
+#
+# 用法:
+#   python simulator.py serve --port 8800 --latency 0.05
+#   UPSTREAM_BASE_URL=http://127.0.0.1:8800 python app.py
+#   python simulator.py record --base-url https://fee.vip.cpolar.cn --out fixtures   # 从线上 (或模拟器) 录制页面样本
+
+FIXTURES_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "fixtures")
+METERS = ('空调', '照明')
+PRICE = '0.5880'
+SESSION_COOKIE = 'ASP.NET_SessionId'
+
+
+class SimulatorConfig:
+    def __init__(self, buildings=3, floors=6, rooms=10, page_size=10, history_days=365,
+                 latency=0.0, jitter=0.0, slow_rate=0.0, slow_latency=2.0,
+                 failure_rate=0.0, error_page_rate=0.0, viewstate_bytes=2048, serialize_sessions=False, seed=0):
+        """
+        latency / jitter: 每个请求的基础延迟和额外的均匀随机延迟 (秒)；slow_rate 的请求额外等待 slow_latency 秒。
+        failure_rate: 返回 503 的概率；error_page_rate: 返回 200 隧道错误页的概率。
+        serialize_sessions: 同一会话的请求串行处理 (ASP.NET InProc 会话锁的行为)。
+        """
+        self.buildings = buildings
+        self.floors = floors
+        self.rooms = rooms
+        self.page_size = page_size
+        self.history_days = history_days
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.failure_rate = failure_rate
+        self.error_page_rate = error_page_rate
+        self.viewstate_bytes = viewstate_bytes
+        self.serialize_sessions = serialize_sessions
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class _Session:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.room = None
+        self.date_range = None
+
+
+class UpstreamSimulator:
+    def __init__(self, config=None):
+        self.config = config or SimulatorConfig()
+        self._random = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._counts = {}
+        # 真实页面的 VIEWSTATE 有数 KB，用固定的填充字节模拟回发时的请求体大小
+        self._padding = random.Random(self.config.seed).randbytes(self.config.viewstate_bytes)
+
+    # --- 拓扑与数据 ---
+    def buildings(self):
+        return {str(b): f"{b}号楼" for b in range(1, self.config.buildings + 1)}
+
+    def floors(self, building_value):
+        if building_value not in self.buildings():
+            return {}
+        return {f"{building_value}{f:02d}": f"{f}层" for f in range(1, self.config.floors + 1)}
+
+    def rooms(self, building_value, floor_value):
+        if floor_value not in self.floors(building_value):
+            return {}
+        floor = int(floor_value[len(building_value):])
+        return {f"{floor_value}{r:02d}": f"{floor}{r:02d}" for r in range(1, self.config.rooms + 1)}
+
+    @staticmethod
+    def _unit(*parts):
+        # 由参数确定的 [0, 1) 伪随机数
+        digest = hashlib.sha1('|'.join(map(str, parts)).encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+    def usage(self, room_value, day, meter):
+        if meter == '空调':
+            # 夏冬两季空调用电多
+            season = abs(day.month - 7) if day.month >= 4 else day.month + 5
+            base = max(0.0, 6 - season) * 1.5
+            return round(base * (0.5 + self._unit(room_value, day, meter)), 2)
+        return round(0.5 + 2.5 * self._unit(room_value, day, meter), 2)
+
+    def remaining(self, room_value):
+        return f"{20 + 180 * self._unit(room_value, date.today()):.2f}"
+
+    def records(self, room_value, start_date, end_date):
+        """[start_date, end_date] 内的记录 (日期倒序)，只包含 history_days 天内的历史。"""
+        today = date.today()
+        first_day = today - timedelta(days=self.config.history_days - 1)
+        day = min(end_date, today)
+        rows = []
+        while day >= max(start_date, first_day):
+            for meter in METERS:
+                rows.append((day.isoformat(), meter, f"{self.usage(room_value, day, meter):.2f}", PRICE))
+            day -= timedelta(days=1)
+        return rows
+
+    # --- VIEWSTATE ---
+    def _viewstate(self, page, **state):
+        payload = json.dumps({"page": page, **state}, separators=(',', ':')).encode('utf-8')
+        blob = len(payload).to_bytes(2, 'big') + payload + self._padding[len(payload):]
+        return base64.b64encode(blob).decode('ascii')
+
+    @staticmethod
+    def _decode_viewstate(value):
+        try:
+            blob = base64.b64decode(value or '', validate=True)
+            size = int.from_bytes(blob[:2], 'big')
+            return json.loads(blob[2:2 + size])
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    # --- 页面 ---
+    @staticmethod
+    def _select(select_id, options, selected=None, autopostback=True):
+        onchange = f' onchange="javascript:setTimeout(&#39;__doPostBack(\\&#39;{select_id}\\&#39;,\\&#39;\\&#39;)&#39;, 0)"' \
+            if autopostback else ''
+        items = ['<option value="">--请选择--</option>']
+        for value, text in options.items():
+            mark = ' selected="selected"' if value == selected else ''
+            items.append(f'<option{mark} value="{escape(value)}">{escape(text)}</option>')
+        return f'<select name="{select_id}" id="{select_id}"{onchange}>{"".join(items)}</select>'
+
+    def _hidden(self, viewstate):
+        return (f'<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />'
+                f'<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />'
+                f'<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{viewstate}" />'
+                f'<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="CA0B0334" />'
+                f'<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="{viewstate[:96]}" />')
+
+    def default_page(self, building=None, floor=None):
+        viewstate = self._viewstate('default', b=building, f=floor)
+        selects = [self._select('drlouming', self.buildings(), building)]
+        if building:
+            selects.append(self._select('drceng', self.floors(building), floor))
+        if floor:
+            selects.append(self._select('drfangjian', self.rooms(building, floor), autopostback=False))
+            selects.append('<input id="usedR" type="radio" name="radio" value="usedR" checked="checked" />'
+                           '<label for="usedR">用电记录</label>'
+                           '<input type="image" name="ImageButton1" id="ImageButton1" src="images/cx.gif" />')
+        return ('<!DOCTYPE html><html><head><title>宿舍电费查询</title></head><body>'
+                '<form method="post" action="./default.aspx" id="form1">'
+                f'<div class="aspNetHidden">{self._hidden(viewstate)}</div>'
+                f'<div class="select">{"".join(selects)}</div></form></body></html>')
+
+    def results_page(self, room_value, start_date, end_date, page_num):
+        rows = self.records(room_value, start_date, end_date)
+        size = self.config.page_size
+        total_pages = max(1, (len(rows) + size - 1) // size)
+        chunk = rows[(page_num - 1) * size:page_num * size]
+        viewstate = self._viewstate('results', r=room_value, p=page_num)
+        body = ''.join(
+            f'<tr class="contentLine"><td>{d}</td><td>{escape(meter)}</td><td>{usage}</td><td>{price}</td></tr>'
+            for d, meter, usage, price in chunk)
+        return ('<!DOCTYPE html><html><head><title>用电记录</title></head><body>'
+                '<form method="post" action="./usedRecord.aspx" id="form1">'
+                f'<div class="aspNetHidden">{self._hidden(viewstate)}</div>'
+                f'<h6>房间 <span class="number orange">{room_value}</span> 截至 '
+                f'<span class="number orange">{date.today().isoformat()}</span> 剩余电量 '
+                f'<span class="number orange">{self.remaining(room_value)}</span> 度</h6>'
+                f'<input name="txtstart" type="text" value="{start_date.isoformat()}" id="txtstart" />'
+                f'<input name="txtend" type="text" value="{end_date.isoformat()}" id="txtend" />'
+                '<input type="submit" name="btnser" value="查询" id="btnser" />'
+                '<table class="dataTable"><tr><th>日期</th><th>电表名称</th><th>用量</th><th>单价</th></tr>'
+                f'{body}</table>'
+                f'<div class="pageer">第 {page_num} 页 共 {total_pages} 页</div></form></body></html>')
+
+    @staticmethod
+    def error_page():
+        # cpolar 隧道异常时返回 200 的错误页
+        return '<!DOCTYPE html><html><body><h1>Tunnel fee.vip.cpolar.cn not found</h1></body></html>'
+
+    # --- 请求处理 ---
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._counts, "sessions": len(self._sessions)}
+
+    def reset_stats(self):
+        with self._lock:
+            self._counts.clear()
+
+    def _session(self, session_id):
+        with self._lock:
+            if session_id not in self._sessions:
+                return None
+            return self._sessions[session_id]
+
+    def _new_session(self):
+        session_id = uuid.uuid4().hex[:24]
+        with self._lock:
+            self._sessions[session_id] = _Session()
+        return session_id
+
+    def _delay(self):
+        config = self.config
+        with self._lock:
+            delay = config.latency + self._random.uniform(0, config.jitter)
+            if self._random.random() < config.slow_rate:
+                delay += config.slow_latency
+            fail = self._random.random() < config.failure_rate
+            error_page = not fail and self._random.random() < config.error_page_rate
+        if delay:
+            time.sleep(delay)
+        return fail, error_page
+
+    def handle(self, method, path, form, session_id):
+        """返回 (状态码, 额外响应头, HTML)。"""
+        session = self._session(session_id)
+        headers = {}
+        if session is None:
+            session_id = self._new_session()
+            session = self._session(session_id)
+            headers['Set-Cookie'] = f'{SESSION_COOKIE}={session_id}; path=/; HttpOnly'
+        if self.config.serialize_sessions:
+            with session.lock:
+                status, extra, html = self._handle(method, path, form, session)
+        else:
+            status, extra, html = self._handle(method, path, form, session)
+        return status, {**headers, **extra}, html
+
+    def _handle(self, method, path, form, session):
+        url = urlsplit(path)
+        page_name = url.path.rsplit('/', 1)[-1].lower()
+        fail, error_page = self._delay()
+        if fail:
+            self._count('failures')
+            return 503, {}, '<html><body><h1>503 Service Unavailable</h1></body></html>'
+        if error_page:
+            self._count('error_pages')
+            return 200, {}, self.error_page()
+
+        if page_name in ('', 'default.aspx'):
+            return self._handle_default(method, form, session)
+        if page_name == 'usedrecord.aspx':
+            return self._handle_results(method, dict(parse_qsl(url.query)), form, session)
+        return 404, {}, '<html><body><h1>404</h1></body></html>'
+
+    def _check_viewstate(self, form, page):
+        state = self._decode_viewstate(form.get('__VIEWSTATE'))
+        return state is not None and state.get('page') == page
+
+    def _handle_default(self, method, form, session):
+        if method == 'GET':
+            self._count('default_get')
+            return 200, {}, self.default_page()
+        if not self._check_viewstate(form, 'default'):
+            self._count('viewstate_errors')
+            return 500, {}, '<html><body><h2>Validation of viewstate MAC failed.</h2></body></html>'
+        building, floor, room = form.get('drlouming'), form.get('drceng'), form.get('drfangjian')
+        target = form.get('__EVENTTARGET')
+        if form.get('ImageButton1.x') is not None:
+            self._count('select_room')
+            if room not in self.rooms(building, floor) or form.get('radio') != 'usedR':
+                return 200, {}, self.default_page(building, floor)
+            session.room = room
+            session.date_range = None
+            return 302, {'Location': './usedRecord.aspx'}, ''
+        if target == 'drlouming':
+            self._count('postback_building')
+            return 200, {}, self.default_page(building if building in self.buildings() else None)
+        if target == 'drceng':
+            self._count('postback_floor')
+            floor = floor if floor in self.floors(building) else None
+            return 200, {}, self.default_page(building, floor)
+        self._count('postback_other')
+        return 200, {}, self.default_page()
+
+    def _handle_results(self, method, query, form, session):
+        if session.room is None:
+            # 未选择房间 (会话过期) 时跳回首页
+            self._count('results_redirect')
+            return 302, {'Location': './default.aspx'}, ''
+        if method == 'POST':
+            if not self._check_viewstate(form, 'results'):
+                self._count('viewstate_errors')
+                return 500, {}, '<html><body><h2>Validation of viewstate MAC failed.</h2></body></html>'
+            try:
+                session.date_range = (date.fromisoformat(form.get('txtstart', '')),
+                                      date.fromisoformat(form.get('txtend', '')))
+            except ValueError:
+                session.date_range = None
+            self._count('query')
+            page_num = 1
+        else:
+            self._count('page' if 'p' in query else 'results_get')
+            try:
+                page_num = max(1, int(query.get('p', 1)))
+            except ValueError:
+                page_num = 1
+        # 未查询过时显示最近 7 天
+        start_date, end_date = session.date_range or (date.today() - timedelta(days=6), date.today())
+        return 200, {}, self.results_page(session.room, start_date, end_date, page_num)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    simulator = None
+
+    def log_message(self, *args):
+        pass
+
+    def _session_id(self):
+        for part in self.headers.get('Cookie', '').split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == SESSION_COOKIE:
+                return value
+        return None
+
+    def _respond(self, form):
+        status, headers, html = self.simulator.handle(self.command, self.path, form, self._session_id())
+        body = html.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._respond({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self._respond(dict(parse_qsl(self.rfile.read(length).decode('utf-8'), keep_blank_values=True)))
+
+
+def start_simulator(config=None, host='127.0.0.1', port=0):
+    """在后台线程启动模拟器，返回 (server, simulator, base_url)；用完调用 server.shutdown()。"""
+    simulator = UpstreamSimulator(config)
+    handler = type('SimulatorHandler', (_Handler,), {'simulator': simulator})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='simulator', daemon=True).start()
+    return server, simulator, f"http://{host}:{server.server_address[1]}"
+
+
+def record_fixtures(base_url, out_dir=FIXTURES_DIR, days=90):
+    """
+    按真实回发流程访问 base_url (线上站点或模拟器)，把每一步的页面保存到 out_dir：
+    default / floors / rooms / results_p1 / results_p2 (.html)。选择第一个楼栋、楼层和房间。
+    """
+    import requests
+    from parsers import parse_page
+
+    os.makedirs(out_dir, exist_ok=True)
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                             'Chrome/91.0.4472.124 Safari/537.36'}
+    login_url, results_url = f"{base_url}/default.aspx", f"{base_url}/usedRecord.aspx"
+    saved = []
+
+    def save(name, response):
+        response.raise_for_status()
+        with open(os.path.join(out_dir, f"{name}.html"), 'w', encoding='utf-8') as f:
+            f.write(response.text)
+        saved.append(name)
+        return parse_page(response.text)
+
+    with requests.Session() as session:
+        session.headers.update(headers)
+        page = save('default', session.get(login_url, timeout=30))
+        building = page.select_options('drlouming')[0]['value']
+        page = save('floors', session.post(login_url, data={**page.hidden_inputs(), '__EVENTTARGET': 'drlouming',
+                                                            'drlouming': building}, timeout=30))
+        floor = page.select_options('drceng')[0]['value']
+        page = save('rooms', session.post(login_url, data={**page.hidden_inputs(), '__EVENTTARGET': 'drceng',
+                                                           'drlouming': building, 'drceng': floor}, timeout=30))
+        room = page.select_options('drfangjian')[0]['value']
+        form = {**page.hidden_inputs(), 'drlouming': building, 'drceng': floor, 'drfangjian': room,
+                'radio': 'usedR', 'ImageButton1.x': '30', 'ImageButton1.y': '10'}
+        form.pop('__EVENTTARGET', None)
+        page = parse_page(session.post(login_url, data=form, headers={'Referer': login_url}, timeout=30).text)
+        today = date.today()
+        page = save('results_p1', session.post(results_url, data={
+            **page.hidden_inputs(), 'txtstart': (today - timedelta(days=days)).isoformat(),
+            'txtend': today.isoformat(), 'btnser': '查询'}, headers={'Referer': results_url}, timeout=30))
+        if page.total_pages() > 1:
+            save('results_p2', session.get(f"{results_url}?p=2", headers={'Referer': results_url}, timeout=30))
+    return saved
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="电费查询上游模拟器")
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help="启动模拟器")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8800)
+    defaults = SimulatorConfig()
+    for name, value in defaults.as_dict().items():
+        option = '--' + name.replace('_', '-')
+        if isinstance(value, bool):
+            serve.add_argument(option, action='store_true')
+        else:
+            serve.add_argument(option, type=type(value), default=value)
+    record = sub.add_parser('record', help="录制页面样本到 fixtures 目录")
+    record.add_argument('--base-url', required=True, help="线上站点或模拟器地址，如 https://fee.vip.cpolar.cn")
+    record.add_argument('--out', default=FIXTURES_DIR)
+    record.add_argument('--days', type=int, default=90)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'record':
+        saved = record_fixtures(args.base_url, args.out, args.days)
+        print(f"已保存 {len(saved)} 个页面到 {args.out}: {', '.join(saved)}")
+        return
+    config = SimulatorConfig(**{name: getattr(args, name) for name in SimulatorConfig().as_dict()})
+    server, _, base_url = start_simulator(config, args.host, args.port)
+    print(f"上游模拟器已启动: {base_url}  (UPSTREAM_BASE_URL={base_url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+import uuid
+
+from logs import get_logger
+
+# --- 请求合并 (single-flight) ---
+# 同一个 key (房间 + 日期范围) 同时只允许一次上游爬取：
+#   - 同一进程内：后到的线程等待首个线程的结果并直接共享
+#   - 多进程 (gunicorn workers)：通过数据库中的锁互斥，等待方在锁释放后调用 after_wait()
+#     (通常是从数据库读取刚写入的结果)，读不到时才自己爬取
+# do_async 是同样语义的 asyncio 版本，供异步爬取流程 (asgi.py) 使用
+# 持有锁期间由后台线程每 lock_ttl / 3 秒续期一次，爬取耗时超过 lock_ttl 也不会被其他 worker 接管；
+# 进程异常退出时锁最多在 lock_ttl 秒后失效
+
+log = get_logger('singleflight')
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, store=None, lock_ttl=300, poll_interval=0.2):
+        self.store = store
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self._held = {}
+        self._renewer = None
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls) + len(self._tasks)
+
+    def do(self, key, fn, after_wait=None):
+        """执行 fn() 并返回 (结果, 是否与其他请求共享)。"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result, shared = self._run_locked(key, fn, after_wait)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, shared
+
+    def _hold(self, lock_name, owner):
+        with self._lock:
+            self._held[lock_name] = owner
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew_loop, name='singleflight-renew', daemon=True)
+                self._renewer.start()
+
+    def _unhold(self, lock_name):
+        with self._lock:
+            self._held.pop(lock_name, None)
+
+    def _renew_loop(self):
+        while True:
+            time.sleep(self.lock_ttl / 3)
+            with self._lock:
+                held = list(self._held.items())
+            for lock_name, owner in held:
+                try:
+                    if not self.store.extend_lock(lock_name, owner, self.lock_ttl):
+                        log.warning('lock.lost', lock=lock_name)
+                except Exception as e:
+                    log.exception('lock.renew_error', lock=lock_name, error=str(e))
+
+    def _run_locked(self, key, fn, after_wait):
+        if self.store is None:
+            return fn(), False
+        lock_name = f"singleflight:{key}"
+        waited = False
+        while not self.store.try_lock(lock_name, self.owner, self.lock_ttl):
+            waited = True
+            time.sleep(self.poll_interval)
+        self._hold(lock_name, self.owner)
+        try:
+            if waited and after_wait is not None:
+                result = after_wait()
+                if result is not None:
+                    return result, True
+            return fn(), False
+        finally:
+            self._unhold(lock_name)
+            self.store.release_lock(lock_name, self.owner)
+
+    async def do_async(self, key, coro_fn, after_wait=None):
+        """do() 的协程版本：coro_fn() 返回协程；同一事件循环内的并发调用共享同一个任务。"""
+        task = self._tasks.get(key)
+        shared = task is not None
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(self._run_locked_async(key, coro_fn, after_wait))
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        # shield: 某个等待方被取消 (如客户端断开) 不影响其他等待方
+        result, waited = await asyncio.shield(task)
+        return result, shared or waited
+
+    async def _run_locked_async(self, key, coro_fn, after_wait):
+        if self.store is None:
+            return await coro_fn(), False
+        # 与同进程内线程版 do() 使用不同的 owner，两者之间也能互斥
+        lock_name, owner = f"singleflight:{key}", f"{self.owner}:async"
+        waited = False
+        # 锁和 after_wait 都要读写数据库，放到线程中执行，不阻塞事件循环
+        while not await asyncio.to_thread(self.store.try_lock, lock_name, owner, self.lock_ttl):
+            waited = True
+            await asyncio.sleep(self.poll_interval)
+        self._hold(lock_name, owner)
+        try:
+            if waited and after_wait is not None:
+                result = await asyncio.to_thread(after_wait)
+                if result is not None:
+                    return result, True
+            return await coro_fn(), False
+        finally:
+            self._unhold(lock_name)
+            await asyncio.to_thread(self.store.release_lock, lock_name, owner)
@@ -53,24 +53,21 @@ $(document).ready(function() {
             if (!$('#loadingText').length) {
                 $('.settings-content').append('<p id="loadingText" style="text-align: center; color: blue;">正在获取数据，请等待😘...</p>');
             }
-            $('#loadingText').show();
+            $('#loadingText').text('正在获取数据，请等待😘...').show();
             console.log('加载中...');
         
-            // 调用 /api/refresh 触发爬取
-            $.get('/api/refresh?building=' + buildingText + '&floor=' + floorText + '&room=' + roomText)
-                .done(function(data) {
-                    if (!data.success) {
-                        $('#loadingText').hide();
-                        alert('刷新失败: ' + (data.error || '未知错误'));
-                        return;
-                    }
+            // 登记刷新任务并轮询进度，爬取期间不占用服务端 worker
+            runRefreshJob({ building: buildingText, floor: floorText, room: roomText }, function(job) {
+                $('#loadingText').text(jobProgressText(job));
+            })
+                .done(function() {
                     console.log('刷新完成');
                     console.log('loadData.done called');
                     $('#loadingText').hide();
                     $('#loading').show();  // 显示 spinner for loadData
                     loadData().done(function(result) {
                         $('#loading').hide();
-                        if (result.data && result.data.records && result.data.records.length > 0) {
+                        if (result.data && result.data.record_count > 0) {
                             updateDashboard(result.data);
                             updateCharts(result.weekly, result.monthly, result.distribution, result.distributions);
                             console.log('面板数据已自动刷新');
@@ -94,8 +91,8 @@ $(document).ready(function() {
                         console.log('saveSettings loadData 失败');
                     });
                 })
-                .fail(function() {
-                    alert('爬取失败，请重试');
+                .fail(function(error) {
+                    alert('爬取失败，请重试: ' + error);
                     $('#loading').hide();
                     $('#loadingText').hide();
                 });
@@ -118,34 +115,32 @@ $(document).ready(function() {
 
         // 刷新按钮
         $('#refreshBtn').click(function() {
+            const refreshBtn = $(this);
+            if (refreshBtn.prop('disabled')) {
+                return;
+            }
+            const originalHtml = refreshBtn.html();
+            refreshBtn.prop('disabled', true);
             $('#loading').show();
-            $.get('/api/refresh')
-                .done(function(data) {
-                    if (data.success) {
-                        console.log('刷新完成');
-                        loadData().done(function(result) {
-                            $('#loading').hide();
-                            if (result.data && result.data.records && result.data.records.length > 0) {
-                                updateDashboard(result.data);
-                                updateCharts(result.weekly, result.monthly, result.distribution, result.distributions);
-                                console.log('刷新数据加载完成');
-                            } else {
-                                alert('刷新后无新数据');
-                                // 设置空值
-                                document.getElementById('remainingElectricity').textContent = '--';
-                                document.getElementById('remainingCost').textContent = '--';
-                                document.getElementById('todayUsage').textContent = '--';
-                                document.getElementById('todayCost').textContent = '--';
-                                document.getElementById('yesterdayUsage').textContent = '--';
-                                document.getElementById('yesterdayCost').textContent = '--';
-                                document.getElementById('monthUsage').textContent = '--';
-                                document.getElementById('monthCost').textContent = '--';
-                                document.getElementById('lastUpdateTime').textContent = '--';
-                            }
-                        }).fail(function(err) {
-                            $('#loading').hide();
-                            alert('数据加载失败: ' + err.message);
-                            console.log('刷新加载失败');
+            // 刷新已保存的房间；没有保存设置时由服务端刷新最近一次爬取的房间
+            const savedSettings = JSON.parse(localStorage.getItem('roomSettings') || '{}');
+            const room = savedSettings.building ? { building: savedSettings.building, floor: savedSettings.floor, room: savedSettings.room } : {};
+            runRefreshJob(room, function(job) {
+                refreshBtn.html('<i class="fas fa-sync-alt fa-spin"></i> ' + jobProgressText(job, true));
+            })
+                .always(function() {
+                    refreshBtn.prop('disabled', false).html(originalHtml);
+                })
+                .done(function() {
+                    console.log('刷新完成');
+                    loadData().done(function(result) {
+                        $('#loading').hide();
+                        if (result.data && result.data.record_count > 0) {
+                            updateDashboard(result.data);
+                            updateCharts(result.weekly, result.monthly, result.distribution, result.distributions);
+                            console.log('刷新数据加载完成');
+                        } else {
+                            alert('刷新后无新数据');
                             // 设置空值
                             document.getElementById('remainingElectricity').textContent = '--';
                             document.getElementById('remainingCost').textContent = '--';
@@ -156,15 +151,26 @@ $(document).ready(function() {
                             document.getElementById('monthUsage').textContent = '--';
                             document.getElementById('monthCost').textContent = '--';
                             document.getElementById('lastUpdateTime').textContent = '--';
-                        });
-                    } else {
+                        }
+                    }).fail(function(err) {
                         $('#loading').hide();
-                        alert('刷新失败: ' + (data.error || '未知错误'));
-                    }
+                        alert('数据加载失败: ' + err.message);
+                        console.log('刷新加载失败');
+                        // 设置空值
+                        document.getElementById('remainingElectricity').textContent = '--';
+                        document.getElementById('remainingCost').textContent = '--';
+                        document.getElementById('todayUsage').textContent = '--';
+                        document.getElementById('todayCost').textContent = '--';
+                        document.getElementById('yesterdayUsage').textContent = '--';
+                        document.getElementById('yesterdayCost').textContent = '--';
+                        document.getElementById('monthUsage').textContent = '--';
+                        document.getElementById('monthCost').textContent = '--';
+                        document.getElementById('lastUpdateTime').textContent = '--';
+                    });
                 })
-                .fail(function() {
+                .fail(function(error) {
                     $('#loading').hide();
-                    alert('网络错误，刷新失败');
+                    alert('刷新失败: ' + error);
                 });
         });
 
@@ -221,6 +227,56 @@ $(document).ready(function() {
         });
     }
 
+    // 刷新任务：POST /api/jobs 立即返回任务，之后每 JOB_POLL_INTERVAL 毫秒查询一次 /api/jobs/<id>。
+    // 任务完成时 resolve(job)，失败时 reject(错误信息)；onProgress(job) 在每次得到任务状态后调用。
+    const JOB_POLL_INTERVAL = 1000;
+
+    function runRefreshJob(room, onProgress) {
+        const deferred = $.Deferred();
+
+        function poll(job) {
+            if (onProgress) {
+                onProgress(job);
+            }
+            if (job.status === 'done') {
+                deferred.resolve(job);
+            } else if (job.status === 'failed') {
+                deferred.reject(job.error || '未知错误');
+            } else {
+                setTimeout(function() {
+                    $.get('/api/jobs/' + job.id)
+                        .done(poll)
+                        .fail(function() {
+                            deferred.reject('网络错误，无法获取刷新进度');
+                        });
+                }, JOB_POLL_INTERVAL);
+            }
+        }
+
+        $.ajax({
+            url: '/api/jobs',
+            method: 'POST',
+            contentType: 'application/json',
+            data: JSON.stringify(room)
+        })
+            .done(poll)
+            .fail(function(xhr) {
+                deferred.reject((xhr.responseJSON && xhr.responseJSON.error) || '网络错误');
+            });
+        return deferred.promise();
+    }
+
+    function jobProgressText(job, short) {
+        const progress = job.progress || {};
+        if (job.status === 'queued') {
+            return '排队中...';
+        }
+        if (progress.pages_total) {
+            return (short ? '' : '正在获取数据 ') + `${progress.pages_done}/${progress.pages_total} 页`;
+        }
+        return short ? '刷新中...' : '正在获取数据，请等待😘...';
+    }
+
     // 加载楼栋选项
     function loadOptions() {
         $.get('/api/options/buildings')
@@ -250,7 +306,7 @@ $(document).ready(function() {
         if (settings.building && settings.floor && settings.room) {
             console.log('检测到保存的房间，调用 loadData()');
             loadData().done(function(result) {
-                if (result.data && result.data.records && result.data.records.length > 0) {
+                if (result.data && result.data.record_count > 0) {
                     updateDashboard(result.data);
                     updateCharts(result.weekly, result.monthly, result.distribution, result.distributions);
                     console.log('初始数据加载完成');
@@ -300,147 +356,26 @@ const charts = {
 };
     const ELECTRICITY_RATE = 0.55;
 
-    // 计算指定日期用量 (sum usage)
-    function getUsageByDate(records, targetDate) {
-        return records
-            .filter(record => record.date === targetDate)
-            .reduce((sum, record) => sum + parseFloat(record.usage || 0), 0);
-    }
-
-    // 计算趋势数据 (group by date, sum total and by meter)
-    function getTrendData(records, dates) {
-        const meterNames = [...new Set(records.map(r => r.meter_name))];  // 动态获取 meter types
-        const uniqueMeters = meterNames.length > 0 ? meterNames : ['空调', '照明'];  // fallback
-
-        const totalData = dates.map(date => getUsageByDate(records, date));
-        
-        const meterData = uniqueMeters.map(meter => 
-            dates.map(date => records
-                .filter(record => record.date === date && record.meter_name.includes(meter))
-                .reduce((sum, record) => sum + parseFloat(record.usage || 0), 0)
-            )
-        );
-
-        return {
-            dates,
-            meters: uniqueMeters,
-            total: totalData,
-            byMeter: meterData
-        };
-    }
-
-    // 获取周趋势 (最近 7 天)
-    function getWeeklyData(records) {
-        const today = new Date();
-        const dates = [];
-        for (let i = 6; i >= 0; i--) {
-            const date = new Date(today);
-            date.setDate(today.getDate() - i);
-            dates.push(date.toISOString().split('T')[0]);
-        }
-        return getTrendData(records, dates);
-    }
-
-    // 获取月趋势 (最近 4 周，每周 sum)
-    function getMonthlyData(records) {
-        const today = new Date();
-        const weeks = ['第一周', '第二周', '第三周', '第四周'];
-        const weekData = weeks.map((_, index) => {
-            const startDate = new Date(today);
-            startDate.setDate(today.getDate() - (index * 7 + 6));
-            const endDate = new Date(startDate);
-            endDate.setDate(startDate.getDate() + 6);
-            const weekRecords = records.filter(record => {
-                const recordDate = new Date(record.date);
-                return recordDate >= startDate && recordDate <= endDate;
-            });
-            return weekRecords.reduce((sum, record) => sum + parseFloat(record.usage || 0), 0);
-        });
-        // For bars: airConditioner, lighting, total (similar grouping)
-        const meterNames = [...new Set(records.map(r => r.meter_name))];
-        const uniqueMeters = meterNames.length > 0 ? meterNames : ['空调', '照明'];
-        const meterWeekData = uniqueMeters.map(meter => 
-            weeks.map((_, index) => {
-                // Similar filtering for week
-                const startDate = new Date(today);
-                startDate.setDate(today.getDate() - (index * 7 + 6));
-                const endDate = new Date(startDate);
-                endDate.setDate(startDate.getDate() + 6);
-                return records
-                    .filter(record => {
-                        const recordDate = new Date(record.date);
-                        return recordDate >= startDate && recordDate <= endDate && record.meter_name.includes(meter);
-                    })
-                    .reduce((sum, record) => sum + parseFloat(record.usage || 0), 0);
-            })
-        );
-
-        return {
-            weeks,
-            total: weekData,
-            byMeter: meterWeekData,
-            meters: uniqueMeters
-        };
-    }
-
-    // 获取月构成 (group by meter sum)
-    function getUsageDistribution(records) {
-        const acSum = records.filter(record => record.meter_name.includes('空调')).reduce((sum, record) => sum + parseFloat(record.usage || 0), 0);
-        const otherSum = records.filter(record => !record.meter_name.includes('空调')).reduce((sum, record) => sum + parseFloat(record.usage || 0), 0);
-        const totalMonth = acSum + otherSum;
-        return {
-            meters: ['空调', '照明'],
-            values: [acSum, otherSum],
-            total: totalMonth
-        };
-    }
-
-    // 获取指定时间范围的用电分布
-    function getTimeRangeDistribution(records, days, title) {
-        let filtered;
-        const today = new Date();
-        if (days === 1) {
-            const yesterday = new Date(today.getTime() - 86400000);
-            const yesterdayStr = yesterday.toISOString().split('T')[0];
-            filtered = records.filter(record => record.date === yesterdayStr);
-        } else {
-            const cutoff = new Date(today.getTime() - days * 86400000);
-            const cutoffStr = cutoff.toISOString().split('T')[0];
-            filtered = records.filter(record => {
-                const recordDate = new Date(record.date);
-                return recordDate >= cutoff;
-            });
-        }
-        const dist = getUsageDistribution(filtered);
-        return {
-            title: title,
-            ...dist
-        };
-    }
-
     // 更新概览卡片 DOM
     function updateDashboard(data) {
         console.log('updateDashboard 开始, data:', data);
         const rates = ELECTRICITY_RATE;
-        const today = new Date().toISOString().split('T')[0];
-        const yesterday = new Date(Date.now() - 86400000).toISOString().split('T')[0];
-        const monthStart = new Date();
-        monthStart.setDate(1);
-        const monthRecords = data.records.filter(record => new Date(record.date) >= monthStart);
-        const monthUsage = monthRecords.reduce((sum, record) => sum + parseFloat(record.usage || 0), 0);
-        console.log('计算结果:', {todayUsage: getUsageByDate(data.records, today), yesterdayUsage: getUsageByDate(data.records, yesterday), monthUsage});
+        // 今日/昨日/本月用量由 /api/stats 在服务端汇总
+        const summary = data.summary || {today: 0, yesterday: 0, month: 0};
+        const monthUsage = summary.month;
+        console.log('计算结果:', {todayUsage: summary.today, yesterdayUsage: summary.yesterday, monthUsage});
 
         // 剩余
         document.getElementById('remainingElectricity').textContent = `${data.remaining_electricity || '--'} 度`;
         document.getElementById('remainingCost').textContent = `约 ${((data.remaining_electricity || 0) * rates).toFixed(2)} 元`;
 
         // 今日
-        const todayUsage = getUsageByDate(data.records, today);
+        const todayUsage = summary.today;
         document.getElementById('todayUsage').textContent = `${todayUsage.toFixed(1)} 度`;
         document.getElementById('todayCost').textContent = `${(todayUsage * rates).toFixed(2)} 元`;
 
         // 昨日
-        const yesterdayUsage = getUsageByDate(data.records, yesterday);
+        const yesterdayUsage = summary.yesterday;
         document.getElementById('yesterdayUsage').textContent = `${yesterdayUsage.toFixed(1)} 度`;
         document.getElementById('yesterdayCost').textContent = `${(yesterdayUsage * rates).toFixed(2)} 元`;
 
@@ -672,43 +607,39 @@ const charts = {
         const ninetyDaysAgo = new Date(Date.now() - 90 * 24 * 60 * 60 * 1000).toISOString().split('T')[0];
         console.log('查询日期范围:', {start: ninetyDaysAgo, end: today});
 
+        // 统计由服务端一次性计算，只下载汇总结果，不下载原始记录
+        // 使用 GET：数据未更新时浏览器凭 ETag 重新验证，服务端只返回 304 响应头
+        const params = {
+            building: buildingText,
+            floor: floorText,
+            room: roomText,
+            start_date: ninetyDaysAgo,
+            end_date: today
+        };
+        if (settings.frequency) {
+            // 设置中的更新频率 (分钟)，后端据此在后台提前刷新该房间
+            params.refresh_interval = parseInt(settings.frequency, 10) * 60;
+        }
         return $.ajax({
-            url: '/api/query',
-            method: 'POST',
-            contentType: 'application/json',
-            data: JSON.stringify({
-                building: buildingText,
-                floor: floorText,
-                room: roomText,
-                start_date: ninetyDaysAgo,
-                end_date: today
-            })
+            url: '/api/stats',
+            method: 'GET',
+            data: params
         }).then(function(data) {
-            console.log('AJAX success, 数据响应:', data);
-            console.log('loadData received records:', data.records ? data.records.length : 0, 'computed weekly:', getWeeklyData(data.records));
-            if (data.error || !data.records || data.records.length === 0) {
+            console.log('AJAX success, 统计响应:', data);
+            if (data.stale) {
+                console.log('返回的是过期缓存，后台正在刷新');
+            }
+            if (data.error || !data.record_count) {
                 throw new Error('数据加载失败: ' + (data.error || '无记录'));
             }
             console.log('数据加载完成');
 
-            // 计算趋势和构成
-            const weekly = getWeeklyData(data.records);
-            const monthly = getMonthlyData(data.records);
-            const distribution = getUsageDistribution(data.records);
-            const distributions = {
-                yesterday: getTimeRangeDistribution(data.records, 1, '昨日'),
-                threeDays: getTimeRangeDistribution(data.records, 3, '近三日'),
-                weekly: getTimeRangeDistribution(data.records, 7, '近一周'),
-                monthly: getTimeRangeDistribution(data.records, 30, '近一个月')
-            };
-            console.log('计算数据:', {weeklyTotal: weekly.total, monthlyTotal: monthly.total, distributionTotal: distribution.total, distributions});
-
             return {
                 data: data,
-                weekly: weekly,
-                monthly: monthly,
-                distribution: distribution,
-                distributions: distributions
+                weekly: data.weekly,
+                monthly: data.monthly,
+                distribution: data.distribution,
+                distributions: data.distributions
             };
         }).fail(function(xhr, status, error) {
             console.error('AJAX error:', xhr);
@@ -77,6 +77,33 @@ $(document).ready(function() {
         }
     });
 
+    // 本地记录副本：按房间和日期范围保存在 localStorage，{cursor, records, remaining_electricity}
+    function syncStorageKey(params) {
+        return 'recordSync:' + [params.building, params.floor, params.room, params.start_date, params.end_date].join('|');
+    }
+
+    function loadLocalCopy(key) {
+        try {
+            return JSON.parse(localStorage.getItem(key)) || null;
+        } catch (err) {
+            return null;
+        }
+    }
+
+    // 把增量记录按 (date, meter_name) 合并进本地副本，保持日期倒序
+    function mergeRecords(records, changes) {
+        const merged = {};
+        records.concat(changes).forEach(function(record) {
+            merged[record.date + '|' + record.meter_name] = record;
+        });
+        return Object.values(merged).sort(function(a, b) {
+            if (a.date !== b.date) {
+                return a.date < b.date ? 1 : -1;
+            }
+            return a.meter_name < b.meter_name ? -1 : (a.meter_name > b.meter_name ? 1 : 0);
+        });
+    }
+
     // 表单提交：AJAX查询
     $('#queryForm').submit(function(e) {
         e.preventDefault();
@@ -101,19 +128,39 @@ $(document).ready(function() {
         $('#loading').show();
         $('#results').hide();
 
+        // 增量同步：带上本地副本的游标，服务端只返回之后新增或变化的记录
+        const params = {
+            building: buildingText,
+            floor: floorText,
+            room: roomText,
+            start_date: startDate,
+            end_date: endDate
+        };
+        const storageKey = syncStorageKey(params);
+        const localCopy = loadLocalCopy(storageKey);
+        if (localCopy && localCopy.cursor) {
+            params.since = localCopy.cursor;
+        }
+
         $.ajax({
-            url: '/api/query',
-            method: 'POST',
-            contentType: 'application/json',
-            data: JSON.stringify({
-                building: buildingText,
-                floor: floorText,
-                room: roomText,
-                start_date: startDate,
-                end_date: endDate
-            }),
-            success: function(data) {
-                console.log('Query success:', data);  // 添加日志：成功响应
+            url: '/api/sync',
+            method: 'GET',
+            data: params,
+            success: function(delta) {
+                console.log('Sync success:', {full: delta.full, changes: delta.records.length, cursor: delta.cursor});  // 添加日志：成功响应
+                const records = (delta.full || !localCopy) ? delta.records : mergeRecords(localCopy.records, delta.records);
+                const data = {...delta, records: records};
+                try {
+                    localStorage.setItem(storageKey, JSON.stringify({
+                        cursor: delta.cursor,
+                        records: records,
+                        remaining_electricity: delta.remaining_electricity
+                    }));
+                } catch (err) {
+                    // 超出 localStorage 配额：下次查询全量同步
+                    console.log('保存本地记录副本失败:', err);
+                    localStorage.removeItem(storageKey);
+                }
                 $('#loading').hide();
                 if (data.remaining_electricity !== undefined) {
                     $('#remaining').text(`剩余电量: ${data.remaining_electricity} 度`);
@@ -0,0 +1,153 @@
+from datetime import date, timedelta
+
+from records import RecordColumns, iso_date
+
+
+# --- 服务端用电统计 ---
+# 面板需要的全部统计：今日/昨日/本月用量、每日合计、近 7 天与近 4 周趋势 (总量和分电表)、
+# 昨日/近三日/近一周/近一个月的空调与其他用电构成，以及所选范围的总用量、电费和日均用量。
+# 返回结构与 dashboard.js 绘图所需的数据一致。
+# rollup_stats 读取入库时维护的每日汇总 (storage.daily_usage)，除分电表趋势只需最近 28 天的原始记录外，
+# 开销只与天数有关；compute_stats 先把原始记录汇总成同样的每日数据，两条路径结果相同。
+
+WEEK_LABELS = ['第一周', '第二周', '第三周', '第四周']
+DISTRIBUTION_WINDOWS = (
+    # (key, 标题, 天数)；1 表示仅昨日，其余表示最近 N 天 (含今天)
+    ('yesterday', '昨日', 1),
+    ('threeDays', '近三日', 3),
+    ('weekly', '近一周', 7),
+    ('monthly', '近一个月', 30),
+)
+AIR_CONDITIONER = '空调'
+
+
+def _round(values):
+    return [round(v, 2) for v in values]
+
+
+def daily_rollups(records):
+    """原始记录 -> 与 store.get_daily_rollups 相同结构的每日汇总 (按日期倒序)。"""
+    columns = RecordColumns.from_rows(records)
+    meters = columns.meters
+    days = {}
+    for ordinal, usage, price, code in zip(columns.ordinals, columns.usages, columns.prices, columns.meter_codes):
+        day = days.get(ordinal)
+        if day is None:
+            day = days[ordinal] = {"date": iso_date(ordinal), "usage": 0.0, "ac_usage": 0.0, "cost": 0.0,
+                                   "record_count": 0, "meters": []}
+        name = meters[code]
+        day["usage"] += usage
+        if AIR_CONDITIONER in name:
+            day["ac_usage"] += usage
+        day["cost"] += usage * price
+        day["record_count"] += 1
+        day["meters"].append(name)
+    for day in days.values():
+        day["meters"].sort()
+    return [days[ordinal] for ordinal in sorted(days, reverse=True)]
+
+
+def compute_stats(records, today=None):
+    today = today or date.today()
+    columns = RecordColumns.from_rows(records)
+    return rollup_stats(daily_rollups(columns), columns, today)
+
+
+def rollup_stats(days, recent, today=None):
+    """
+    days 为每日汇总 (按日期倒序)，recent 为覆盖最近 28 天的原始记录 (RecordColumns，可以多于 28 天)，
+    只用于分电表的近 7 天 / 近 4 周趋势。
+    """
+    today = today or date.today()
+    today_ord = today.toordinal()
+    month_start_ord = today.replace(day=1).toordinal()
+    week_days = 7
+
+    # 电表顺序与按 (日期倒序, 电表名) 遍历记录时的首次出现顺序一致
+    meters, meter_index = [], {}
+    for day in days:
+        for name in day["meters"]:
+            if name not in meter_index:
+                meter_index[name] = len(meters)
+                meters.append(name)
+    meter_count = len(meters)
+
+    daily_dates, daily_total = [], []
+    weekly_total = [0.0] * week_days
+    weekly_by_meter = [[0.0] * week_days for _ in range(meter_count)]
+    monthly_total = [0.0] * len(WEEK_LABELS)
+    monthly_by_meter = [[0.0] * len(WEEK_LABELS) for _ in range(meter_count)]
+    all_split = [0.0, 0.0]
+    window_split = {key: [0.0, 0.0] for key, _, _ in DISTRIBUTION_WINDOWS}
+    summary = {"today": 0.0, "yesterday": 0.0, "month": 0.0}
+    totals = {"usage": 0.0, "cost": 0.0}
+    record_count = 0
+
+    for day in reversed(days):
+        ordinal = date.fromisoformat(day["date"]).toordinal()
+        usage, ac_usage = day["usage"], day["ac_usage"]
+        split = (ac_usage, usage - ac_usage)
+        age = today_ord - ordinal
+        daily_dates.append(day["date"])
+        daily_total.append(usage)
+        record_count += day["record_count"]
+        totals["usage"] += usage
+        totals["cost"] += day["cost"]
+        all_split[0] += split[0]
+        all_split[1] += split[1]
+        if age == 0:
+            summary["today"] += usage
+        elif age == 1:
+            summary["yesterday"] += usage
+        if ordinal >= month_start_ord and age >= 0:
+            summary["month"] += usage
+        if 0 <= age < week_days:
+            weekly_total[week_days - 1 - age] += usage
+        if 0 <= age < week_days * len(WEEK_LABELS):
+            monthly_total[age // week_days] += usage
+        for key, _, window in DISTRIBUTION_WINDOWS:
+            if (age == 1) if window == 1 else (0 <= age < window):
+                window_split[key][0] += split[0]
+                window_split[key][1] += split[1]
+
+    recent_meters = recent.meters
+    for ordinal, usage, code in zip(recent.ordinals, recent.usages, recent.meter_codes):
+        age = today_ord - ordinal
+        row = meter_index.get(recent_meters[code])
+        if row is None or not 0 <= age < week_days * len(WEEK_LABELS):
+            continue
+        if age < week_days:
+            weekly_by_meter[row][week_days - 1 - age] += usage
+        monthly_by_meter[row][age // week_days] += usage
+
+    def distribution(split, title=None):
+        result = {"meters": [AIR_CONDITIONER, '照明'], "values": _round(split), "total": round(sum(split), 2)}
+        if title:
+            result["title"] = title
+        return result
+
+    return {
+        "record_count": record_count,
+        "summary": {key: round(value, 2) for key, value in summary.items()},
+        "totals": {
+            "usage": round(totals["usage"], 2),
+            "cost": round(totals["cost"], 2),
+            "days": len(days),
+            "average_daily": round(totals["usage"] / len(days), 2) if days else None,
+        },
+        "daily": {"dates": daily_dates, "total": _round(daily_total)},
+        "weekly": {
+            "dates": [(today - timedelta(days=week_days - 1 - i)).isoformat() for i in range(week_days)],
+            "meters": meters,
+            "total": _round(weekly_total),
+            "byMeter": [_round(row) for row in weekly_by_meter],
+        },
+        "monthly": {
+            "weeks": WEEK_LABELS,
+            "meters": meters,
+            "total": _round(monthly_total),
+            "byMeter": [_round(row) for row in monthly_by_meter],
+        },
+        "distribution": distribution(all_split),
+        "distributions": {key: distribution(window_split[key], title) for key, title, _ in DISTRIBUTION_WINDOWS},
+    }
@@ -0,0 +1,643 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from records import RecordColumns, iso_date, parse_date, parse_number
+from stats import AIR_CONDITIONER
+
+# --- 多房间持久化存储 (SQLite, WAL 模式) ---
+# rooms   : 每个 (building_value, floor_value, room_value) 一行，保存中文名称、剩余电量和爬取时间
+# records : 每个房间的用量记录，(room_id, date, meter_name) 唯一；用量、单价和剩余电量以数值存储
+#           (旧库中这些列是 TEXT，读取时统一转换为 float)，读写接口使用 records.RecordColumns
+# history_start / history_end 记录已抓取历史覆盖的日期范围 (连续，含两端)，用于只向上游请求未覆盖的日期段
+# last_queried / refresh_interval 供后台刷新挑选活跃房间 (refresh_interval 单位秒，为空时用全局默认)
+# stats_key / stats_json 缓存该房间的面板统计结果 (key 含 scrape_time，数据更新后自动失效)
+# sync_version 每次写入该房间时加一，records.version 为该记录最后一次新增或数值变化时的 sync_version，
+# 供 /api/sync 按游标只返回之后变化的记录；reset_version 为最近一次整体替换记录 (merge=False) 的版本，
+# 更早的游标无法表示被删除的记录，需要全量同步
+# daily_usage : 每个房间每天的汇总 (总用量、空调用量、电费 = 用量 × 单价、记录数、当天出现的电表)，
+#           在 save_room 的同一事务中按写入记录的日期范围重算；rooms.usage_total / cost_total / usage_days
+#           为全部历史的累计值，按重算前后的差值增量更新，日均用量 = usage_total / usage_days。
+#           统计和汇总查询只读这张表，开销与天数而不是记录数成正比
+# refresh_failures / refresh_failed_at 为后台刷新连续失败的次数和最近一次失败的时间 (scheduler.py 据此退避)，
+# 任意一次完整爬取成功写入 (带 scrape_time 的 save_room) 时清零
+# balance_time 为剩余电量最后一次更新的时间：完整爬取时等于 scrape_time，余额批量刷新 (watchlist.py) 只更新余额和该时间
+# watchlist : 余额监控的房间及其告警阈值 (剩余电量 / 预计可用天数)，checked_at / error 为最近一次批量刷新的结果
+# topology : 楼栋/楼层/房间下拉选项缓存 (topology_cache.py)，key 为节点名，所有 worker 共用，失效立即对所有进程可见
+# state   : 跨进程共享的少量运行状态 (如余额批量刷新的最近一次汇总)，value 为 JSON
+# locks   : 跨进程的互斥锁 (如多个 gunicorn worker 同时爬取同一房间)，过期自动失效
+# jobs    : 异步刷新任务 (/api/jobs)，任意 worker 都能查询进度；room_key 为去重 key (房间 + 日期范围)，相同的未完成任务只保留一个；
+#           runner 为登记任务的进程，它在任务排队和执行期间定期刷新 updated_at (心跳)；已结束 (done / failed) 的任务不再更新
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_DATABASE_FILE = os.environ.get('ELECTRICITY_DB', os.path.join(BASE_DIR, "electricity_data.db"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rooms (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    building_value TEXT NOT NULL,
+    floor_value TEXT NOT NULL,
+    room_value TEXT NOT NULL,
+    building TEXT,
+    floor TEXT,
+    room TEXT,
+    remaining_electricity REAL,
+    scrape_time TEXT,
+    history_start TEXT,
+    history_end TEXT,
+    last_queried TEXT,
+    refresh_interval INTEGER,
+    stats_key TEXT,
+    stats_json TEXT,
+    sync_version INTEGER NOT NULL DEFAULT 0,
+    reset_version INTEGER NOT NULL DEFAULT 0,
+    usage_total REAL NOT NULL DEFAULT 0,
+    cost_total REAL NOT NULL DEFAULT 0,
+    usage_days INTEGER NOT NULL DEFAULT 0,
+    balance_time TEXT,
+    refresh_failures INTEGER NOT NULL DEFAULT 0,
+    refresh_failed_at TEXT,
+    UNIQUE (building_value, floor_value, room_value)
+);
+CREATE INDEX IF NOT EXISTS idx_rooms_text ON rooms (building, floor, room);
+CREATE INDEX IF NOT EXISTS idx_rooms_scrape_time ON rooms (scrape_time);
+
+CREATE TABLE IF NOT EXISTS records (
+    room_id INTEGER NOT NULL REFERENCES rooms (id) ON DELETE CASCADE,
+    date TEXT NOT NULL,
+    meter_name TEXT NOT NULL,
+    usage REAL,
+    price REAL,
+    version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (room_id, date, meter_name)
+);
+CREATE INDEX IF NOT EXISTS idx_records_date ON records (date);
+
+CREATE TABLE IF NOT EXISTS daily_usage (
+    room_id INTEGER NOT NULL REFERENCES rooms (id) ON DELETE CASCADE,
+    date TEXT NOT NULL,
+    usage REAL NOT NULL,
+    ac_usage REAL NOT NULL,
+    cost REAL NOT NULL,
+    record_count INTEGER NOT NULL,
+    meters TEXT NOT NULL,
+    PRIMARY KEY (room_id, date)
+);
+
+CREATE TABLE IF NOT EXISTS watchlist (
+    room_id INTEGER PRIMARY KEY REFERENCES rooms (id) ON DELETE CASCADE,
+    threshold REAL,
+    days_threshold REAL,
+    created_at TEXT NOT NULL,
+    checked_at TEXT,
+    error TEXT
+);
+
+CREATE TABLE IF NOT EXISTS topology (
+    key TEXT PRIMARY KEY,
+    options_json TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value_json TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS locks (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    room_key TEXT NOT NULL,
+    runner TEXT,
+    target_json TEXT NOT NULL,
+    start_date TEXT,
+    end_date TEXT,
+    status TEXT NOT NULL,
+    pages_done INTEGER NOT NULL DEFAULT 0,
+    pages_total INTEGER,
+    record_count INTEGER NOT NULL DEFAULT 0,
+    result_json TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_room ON jobs (room_key, status);
+"""
+
+ROOM_COLUMNS = ("building", "floor", "room", "building_value", "floor_value", "room_value",
+                "remaining_electricity", "scrape_time", "history_start", "history_end", "last_queried", "refresh_interval",
+                "balance_time", "refresh_failures", "refresh_failed_at")
+
+# 旧库升级：为已存在的表补充后来新增的列
+MIGRATIONS = {
+    "rooms": {"history_start": "TEXT", "last_queried": "TEXT", "refresh_interval": "INTEGER",
+              "stats_key": "TEXT", "stats_json": "TEXT", "history_end": "TEXT",
+              "sync_version": "INTEGER NOT NULL DEFAULT 0", "reset_version": "INTEGER NOT NULL DEFAULT 0",
+              "usage_total": "REAL NOT NULL DEFAULT 0", "cost_total": "REAL NOT NULL DEFAULT 0",
+              "usage_days": "INTEGER NOT NULL DEFAULT 0", "balance_time": "TEXT",
+              "refresh_failures": "INTEGER NOT NULL DEFAULT 0", "refresh_failed_at": "TEXT"},
+    "records": {"version": "INTEGER NOT NULL DEFAULT 0"},
+    "jobs": {"runner": "TEXT"},
+}
+# 依赖迁移新增列的索引，在迁移之后创建
+POST_MIGRATION_SQL = """
+CREATE INDEX IF NOT EXISTS idx_records_version ON records (room_id, version);
+"""
+# 每周从周一开始；每月为自然月
+PERIODS = {
+    "week": "date(date, '-6 days', 'weekday 1')",
+    "month": "strftime('%Y-%m', date)",
+}
+
+
+class ElectricityStore:
+    """每个线程持有独立连接；写操作在事务中完成，多个进程可同时读写同一个数据库文件。"""
+
+    def __init__(self, path=DEFAULT_DATABASE_FILE):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            has_rollups = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_usage'").fetchone()
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+            conn.executescript(POST_MIGRATION_SQL)
+            if not has_rollups:
+                # 旧库第一次打开：按已有记录补建每日汇总
+                for row in conn.execute("SELECT id FROM rooms").fetchall():
+                    self._refresh_rollups(conn, row["id"])
+
+    @staticmethod
+    def _migrate(conn):
+        for table, columns in MIGRATIONS.items():
+            existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for name, column_type in columns.items():
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _room_info(row):
+        info = {key: row[key] for key in ROOM_COLUMNS}
+        info["remaining_electricity"] = parse_number(info["remaining_electricity"])
+        if info["remaining_electricity"] is None:
+            del info["remaining_electricity"]
+        info["id"] = row["id"]
+        return info
+
+    @staticmethod
+    def _record_columns(rows):
+        # rows: (date, meter_name, usage, price)
+        columns = RecordColumns()
+        for day, meter_name, usage, price in rows:
+            ordinal = parse_date(day)
+            if ordinal is not None:
+                columns.append(ordinal, meter_name, usage or 0.0, price or 0.0)
+        return columns
+
+    def find_room(self, building, floor, room):
+        row = self._connect().execute(
+            "SELECT * FROM rooms WHERE building = ? AND floor = ? AND room = ? ORDER BY scrape_time DESC LIMIT 1",
+            (building, floor, room)).fetchone()
+        return self._room_info(row) if row else None
+
+    def get_room(self, building_value, floor_value, room_value):
+        row = self._connect().execute(
+            "SELECT * FROM rooms WHERE building_value = ? AND floor_value = ? AND room_value = ?",
+            (building_value, floor_value, room_value)).fetchone()
+        return self._room_info(row) if row else None
+
+    def latest_room(self):
+        row = self._connect().execute(
+            "SELECT * FROM rooms ORDER BY scrape_time DESC LIMIT 1").fetchone()
+        return self._room_info(row) if row else None
+
+    def list_rooms(self):
+        rows = self._connect().execute(
+            "SELECT * FROM rooms ORDER BY building, floor, room").fetchall()
+        return [self._room_info(row) for row in rows]
+
+    def active_rooms(self, since):
+        rows = self._connect().execute(
+            "SELECT * FROM rooms WHERE last_queried >= ? ORDER BY scrape_time", (since,)).fetchall()
+        return [self._room_info(row) for row in rows]
+
+    def record_refresh_failure(self, room_id, failed_at):
+        """后台刷新失败：连续失败次数加一并记录失败时间。"""
+        conn = self._connect()
+        with conn:
+            conn.execute("UPDATE rooms SET refresh_failures = refresh_failures + 1, refresh_failed_at = ? WHERE id = ?",
+                         (failed_at, room_id))
+
+    def touch_room(self, room_id, queried_at, refresh_interval=None):
+        """记录房间最近一次被查询的时间，可同时更新该房间的刷新间隔。"""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "UPDATE rooms SET last_queried = ?, refresh_interval = COALESCE(?, refresh_interval) WHERE id = ?",
+                (queried_at, refresh_interval, room_id))
+
+    def get_records(self, room_id, start_date=None, end_date=None):
+        """返回该房间 [start_date, end_date] 内的记录 (RecordColumns)，按日期倒序。"""
+        rows = self._connect().execute(
+            """SELECT date, meter_name, CAST(usage AS REAL), CAST(price AS REAL) FROM records
+               WHERE room_id = ? AND date >= COALESCE(?, date) AND date <= COALESCE(?, date)
+               ORDER BY date DESC, meter_name""",
+            (room_id, start_date, end_date))
+        return self._record_columns(rows)
+
+    def iter_records(self, room_id, start_date=None, end_date=None, batch_size=200):
+        """同 get_records，但每次只从数据库取出 batch_size 条，逐批产出 RecordColumns。"""
+        cursor = self._connect().execute(
+            """SELECT date, meter_name, CAST(usage AS REAL), CAST(price AS REAL) FROM records
+               WHERE room_id = ? AND date >= COALESCE(?, date) AND date <= COALESCE(?, date)
+               ORDER BY date DESC, meter_name""",
+            (room_id, start_date, end_date))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield self._record_columns(rows)
+
+    def get_changes(self, room_id, since_version, start_date=None, end_date=None):
+        """
+        返回 (当前 sync_version, reset_version, since_version 之后新增或变化的记录)。
+        只取不超过当前版本的记录：读取期间并发写入的记录留给下一次 (以返回的版本为游标) 同步，不会遗漏。
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT sync_version, reset_version FROM rooms WHERE id = ?", (room_id,)).fetchone()
+        rows = conn.execute(
+            """SELECT date, meter_name, CAST(usage AS REAL), CAST(price AS REAL) FROM records
+               WHERE room_id = ? AND version > ? AND version <= ?
+                 AND date >= COALESCE(?, date) AND date <= COALESCE(?, date)
+               ORDER BY date DESC, meter_name""",
+            (room_id, since_version, row["sync_version"], start_date, end_date))
+        return row["sync_version"], row["reset_version"], self._record_columns(rows)
+
+    def latest_record_date(self, room_id):
+        row = self._connect().execute(
+            "SELECT MAX(date) AS latest FROM records WHERE room_id = ?", (room_id,)).fetchone()
+        return row["latest"]
+
+    def save_room(self, info, records, merge=False):
+        """
+        写入一个房间的信息和记录，返回 room_id。records 为 RecordColumns 或记录字典列表。
+        merge=False 时用 records 替换该房间原有记录；merge=True 时按 (date, meter_name) 合并去重，
+        新抓取的同日同表记录覆盖旧值。scrape_time / history_start / history_end 由调用方计算，未提供时保留原值
+        (流式爬取逐页写入记录时不提供，整次爬取完成后才更新)。
+        """
+        columns = RecordColumns.from_rows(records)
+        remaining = parse_number(info.get("remaining_electricity"))
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                """INSERT INTO rooms (building_value, floor_value, room_value, building, floor, room,
+                                      remaining_electricity, scrape_time, history_start, history_end, balance_time)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (building_value, floor_value, room_value) DO UPDATE SET
+                       building = excluded.building,
+                       floor = excluded.floor,
+                       room = excluded.room,
+                       remaining_electricity = COALESCE(excluded.remaining_electricity, rooms.remaining_electricity),
+                       balance_time = COALESCE(excluded.balance_time, rooms.balance_time),
+                       scrape_time = COALESCE(excluded.scrape_time, rooms.scrape_time),
+                       refresh_failures = CASE WHEN excluded.scrape_time IS NULL THEN rooms.refresh_failures ELSE 0 END,
+                       history_start = COALESCE(excluded.history_start, rooms.history_start),
+                       history_end = COALESCE(excluded.history_end, rooms.history_end)""",
+                (info["building_value"], info["floor_value"], info["room_value"],
+                 info.get("building"), info.get("floor"), info.get("room"),
+                 remaining, info.get("scrape_time"), info.get("history_start"), info.get("history_end"),
+                 info.get("scrape_time") if remaining is not None else None))
+            room_id = conn.execute(
+                "SELECT id FROM rooms WHERE building_value = ? AND floor_value = ? AND room_value = ?",
+                (info["building_value"], info["floor_value"], info["room_value"])).fetchone()["id"]
+            conn.execute("UPDATE rooms SET sync_version = sync_version + 1 WHERE id = ?", (room_id,))
+            version = conn.execute("SELECT sync_version FROM rooms WHERE id = ?", (room_id,)).fetchone()[0]
+            if not merge:
+                conn.execute("DELETE FROM records WHERE room_id = ?", (room_id,))
+                conn.execute("UPDATE rooms SET reset_version = ? WHERE id = ?", (version, room_id))
+            # 数值没有变化的记录保留原 version，增量同步不会重复返回
+            conn.executemany(
+                """INSERT INTO records (room_id, date, meter_name, usage, price, version) VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (room_id, date, meter_name) DO UPDATE SET
+                       usage = excluded.usage, price = excluded.price, version = excluded.version
+                   WHERE records.usage IS NOT excluded.usage OR records.price IS NOT excluded.price""",
+                [row + (version,) for row in columns.db_rows(room_id)])
+            if not merge:
+                self._refresh_rollups(conn, room_id)
+            elif columns:
+                self._refresh_rollups(conn, room_id, iso_date(min(columns.ordinals)), iso_date(max(columns.ordinals)))
+        return room_id
+
+    @staticmethod
+    def _refresh_rollups(conn, room_id, start_date=None, end_date=None):
+        """在调用方的事务中重算 [start_date, end_date] (为空表示全部) 的每日汇总，并把差值计入房间累计值。"""
+        where = "room_id = ? AND date >= COALESCE(?, date) AND date <= COALESCE(?, date)"
+        bounds = (room_id, start_date, end_date)
+        totals = f"SELECT COALESCE(SUM(usage), 0), COALESCE(SUM(cost), 0), COUNT(*) FROM daily_usage WHERE {where}"
+        old = conn.execute(totals, bounds).fetchone()
+        conn.execute(f"DELETE FROM daily_usage WHERE {where}", bounds)
+        conn.execute(
+            f"""INSERT INTO daily_usage (room_id, date, usage, ac_usage, cost, record_count, meters)
+               SELECT room_id, date, SUM(u),
+                      SUM(CASE WHEN instr(meter_name, ?) > 0 THEN u ELSE 0 END),
+                      SUM(u * p), COUNT(*), group_concat(meter_name, char(10))
+               FROM (SELECT room_id, date, meter_name, COALESCE(CAST(usage AS REAL), 0) AS u,
+                            COALESCE(CAST(price AS REAL), 0) AS p
+                     FROM records WHERE {where})
+               GROUP BY date""",
+            (AIR_CONDITIONER, *bounds))
+        new = conn.execute(totals, bounds).fetchone()
+        conn.execute(
+            """UPDATE rooms SET usage_total = usage_total + ?, cost_total = cost_total + ?,
+                                usage_days = usage_days + ? WHERE id = ?""",
+            (new[0] - old[0], new[1] - old[1], new[2] - old[2], room_id))
+
+    def get_daily_rollups(self, room_id, start_date=None, end_date=None):
+        """[start_date, end_date] 内的每日汇总，按日期倒序；meters 为当天出现的电表 (按名称排序)。"""
+        rows = self._connect().execute(
+            """SELECT date, usage, ac_usage, cost, record_count, meters FROM daily_usage
+               WHERE room_id = ? AND date >= COALESCE(?, date) AND date <= COALESCE(?, date)
+               ORDER BY date DESC""",
+            (room_id, start_date, end_date))
+        return [{"date": day, "usage": usage, "ac_usage": ac_usage, "cost": cost, "record_count": count,
+                 "meters": sorted(meters.split('\n'))}
+                for day, usage, ac_usage, cost, count, meters in rows]
+
+    def get_period_totals(self, room_id, period, start_date=None, end_date=None):
+        """按周 (period='week'，键为该周周一) 或自然月 ('month'，键为 YYYY-MM) 汇总的用量和电费，按时间倒序。"""
+        key = PERIODS[period]
+        rows = self._connect().execute(
+            f"""SELECT {key} AS period, SUM(usage), SUM(cost), COUNT(*) FROM daily_usage
+                WHERE room_id = ? AND date >= COALESCE(?, date) AND date <= COALESCE(?, date)
+                GROUP BY period ORDER BY period DESC""",
+            (room_id, start_date, end_date))
+        return [{"period": name, "usage": usage, "cost": cost, "days": days} for name, usage, cost, days in rows]
+
+    def get_usage_totals(self, room_id):
+        """该房间全部历史的累计用量、电费、有记录的天数和日均用量。"""
+        row = self._connect().execute(
+            "SELECT usage_total, cost_total, usage_days FROM rooms WHERE id = ?", (room_id,)).fetchone()
+        if row is None:
+            return None
+        usage, cost, days = row
+        return {"usage": usage, "cost": cost, "days": days, "average_daily": usage / days if days else None}
+
+    def get_cached_stats(self, room_id, key):
+        row = self._connect().execute(
+            "SELECT stats_json FROM rooms WHERE id = ? AND stats_key = ?", (room_id, key)).fetchone()
+        return json.loads(row["stats_json"]) if row else None
+
+    def save_cached_stats(self, room_id, key, stats):
+        conn = self._connect()
+        with conn:
+            conn.execute("UPDATE rooms SET stats_key = ?, stats_json = ? WHERE id = ?",
+                         (key, json.dumps(stats, ensure_ascii=False), room_id))
+
+    def ensure_room(self, info):
+        """登记房间 (不写入记录，也不改动已有房间的数据)，返回 room_id。"""
+        conn = self._connect()
+        values = (info["building_value"], info["floor_value"], info["room_value"])
+        with conn:
+            conn.execute(
+                """INSERT INTO rooms (building_value, floor_value, room_value, building, floor, room)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (building_value, floor_value, room_value) DO UPDATE SET
+                       building = COALESCE(rooms.building, excluded.building),
+                       floor = COALESCE(rooms.floor, excluded.floor),
+                       room = COALESCE(rooms.room, excluded.room)""",
+                (*values, info.get("building"), info.get("floor"), info.get("room")))
+            return conn.execute(
+                "SELECT id FROM rooms WHERE building_value = ? AND floor_value = ? AND room_value = ?",
+                values).fetchone()["id"]
+
+    def watch_room(self, room_id, threshold=None, days_threshold=None, created_at=None):
+        """加入余额监控；已在监控中时只更新阈值 (为 None 的阈值使用全局默认)。"""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                """INSERT INTO watchlist (room_id, threshold, days_threshold, created_at) VALUES (?, ?, ?, ?)
+                   ON CONFLICT (room_id) DO UPDATE SET
+                       threshold = excluded.threshold, days_threshold = excluded.days_threshold""",
+                (room_id, threshold, days_threshold, created_at or time.strftime("%Y-%m-%d %H:%M:%S")))
+
+    def unwatch_room(self, room_id):
+        conn = self._connect()
+        with conn:
+            return conn.execute("DELETE FROM watchlist WHERE room_id = ?", (room_id,)).rowcount
+
+    def watched_rooms(self):
+        """批量刷新用：全部监控房间的 id 和 value，按楼栋、楼层排序。"""
+        rows = self._connect().execute(
+            """SELECT r.id, r.building_value, r.floor_value, r.room_value FROM watchlist w JOIN rooms r ON r.id = w.room_id
+               ORDER BY r.building_value, r.floor_value, r.room_value""").fetchall()
+        return [dict(row) for row in rows]
+
+    def save_balances(self, results, checked_at):
+        """
+        一个事务写入一批余额刷新结果 results = [(room_id, 剩余电量, 错误信息), ...]；
+        失败的房间只记录错误，保留原来的余额。
+        """
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "UPDATE rooms SET remaining_electricity = ?, balance_time = ? WHERE id = ?",
+                [(remaining, checked_at, room_id) for room_id, remaining, error in results if error is None])
+            conn.executemany(
+                "UPDATE watchlist SET checked_at = ?, error = ? WHERE room_id = ?",
+                [(checked_at, error, room_id) for room_id, _, error in results])
+
+    def get_watchlist(self, usage_since):
+        """
+        监控房间的余额、阈值和用量：recent_daily 为 usage_since 之后有记录日期的日均用量 (每日汇总表)，
+        average_daily 为全部历史的日均用量。每个房间只按主键范围读取最近几天的汇总，一次查询完成。
+        """
+        rows = self._connect().execute(
+            """SELECT r.*, w.threshold, w.days_threshold, w.created_at AS watched_at, w.checked_at, w.error,
+                      (SELECT AVG(d.usage) FROM daily_usage d WHERE d.room_id = r.id AND d.date >= ?) AS recent_daily,
+                      CASE WHEN r.usage_days > 0 THEN r.usage_total / r.usage_days END AS average_daily
+               FROM watchlist w JOIN rooms r ON r.id = w.room_id""", (usage_since,)).fetchall()
+        entries = []
+        for row in rows:
+            entry = self._room_info(row)
+            for key in ("threshold", "days_threshold", "watched_at", "checked_at", "error", "recent_daily",
+                        "average_daily"):
+                entry[key] = row[key]
+            entries.append(entry)
+        return entries
+
+    def get_topology(self, key):
+        """返回 (options, fetched_at)，没有该节点时返回 None。"""
+        row = self._connect().execute("SELECT options_json, fetched_at FROM topology WHERE key = ?", (key,)).fetchone()
+        return (json.loads(row["options_json"]), row["fetched_at"]) if row else None
+
+    def put_topology(self, nodes):
+        """一个事务写入多个节点 nodes = [(key, options, fetched_at), ...]。"""
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                """INSERT INTO topology (key, options_json, fetched_at) VALUES (?, ?, ?)
+                   ON CONFLICT (key) DO UPDATE SET options_json = excluded.options_json, fetched_at = excluded.fetched_at""",
+                [(key, json.dumps(options, ensure_ascii=False), fetched_at) for key, options, fetched_at in nodes])
+
+    def delete_topology(self, prefix=None):
+        """prefix 为空时删除全部节点，否则删除该节点及其子节点 (key 以 "prefix:" 开头)，返回删除数。"""
+        conn = self._connect()
+        with conn:
+            if prefix is None:
+                return conn.execute("DELETE FROM topology").rowcount
+            return conn.execute("DELETE FROM topology WHERE key = ? OR substr(key, 1, ?) = ?",
+                                (prefix, len(prefix) + 1, f"{prefix}:")).rowcount
+
+    def topology_stats(self, fresh_since):
+        row = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(fetched_at >= ?), 0) FROM topology", (fresh_since,)).fetchone()
+        return {'nodes': row[0], 'fresh': row[1], 'stale': row[0] - row[1]}
+
+    def try_lock(self, name, owner, ttl):
+        """尝试获取名为 name 的锁 (过期的锁会被接管)，成功返回 True。"""
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM locks WHERE name = ? AND expires_at < ?", (name, now))
+            conn.execute("INSERT OR IGNORE INTO locks (name, owner, expires_at) VALUES (?, ?, ?)",
+                         (name, owner, now + ttl))
+            row = conn.execute("SELECT owner FROM locks WHERE name = ?", (name,)).fetchone()
+        return row is not None and row["owner"] == owner
+
+    def lock_owner(self, name):
+        """锁当前的持有者，未被持有或已过期时返回 None。"""
+        row = self._connect().execute(
+            "SELECT owner FROM locks WHERE name = ? AND expires_at >= ?", (name, time.time())).fetchone()
+        return row["owner"] if row else None
+
+    def extend_lock(self, name, owner, ttl):
+        """延长仍由 owner 持有的锁，返回是否仍持有。"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute("UPDATE locks SET expires_at = ? WHERE name = ? AND owner = ?",
+                                  (time.time() + ttl, name, owner))
+        return cursor.rowcount > 0
+
+    def release_lock(self, name, owner):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner))
+
+    def get_state(self, key):
+        row = self._connect().execute("SELECT value_json FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["value_json"]) if row else None
+
+    def set_state(self, key, value):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                """INSERT INTO state (key, value_json, updated_at) VALUES (?, ?, ?)
+                   ON CONFLICT (key) DO UPDATE SET value_json = excluded.value_json, updated_at = excluded.updated_at""",
+                (key, json.dumps(value, ensure_ascii=False), time.time()))
+
+    @staticmethod
+    def _job(row):
+        job = dict(row)
+        job["target"] = json.loads(job.pop("target_json"))
+        job["result"] = json.loads(job.pop("result_json")) if job["result_json"] else None
+        return job
+
+    def create_job(self, job_id, room_key, target, start_date, end_date, active_since, runner=None):
+        """
+        新建 queued 任务，返回 (任务, 是否新建)。同一 room_key 已有 active_since (时间戳) 之后仍在更新的
+        queued / running 任务时不新建，直接返回该任务；检查和插入在同一个写事务中，多进程并发提交也只会有一个。
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                """SELECT * FROM jobs WHERE room_key = ? AND status IN ('queued', 'running') AND updated_at >= ?
+                   ORDER BY created_at DESC LIMIT 1""", (room_key, active_since)).fetchone()
+            if row is None:
+                conn.execute(
+                    """INSERT INTO jobs (id, room_key, runner, target_json, start_date, end_date, status, created_at,
+                                       updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?)""",
+                    (job_id, room_key, runner, json.dumps(target, ensure_ascii=False), start_date, end_date, now, now))
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                created = True
+            else:
+                created = False
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return self._job(row), created
+
+    def update_job(self, job_id, **fields):
+        """
+        更新任务字段 (status、pages_done、pages_total、record_count、result、error、finished_at)，返回是否更新。
+        已结束 (done / failed) 的任务不会被覆盖。
+        """
+        if 'result' in fields:
+            fields['result_json'] = json.dumps(fields.pop('result'), ensure_ascii=False)
+        fields['updated_at'] = time.time()
+        conn = self._connect()
+        with conn:
+            return conn.execute(
+                f"""UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)}
+                    WHERE id = ? AND status IN ('queued', 'running')""", (*fields.values(), job_id)).rowcount > 0
+
+    def heartbeat_jobs(self, job_ids):
+        """刷新仍未结束的任务的 updated_at。"""
+        if not job_ids:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                f"""UPDATE jobs SET updated_at = ? WHERE id IN ({', '.join('?' * len(job_ids))})
+                    AND status IN ('queued', 'running')""", (time.time(), *job_ids))
+
+    def get_job(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def prune_jobs(self, finished_before):
+        """删除 finished_before (时间戳) 之前已结束的任务，返回删除数。"""
+        conn = self._connect()
+        with conn:
+            return conn.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                                (finished_before,)).rowcount
+
+    def import_legacy_json(self, json_path):
+        """把旧版单房间 JSON 缓存导入数据库（缺少 value 的旧文件无法定位房间，直接跳过）。"""
+        if not os.path.exists(json_path):
+            return False
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return False
+        info = data.get("info", {})
+        if not all(info.get(key) for key in ("building_value", "floor_value", "room_value")):
+            return False
+        existing = self.get_room(info["building_value"], info["floor_value"], info["room_value"])
+        if existing and (existing.get("scrape_time") or "") >= (info.get("scrape_time") or ""):
+            return False
+        self.save_room(info, data.get("records", []))
+        return True
@@ -0,0 +1,82 @@
+import json
+import os
+import queue
+import threading
+
+# --- 流式查询响应 ---
+# /api/query/stream 把一次查询拆成多帧发送：balance (剩余电量) -> 若干 records 批次 -> summary，出错时为 error 帧。
+# 帧格式为 NDJSON (每行一个 JSON 对象，默认) 或 Server-Sent Events (format=sse 或 Accept: text/event-stream)。
+# 爬取在后台线程进行，scrape_room_data 每解析完一页就通过 PageRelay 把该页记录交给响应生成器，
+# 发送完即释放；队列有界，客户端读得慢时爬取线程等待，客户端断开后爬取线程不再等待 (继续完成爬取并写库)。
+
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 200))
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', 4))
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+}
+
+
+def stream_format(requested=None, accept=None):
+    if requested in FORMATS:
+        return requested
+    return 'sse' if 'text/event-stream' in (accept or '') else 'ndjson'
+
+
+def encode_frame(frame, fmt):
+    data = json.dumps(frame, ensure_ascii=False)
+    if fmt == 'sse':
+        return f"event: {frame['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+def encode_frames(frames, fmt):
+    for frame in frames:
+        yield encode_frame(frame, fmt)
+
+
+class PageRelay:
+    """把后台爬取线程中逐页产出的 (剩余电量, RecordColumns) 交给响应生成器，结束后可读取 fn 的返回值。"""
+
+    def __init__(self, maxsize=STREAM_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize)
+        self._cancelled = threading.Event()
+        self.result = None
+        self.pages = 0
+
+    def _put(self, item):
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def on_page(self, remaining, records):
+        self._put(('page', (remaining, records)))
+
+    def start(self, fn):
+        """在后台线程执行 fn()；fn 应把 self.on_page 作为每页回调。"""
+        def worker():
+            try:
+                self._put(('done', fn()))
+            except Exception as e:
+                self._put(('error', e))
+        threading.Thread(target=worker, name='stream-scrape', daemon=True).start()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def __iter__(self):
+        """逐页产出 (剩余电量, RecordColumns)；fn 抛出的异常在这里重新抛出，返回值存入 self.result。"""
+        while True:
+            kind, value = self._queue.get()
+            if kind == 'page':
+                self.pages += 1
+                yield value
+            elif kind == 'error':
+                raise value
+            else:
+                self.result = value
+                return
@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from simulator import SimulatorConfig, start_simulator  # noqa: E402
+
+# app 在导入时读取环境变量并打开数据库：先启动模拟器、指向临时目录，再导入 app
+_server, _simulator, _base_url = start_simulator(SimulatorConfig(page_size=20))
+_data_dir = tempfile.mkdtemp(prefix='electricity-tests-')
+os.environ.update(
+    UPSTREAM_BASE_URL=_base_url,
+    ELECTRICITY_DB=os.path.join(_data_dir, 'app.db'),
+    TOPOLOGY_CACHE_FILE=os.path.join(_data_dir, 'topology_cache.json'),
+    SCHEDULER_ENABLED='0',
+    LOG_LEVEL='WARNING',
+)
+
+
+@pytest.fixture(scope='session')
+def simulator():
+    return _simulator
+
+
+@pytest.fixture
+def store(tmp_path):
+    from storage import ElectricityStore
+    return ElectricityStore(str(tmp_path / 'electricity.db'))
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
@@ -0,0 +1,48 @@
+import threading
+import time
+
+from jobs import JobRunner
+
+
+def _wait(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_queued_job_keeps_heartbeat(store):
+    # 单线程执行：b 在 a 完成前一直排队，排队时间超过 stale_after 也不能被判为中断或重复登记
+    ran = []
+    release = threading.Event()
+
+    def run_fn(target, start_date, end_date, on_progress):
+        ran.append(target['room'])
+        if target['room'] == 'a':
+            release.wait(5)
+        return {"id": 1}, None
+
+    runner = JobRunner(store, run_fn, max_concurrency=1, stale_after=0.3)
+    runner.submit('a', {'room': 'a'}, None, None)
+    job_b, _ = runner.submit('b', {'room': 'b'}, None, None)
+    time.sleep(0.6)
+    assert runner.get(job_b['id'])['status'] == 'queued'
+    duplicate, created = runner.submit('b', {'room': 'b'}, None, None)
+    assert not created and duplicate['id'] == job_b['id']
+
+    release.set()
+    assert _wait(lambda: runner.get(job_b['id'])['status'] == 'done')
+    assert ran == ['a', 'b']
+
+
+def test_finished_job_is_not_revived(store):
+    ran = []
+    runner = JobRunner(store, lambda target, *args: ran.append(target) or ({"id": 1}, None), stale_after=60)
+    job, _ = store.create_job('j1', 'k', {'room': 'x'}, None, None, 0)
+    assert store.update_job('j1', status='failed', error="任务已中断")
+    runner._run('j1', {'room': 'x'}, None, None)
+    assert ran == []
+    assert not store.update_job('j1', status='done')
+    assert store.get_job('j1')['status'] == 'failed'
@@ -0,0 +1,15 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _child_scheduler_state():
+    # 模拟解析进程重新执行入口模块：即使开启了后台调度，子进程中也不能启动
+    os.environ['SCHEDULER_ENABLED'] = '1'
+    import app
+    return app.SCHEDULER_ENABLED, app.refresh_scheduler._thread is None, app.balance_refresher._thread is None
+
+
+def test_spawned_workers_do_not_start_schedulers():
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        assert pool.submit(_child_scheduler_state).result(timeout=60) == (False, True, True)
@@ -0,0 +1,99 @@
+from datetime import date, timedelta
+
+import pytest
+
+HISTORY = {"history_start": "2026-01-01", "history_end": "2026-03-31", "scrape_time": "2026-03-31 12:00:00"}
+
+
+@pytest.fixture
+def plan(app_module):
+    return app_module.plan_segments
+
+
+def test_no_history_fetches_whole_range(plan):
+    assert plan(None, "2026-01-01", "2026-02-01") == ([("2026-01-01", "2026-02-01")], "2026-01-01", "2026-02-01")
+    assert plan({"scrape_time": "2026-03-31 12:00:00"}, "2026-01-01", "2026-02-01")[0] == [("2026-01-01", "2026-02-01")]
+
+
+def test_covered_range_needs_nothing(plan):
+    assert plan(HISTORY, "2026-01-10", "2026-02-10") == ([], "2026-01-01", "2026-03-31")
+
+
+def test_head_gap(plan):
+    segments, start, end = plan(HISTORY, "2025-12-01", "2026-02-01")
+    assert segments == [("2025-12-01", "2025-12-31")]
+    assert (start, end) == ("2025-12-01", "2026-03-31")
+
+
+def test_tail_refetches_last_stored_day(plan):
+    # history_end 当天爬取时可能不完整
+    assert plan(HISTORY, "2026-03-01", "2026-04-15")[0] == [("2026-03-31", "2026-04-15")]
+    assert plan(HISTORY, "2026-03-31", "2026-03-31")[0] == [("2026-03-31", "2026-03-31")]
+
+
+def test_tail_without_refresh(plan):
+    assert plan(HISTORY, "2026-03-01", "2026-04-15", refresh_tail=False)[0] == [("2026-04-01", "2026-04-15")]
+    assert plan(HISTORY, "2026-03-01", "2026-03-31", refresh_tail=False)[0] == []
+
+
+def test_gap_after_history_is_filled(plan):
+    # 请求范围与已存历史不相邻：空档一并获取，覆盖范围保持连续
+    segments, start, end = plan(HISTORY, "2026-05-01", "2026-05-10")
+    assert segments == [("2026-03-31", "2026-05-10")]
+    assert (start, end) == ("2026-01-01", "2026-05-10")
+
+
+def test_gap_before_history_is_filled(plan):
+    segments, start, end = plan(HISTORY, "2025-10-01", "2025-10-10")
+    assert segments == [("2025-10-01", "2025-12-31")]
+    assert (start, end) == ("2025-10-01", "2026-03-31")
+
+
+def test_both_sides(plan):
+    segments, start, end = plan(HISTORY, "2025-12-01", "2026-04-10")
+    assert segments == [("2025-12-01", "2025-12-31"), ("2026-03-31", "2026-04-10")]
+    assert (start, end) == ("2025-12-01", "2026-04-10")
+
+
+def test_legacy_room_uses_scrape_date_as_history_end(plan):
+    legacy = {"history_start": "2026-01-01", "scrape_time": "2026-02-15 08:00:00"}
+    assert plan(legacy, "2026-01-01", "2026-03-01")[0] == [("2026-02-15", "2026-03-01")]
+
+
+def test_end_date_capped_at_today(plan):
+    today = date.today()
+    start = (today - timedelta(days=10)).isoformat()
+    segments, _, end = plan(None, start, (today + timedelta(days=30)).isoformat())
+    assert segments == [(start, today.isoformat())] and end == today.isoformat()
+
+
+def test_incremental_disabled(plan, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'INCREMENTAL_SCRAPE', False)
+    assert plan(HISTORY, "2026-01-10", "2026-02-10")[0] == [("2026-01-10", "2026-02-10")]
+
+
+def test_second_scrape_only_requests_tail(app_module, client, monkeypatch):
+    # 端到端 (模拟器)：第一次爬取完整范围，缓存过期后再次查询只请求 history_end 当天起的后段
+    requested = []
+    scrape_room_data = app_module.scrape_room_data
+
+    def spy(session, building_value, floor_value, room_value, form_data, segments, *args, **kwargs):
+        requested.append(list(segments))
+        return scrape_room_data(session, building_value, floor_value, room_value, form_data, segments, *args,
+                                **kwargs)
+
+    monkeypatch.setattr(app_module, 'scrape_room_data', spy)
+    today = date.today()
+    query = {"building": "2号楼", "floor": "3层", "room": "305",
+             "start_date": (today - timedelta(days=30)).isoformat(), "end_date": today.isoformat()}
+    first = client.get('/api/query', query_string=query)
+    assert first.status_code == 200 and first.json['records']
+    assert requested == [[(query['start_date'], query['end_date'])]]
+
+    info = app_module.store.find_room("2号楼", "3层", "305")
+    monkeypatch.setattr(app_module, 'CACHE_MAX_AGE', 0)
+    requested.clear()
+    app_module.scrape_target_once(info, query['start_date'], query['end_date'])
+    assert requested == [[(today.isoformat(), today.isoformat())]]
+    stored = app_module.store.get_records(info['id'], query['start_date'], query['end_date'])
+    assert len(stored) == len(first.json['records'])
@@ -0,0 +1,81 @@
+import pytest
+
+INFO = {"building": "1号楼", "floor": "1层", "room": "101", "building_value": "1", "floor_value": "101",
+        "room_value": "10101", "scrape_time": "2026-03-01 12:00:00"}
+
+
+def _record(day, meter_name, usage, price=0.5):
+    return {"date": day, "meter_name": meter_name, "usage": str(usage), "price": str(price)}
+
+
+def _assert_totals_match_rollups(store, room_id):
+    # 房间累计值按差值增量更新，必须始终等于全部每日汇总之和
+    rollups = store.get_daily_rollups(room_id)
+    totals = store.get_usage_totals(room_id)
+    assert totals["usage"] == pytest.approx(sum(r["usage"] for r in rollups))
+    assert totals["cost"] == pytest.approx(sum(r["cost"] for r in rollups))
+    assert totals["days"] == len(rollups)
+    return rollups, totals
+
+
+def test_rollups_on_first_save(store):
+    room_id = store.save_room(INFO, [
+        _record("2026-02-01", "照明", 2.0),
+        _record("2026-02-01", "空调", 3.0, price=0.6),
+        _record("2026-02-02", "照明", 1.0),
+    ])
+    rollups, totals = _assert_totals_match_rollups(store, room_id)
+    assert [r["date"] for r in rollups] == ["2026-02-02", "2026-02-01"]
+    day = rollups[1]
+    assert day["usage"] == pytest.approx(5.0)
+    assert day["ac_usage"] == pytest.approx(3.0)
+    assert day["cost"] == pytest.approx(2.0 * 0.5 + 3.0 * 0.6)
+    assert day["record_count"] == 2 and day["meters"] == ["照明", "空调"]
+    assert totals["average_daily"] == pytest.approx(6.0 / 2)
+
+
+def test_merge_applies_deltas(store):
+    room_id = store.save_room(INFO, [_record("2026-02-01", "照明", 2.0), _record("2026-02-02", "照明", 1.0)])
+
+    # 同日同表的新值覆盖旧值：用量差值计入累计，天数不变
+    store.save_room(INFO, [_record("2026-02-02", "照明", 4.0)], merge=True)
+    _, totals = _assert_totals_match_rollups(store, room_id)
+    assert totals["usage"] == pytest.approx(6.0) and totals["days"] == 2
+
+    # 新的一天：天数加一，其他日期的汇总不受影响
+    store.save_room(INFO, [_record("2026-02-03", "空调", 5.0)], merge=True)
+    rollups, totals = _assert_totals_match_rollups(store, room_id)
+    assert totals["usage"] == pytest.approx(11.0) and totals["days"] == 3
+    assert rollups[0]["ac_usage"] == pytest.approx(5.0)
+    assert rollups[2]["usage"] == pytest.approx(2.0)
+
+    # 没有记录的合并写入不改变汇总
+    store.save_room({**INFO, "scrape_time": "2026-03-02 12:00:00"}, [], merge=True)
+    assert store.get_usage_totals(room_id)["usage"] == pytest.approx(11.0)
+
+
+def test_replace_recomputes_everything(store):
+    room_id = store.save_room(INFO, [_record("2026-02-01", "照明", 2.0), _record("2026-02-02", "照明", 1.0),
+                                     _record("2026-02-03", "照明", 7.0)])
+    store.save_room(INFO, [_record("2026-02-02", "照明", 1.5)], merge=False)
+    rollups, totals = _assert_totals_match_rollups(store, room_id)
+    assert [r["date"] for r in rollups] == ["2026-02-02"]
+    assert totals["usage"] == pytest.approx(1.5) and totals["days"] == 1
+
+
+def test_rollups_are_per_room(store):
+    first = store.save_room(INFO, [_record("2026-02-01", "照明", 2.0)])
+    second = store.save_room({**INFO, "room": "102", "room_value": "10102"}, [_record("2026-02-01", "照明", 9.0)])
+    store.save_room(INFO, [_record("2026-02-01", "照明", 3.0)], merge=True)
+    assert store.get_usage_totals(first)["usage"] == pytest.approx(3.0)
+    assert store.get_usage_totals(second)["usage"] == pytest.approx(9.0)
+
+
+def test_period_totals(store):
+    room_id = store.save_room(INFO, [_record("2026-01-31", "照明", 1.0), _record("2026-02-01", "照明", 2.0),
+                                     _record("2026-02-02", "照明", 4.0)])
+    months = store.get_period_totals(room_id, 'month')
+    assert [(m["period"], m["usage"], m["days"]) for m in months] == [("2026-02", 6.0, 2), ("2026-01", 1.0, 1)]
+    # 2026-02-02 是周一
+    weeks = store.get_period_totals(room_id, 'week')
+    assert [(w["period"], w["usage"]) for w in weeks] == [("2026-02-02", 4.0), ("2026-01-26", 3.0)]
@@ -0,0 +1,79 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+
+@pytest.mark.parametrize('cursor, room_id, expected', [
+    ("7.42", 7, 42),
+    ("7.0", 7, 0),
+    ("8.42", 7, 0),        # 其他房间的游标
+    (None, 7, 0),
+    ("", 7, 0),
+    ("abc", 7, 0),
+    ("7", 7, 0),
+    ("7.42.1", 7, 0),
+    ("7.x", 7, 0),
+    (42, 7, 0),
+])
+def test_parse_sync_cursor(app_module, cursor, room_id, expected):
+    assert app_module.parse_sync_cursor(cursor, room_id) == expected
+
+
+def _seed_room(app_module, room_value, records):
+    # 写入一个覆盖查询范围、缓存新鲜的房间，/api/sync 不需要访问上游
+    today = date.today()
+    info = {"building": "9号楼", "floor": "9层", "room": room_value, "building_value": "9", "floor_value": "909",
+            "room_value": room_value, "scrape_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "history_start": (today - timedelta(days=30)).isoformat(), "history_end": today.isoformat()}
+    return info, app_module.store.save_room(info, records, merge=False)
+
+
+def _record(days_ago, meter_name, usage):
+    return {"date": (date.today() - timedelta(days=days_ago)).isoformat(), "meter_name": meter_name,
+            "usage": str(usage), "price": "0.5"}
+
+
+def _sync(client, room_value, since=None):
+    today = date.today()
+    query = {"building_value": "9", "floor_value": "909", "room_value": room_value,
+             "start_date": (today - timedelta(days=30)).isoformat(), "end_date": today.isoformat()}
+    if since is not None:
+        query["since"] = since
+    response = client.get('/api/sync', query_string=query)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.json
+
+
+def test_sync_incremental_and_reset(app_module, client):
+    info, room_id = _seed_room(app_module, "90901", [_record(1, "照明", 1.0), _record(2, "照明", 2.0)])
+
+    first = _sync(client, "90901")
+    assert first["full"] and len(first["records"]) == 2
+    assert first["cursor"].startswith(f"{room_id}.")
+
+    unchanged = _sync(client, "90901", first["cursor"])
+    assert not unchanged["full"] and unchanged["records"] == []
+
+    # 合并写入：同值记录不重复返回，只返回变化和新增的记录
+    app_module.store.save_room(info, [_record(1, "照明", 1.0), _record(2, "照明", 2.5), _record(0, "空调", 3.0)],
+                               merge=True)
+    delta = _sync(client, "90901", first["cursor"])
+    assert not delta["full"]
+    assert sorted((r["meter_name"], r["usage"]) for r in delta["records"]) == [("照明", 2.5), ("空调", 3.0)]
+
+    # 整体替换 (merge=False) 之后，更早的游标无法表示被删除的记录，需要全量同步
+    app_module.store.save_room(info, [_record(1, "照明", 1.0)], merge=False)
+    reset = _sync(client, "90901", delta["cursor"])
+    assert reset["full"] and len(reset["records"]) == 1
+
+    # 替换之后拿到的新游标恢复增量同步
+    after = _sync(client, "90901", reset["cursor"])
+    assert not after["full"] and after["records"] == []
+
+
+def test_sync_foreign_or_future_cursor_is_full(app_module, client):
+    _, room_id = _seed_room(app_module, "90902", [_record(1, "照明", 1.0)])
+    assert _sync(client, "90902", f"{room_id + 1000}.5")["full"]
+    # 游标版本大于服务端版本 (如数据库被重建)：全量同步
+    assert _sync(client, "90902", f"{room_id}.99999")["full"]
+    assert _sync(client, "90902", "garbage")["full"]
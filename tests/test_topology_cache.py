@@ -0,0 +1,30 @@
+from topology_cache import TopologyCache
+
+OPTIONS = [{"text": "1号楼", "value": "1"}]
+
+
+def test_memo_avoids_database_reads(store, monkeypatch):
+    cache = TopologyCache(store, ttl=3600, memo_ttl=60)
+    assert cache.get("buildings", lambda: OPTIONS) == OPTIONS
+
+    # 写入后的查询直接命中进程内缓存
+    reads = []
+    original = store.get_topology
+    monkeypatch.setattr(store, 'get_topology', lambda key: reads.append(key) or original(key))
+    assert cache.get("buildings", lambda: []) == OPTIONS
+    assert cache.peek("buildings", fresh_only=True) == OPTIONS
+    assert reads == []
+
+    # 本进程失效立即生效，之后回落到数据库
+    cache.invalidate("buildings")
+    assert cache.peek("buildings") is None
+    assert reads == ["buildings"]
+
+
+def test_memo_expires_for_other_workers(store):
+    writer, reader = TopologyCache(store, ttl=3600, memo_ttl=60), TopologyCache(store, ttl=3600, memo_ttl=0)
+    writer.get("buildings", lambda: OPTIONS)
+    assert reader.peek("buildings") == OPTIONS
+    # 其他 worker 删除节点：memo 过期后 (此处 memo_ttl=0) 读到的是数据库中的结果
+    writer.invalidate()
+    assert reader.peek("buildings") is None
@@ -0,0 +1,59 @@
+from datetime import date
+
+from watchlist import WATCHLIST_USAGE_DAYS, BalanceRefresher
+
+
+def _watch(store, room_value):
+    room_id = store.ensure_room({"building": "1号楼", "floor": "1层", "room": room_value, "building_value": "1",
+                                 "floor_value": "101", "room_value": room_value})
+    store.watch_room(room_id, None, None)
+    return room_id
+
+
+def test_batch_runs_once_per_interval_across_workers(store):
+    _watch(store, "10101")
+    calls = []
+
+    def fetch(building_value, floors):
+        calls.append(building_value)
+        return {(floor_value, room_value): 42.0 for floor_value, rooms in floors.items() for room_value in rooms}
+
+    # 两个 worker 各自的刷新器共用同一个数据库
+    first, second = BalanceRefresher(store, fetch, interval=600), BalanceRefresher(store, fetch, interval=600)
+    summary = first.run_once()
+    assert summary["ok"] == 1
+    assert second.run_once() is None
+    assert calls == ["1"]
+
+    # 最近一次汇总保存在数据库中，其他 worker 读到的是同一份
+    assert second.last_run == summary
+    assert not second.running()
+
+    # 手动触发不受节拍锁限制
+    assert second.run_once(scheduled=False)["ok"] == 1
+    assert calls == ["1", "1"]
+
+
+def test_registration_enqueues_short_history_jobs(app_module, client, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(app_module.job_runner, 'submit',
+                        lambda key, target, start, end: submitted.append((target['room'], start, end)))
+    single = client.post('/api/watchlist', json={"building": "1号楼", "floor": "2层", "room": "201"})
+    assert single.status_code == 201
+    assert len(submitted) == 1
+    room, start, end = submitted[0]
+    assert room == "201" and (date.fromisoformat(end) - date.fromisoformat(start)).days == WATCHLIST_USAGE_DAYS - 1
+
+    # 批量登记默认不登记刷新任务
+    submitted.clear()
+    bulk = client.post('/api/watchlist', json={"rooms": [{"building": "1号楼", "floor": "2层", "room": "202"},
+                                                         {"building": "1号楼", "floor": "2层", "room": "203"}]})
+    assert bulk.status_code == 201 and len(bulk.json["added"]) == 2
+    assert submitted == []
+
+    # 已覆盖最近几天的房间不再登记
+    info = app_module.store.find_room("1号楼", "2层", "201")
+    app_module.store.save_room({**info, "history_start": start, "history_end": end,
+                                "scrape_time": f"{end} 00:00:00"}, [], merge=True)
+    client.post('/api/watchlist', json={"building": "1号楼", "floor": "2层", "room": "201"})
+    assert submitted == []
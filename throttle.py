@@ -0,0 +1,148 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+import requests
+
+from logs import get_logger
+
+# --- 自适应上游限速 + 熔断 ---
+# 替代固定的 REQUEST_DELAY：上游响应正常时不做任何等待；
+# 出现 5xx / 429 / 超时 / 连接错误时按指数退避 (带随机抖动) 拉长请求间隔，成功后立即恢复全速；
+# 响应延迟的滑动平均超过 THROTTLE_SLOW_LATENCY 时加入少量间隔，减轻上游压力；
+# 连续失败 THROTTLE_FAILURE_THRESHOLD 次后熔断：THROTTLE_RESET_TIMEOUT 秒内所有请求直接抛出 UpstreamUnavailable
+# (调用方返回缓存或 503)，之后放行一个探测请求，成功则恢复，失败则继续熔断。
+# 同一进程内的所有上游请求 (app.py、electric_fee_scraper.py、异步客户端) 共用 upstream_throttle。
+
+THROTTLE_BASE_DELAY = float(os.environ.get('THROTTLE_BASE_DELAY', 0.2))
+THROTTLE_MAX_DELAY = float(os.environ.get('THROTTLE_MAX_DELAY', 10))
+THROTTLE_SLOW_LATENCY = float(os.environ.get('THROTTLE_SLOW_LATENCY', 3))
+THROTTLE_FAILURE_THRESHOLD = int(os.environ.get('THROTTLE_FAILURE_THRESHOLD', 5))
+THROTTLE_RESET_TIMEOUT = float(os.environ.get('THROTTLE_RESET_TIMEOUT', 30))
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+log = get_logger('throttle')
+
+
+class UpstreamUnavailable(RuntimeError):
+    """熔断期间拒绝访问上游；retry_after 为距离下一次探测的秒数。"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"上游暂时不可用，请 {int(retry_after) + 1} 秒后重试")
+        self.retry_after = retry_after
+
+
+def is_failure_status(status_code):
+    return status_code >= 500 or status_code == 429
+
+
+class AdaptiveThrottle:
+    def __init__(self, base_delay=THROTTLE_BASE_DELAY, max_delay=THROTTLE_MAX_DELAY,
+                 slow_latency=THROTTLE_SLOW_LATENCY, failure_threshold=THROTTLE_FAILURE_THRESHOLD,
+                 reset_timeout=THROTTLE_RESET_TIMEOUT, latency_alpha=0.2):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.slow_latency = slow_latency
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_alpha = latency_alpha
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._latency = 0.0
+        self._state = CLOSED
+        self._opened_at = 0.0
+
+    def _delay_locked(self):
+        if self._failures:
+            backoff = min(self.max_delay, self.base_delay * 2 ** (self._failures - 1))
+            return random.uniform(backoff / 2, backoff)
+        if self._latency > self.slow_latency:
+            return random.uniform(0, self.base_delay)
+        return 0.0
+
+    def acquire(self):
+        """返回本次请求前应等待的秒数；熔断中抛出 UpstreamUnavailable。"""
+        with self._lock:
+            if self._state != CLOSED:
+                # 熔断中 (或探测请求尚未返回)：冷却结束后只放行一个探测请求
+                remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+                if remaining > 0:
+                    raise UpstreamUnavailable(remaining)
+                self._state = HALF_OPEN
+                self._opened_at = time.monotonic()
+                return 0.0
+            return self._delay_locked()
+
+    def wait(self):
+        delay = self.acquire()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    async def wait_async(self):
+        delay = self.acquire()
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+    def record_success(self, latency):
+        with self._lock:
+            self._failures = 0
+            self._latency += self.latency_alpha * (latency - self._latency)
+            if self._state != CLOSED:
+                log.info('circuit.closed', latency=round(latency, 3))
+            self._state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    log.warning('circuit.open', failures=self._failures, reset_timeout=self.reset_timeout)
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def record(self, status_code, latency):
+        if is_failure_status(status_code):
+            self.record_failure()
+        else:
+            self.record_success(latency)
+
+    def is_open(self):
+        with self._lock:
+            return self._state != CLOSED and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "failures": self._failures,
+                "latency": round(self._latency, 3),
+                "delay": round(min(self.max_delay, self.base_delay * 2 ** (self._failures - 1)), 3) if self._failures else 0.0,
+            }
+
+
+upstream_throttle = AdaptiveThrottle()
+
+
+class ThrottledSessionMixin:
+    """混入 requests.Session：每次发送前经过 throttle，并按响应结果调整后续间隔。"""
+    throttle = upstream_throttle
+
+    def send(self, request, **kwargs):
+        self.throttle.wait()
+        start = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+        except requests.exceptions.RequestException:
+            self.throttle.record_failure()
+            raise
+        self.throttle.record(response.status_code, time.monotonic() - start)
+        return response
+
+
+class ThrottledSession(ThrottledSessionMixin, requests.Session):
+    pass
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+
+from logs import get_logger
+
+# --- 楼栋/楼层/房间 拓扑缓存 ---
+# 拓扑按节点缓存，每个节点对应一次上游选项查询：
+#   "buildings"                       -> 楼栋列表
+#   "floors:<building_value>"         -> 某楼栋的楼层列表
+#   "rooms:<building_value>:<floor>"  -> 某楼层的房间列表
+#   "rooms:<building_value>:<floor>:form" -> 选择该楼层后页面的表单隐藏字段 (VIEWSTATE 等)；
+#       已知房间 value 时直接用它选择房间，省去 GET 首页和楼栋、楼层回发，失效房间列表时一并清除
+# 每个节点保存 options([{"text", "value"}]) 和 fetched_at(时间戳)，存放在 SQLite (storage.topology) 中：
+# 多个 worker 进程读写同一份数据，POST /api/options/invalidate 删除的节点对所有进程可见 (见下方 memo)。
+# 旧版的 JSON 缓存文件在表为空时导入一次。
+# 回发过程中顺带看到的选项 (put) 交给后台写线程：与已存节点相同且未过期时不写，请求路径上不做数据库写入。
+# 数据库前面还有一层进程内缓存 (memo)：节点从数据库读出或由本进程写入后在内存中保留 memo_ttl 秒，
+# 期间的查询不访问数据库也不再解析 JSON；节点过期 (fetched_at + ttl) 仍按原规则在后台重新验证。
+# 本进程的 invalidate 立即清除对应的 memo，其他进程的失效最多 memo_ttl 秒后可见。
+
+log = get_logger('topology_cache')
+
+
+def buildings_key():
+    return "buildings"
+
+
+def floors_key(building_value):
+    return f"floors:{building_value}"
+
+
+def rooms_key(building_value, floor_value):
+    return f"rooms:{building_value}:{floor_value}"
+
+
+def room_form_key(building_value, floor_value):
+    return f"{rooms_key(building_value, floor_value)}:form"
+
+
+class StaleRoomForm(RuntimeError):
+    """用缓存的楼层表单选择房间失败 (表单过期或被上游拒绝)，需要重新回发。"""
+
+
+def find_value(options, text):
+    return next((opt['value'] for opt in options if opt['text'] == text), None)
+
+
+class TopologyCache:
+    """
+    带 TTL 的拓扑缓存。未命中时同步获取；过期时先返回旧数据，再在后台线程重新验证。
+    fetcher 为无参函数，返回 options 列表（空列表视为获取失败，不写入缓存）。
+    """
+
+    def __init__(self, store, ttl, legacy_path=None, memo_ttl=5):
+        self.store = store
+        self.ttl = ttl
+        self.memo_ttl = memo_ttl
+        self._memo = {}
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._pending = {}
+        self._wake = threading.Event()
+        self._writer = None
+        if legacy_path:
+            self._import_legacy(legacy_path)
+
+    def _import_legacy(self, path):
+        if not os.path.exists(path) or self.store.topology_stats(0)['nodes']:
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                nodes = json.load(f).get('nodes', {})
+        except (json.JSONDecodeError, OSError) as e:
+            log.warning('topology.load_failed', path=path, error=str(e))
+            return
+        self.store.put_topology([(key, node['options'], node['fetched_at']) for key, node in nodes.items()])
+        log.info('topology.imported', path=path, nodes=len(nodes))
+
+    def _load(self, key):
+        """(options, fetched_at) 或 None：先查进程内 memo，未命中或已超过 memo_ttl 时读数据库。"""
+        now = time.time()
+        entry = self._memo.get(key)
+        if entry and now - entry[2] < self.memo_ttl:
+            return entry[0], entry[1]
+        node = self.store.get_topology(key)
+        if node:
+            self._memo[key] = (node[0], node[1], now)
+        else:
+            self._memo.pop(key, None)
+        return node
+
+    def _remember(self, nodes):
+        now = time.time()
+        for key, options, fetched_at in nodes:
+            self._memo[key] = (options, fetched_at, now)
+
+    def _store(self, key, options):
+        if options:
+            nodes = [(key, options, time.time())]
+            self.store.put_topology(nodes)
+            self._remember(nodes)
+
+    def _revalidate(self, key, fetcher):
+        try:
+            self._store(key, fetcher())
+        except Exception as e:
+            log.warning('topology.refresh_failed', key=key, error=str(e))
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, key, fetcher):
+        node = self._load(key)
+        if node:
+            options, fetched_at = node
+            with self._lock:
+                if time.time() - fetched_at >= self.ttl and key not in self._refreshing:
+                    self._refreshing.add(key)
+                    threading.Thread(target=self._revalidate, args=(key, fetcher), daemon=True).start()
+            return options
+
+        options = fetcher()
+        self._store(key, options)
+        return options
+
+    def peek(self, key, fresh_only=False):
+        """不访问上游只读缓存；fresh_only 时过期节点视为不存在。"""
+        node = self._load(key)
+        if not node or (fresh_only and time.time() - node[1] >= self.ttl):
+            return None
+        return node[0]
+
+    def put(self, key, options):
+        """登记一次顺带看到的选项，由后台线程写入；同一节点多次 put 只写最后一次。"""
+        if not options:
+            return
+        with self._lock:
+            self._pending[key] = options
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='topology-writer', daemon=True)
+                self._writer.start()
+        self._wake.set()
+
+    def flush(self):
+        """写入全部待写节点，返回实际写入数 (选项未变化且未过期的节点跳过)。"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        now = time.time()
+        changed = []
+        for key, options in pending.items():
+            node = self._load(key)
+            if node is None or node[0] != options or now - node[1] >= self.ttl:
+                changed.append((key, options, now))
+        if changed:
+            self.store.put_topology(changed)
+            self._remember(changed)
+        return len(changed)
+
+    def _write_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                log.warning('topology.write_failed', error=str(e))
+
+    def invalidate(self, prefix=None):
+        # prefix 为空时清空全部；否则删除该节点及其子节点（如 "rooms:3" 清空 3 号楼所有楼层的房间）
+        for key in list(self._memo):
+            if prefix is None or key == prefix or key.startswith(f"{prefix}:"):
+                self._memo.pop(key, None)
+        return self.store.delete_topology(prefix)
+
+    def stats(self):
+        return self.store.topology_stats(time.time() - self.ttl)
@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from metrics import UPSTREAM_POOL_EVENTS, UPSTREAM_REQUESTS, UPSTREAM_SECONDS
+from throttle import ThrottledSessionMixin, UpstreamUnavailable
+
+# --- 共享上游连接池 ---
+# 每次查询都新建 requests.Session 会让每个 API 请求重新做一次 TCP + TLS 握手 (cpolar 隧道上代价很高)。
+# 这里整个进程共用一个 HTTPAdapter (urllib3 连接池)，PooledSession 只持有自己的 cookie jar：
+# 不同的回发流程 (各自的 ASP.NET 会话) 互不干扰，但底层 keep-alive 连接可以复用。
+# 空闲超过 UPSTREAM_IDLE_TIMEOUT 秒的连接在取出时关闭重连，避免使用已被隧道断开的连接。
+# 异步客户端 (async_upstream.py) 通过 shared_async_transport() 共用一个 httpx 连接池，语义相同。
+# 同步和异步流程的每个上游请求都通过 record_upstream 按回发阶段记录耗时和结果 (见 metrics.py)。
+
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 20))
+UPSTREAM_IDLE_TIMEOUT = float(os.environ.get('UPSTREAM_IDLE_TIMEOUT', 60))
+
+
+class PoolStats:
+    """连接复用计数：requests 为请求数，connections 为实际建立的连接数 (即握手次数)，同时计入 electricity_upstream_pool_events_total。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.idle_closed = 0
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+        UPSTREAM_POOL_EVENTS.inc(event=name)
+
+    def snapshot(self):
+        with self._lock:
+            reused = max(self.requests - self.connections, 0)
+            return {
+                "requests": self.requests,
+                "connections": self.connections,
+                "reused": reused,
+                "reuse_ratio": round(reused / self.requests, 3) if self.requests else 0.0,
+                "idle_closed": self.idle_closed,
+                "pool_size": UPSTREAM_POOL_SIZE,
+                "idle_timeout": UPSTREAM_IDLE_TIMEOUT,
+            }
+
+
+pool_stats = PoolStats()
+
+
+class _CountingHTTPConnection(HTTPConnection):
+    def connect(self):
+        pool_stats.incr('connections')
+        super().connect()
+
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        pool_stats.incr('connections')
+        super().connect()
+
+
+class _IdleTimeoutMixin:
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        last_used = getattr(conn, '_last_used', None)
+        if last_used is not None and time.monotonic() - last_used > UPSTREAM_IDLE_TIMEOUT:
+            # 关闭后 urllib3 会在发送时重新建立连接
+            conn.close()
+            pool_stats.incr('idle_closed')
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn._last_used = time.monotonic()
+        super()._put_conn(conn)
+
+
+class _HTTPPool(_IdleTimeoutMixin, HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+
+class _HTTPSPool(_IdleTimeoutMixin, HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+
+class PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _HTTPPool, 'https': _HTTPSPool}
+
+    def send(self, request, **kwargs):
+        pool_stats.incr('requests')
+        return super().send(request, **kwargs)
+
+
+# pool_connections 为缓存的主机数 (上游只有一两个域名)，pool_maxsize 为每个主机保留的空闲连接数
+shared_adapter = PooledAdapter(pool_connections=4, pool_maxsize=UPSTREAM_POOL_SIZE)
+
+
+class PooledSession(ThrottledSessionMixin, requests.Session):
+    """cookie 独立、连接共享的会话，请求经过 upstream_throttle；close() 只丢弃 cookie，不关闭共享连接池。"""
+
+    def __init__(self, headers=None):
+        super().__init__()
+        self.mount('https://', shared_adapter)
+        self.mount('http://', shared_adapter)
+        if headers:
+            self.headers.update(headers)
+
+    def close(self):
+        self.cookies.clear()
+
+
+def request_outcome(response=None, error=None):
+    """上游请求结果分类，用作 electricity_upstream_requests_total 的 outcome 标签。"""
+    if error is not None:
+        if isinstance(error, UpstreamUnavailable):
+            return 'circuit_open'
+        if isinstance(error, (requests.exceptions.Timeout, httpx.TimeoutException)):
+            return 'timeout'
+        if isinstance(error, (requests.exceptions.ConnectionError, httpx.TransportError)):
+            return 'connection_error'
+        return 'error'
+    return 'ok' if response.status_code < 400 else f"http_{response.status_code // 100}xx"
+
+
+def record_upstream(stage, started, response=None, error=None):
+    """started 为发送前的 time.perf_counter()；熔断拒绝的请求没有真正发出，只计数不计耗时。"""
+    outcome = request_outcome(response, error)
+    if outcome != 'circuit_open':
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, stage=stage)
+    UPSTREAM_REQUESTS.inc(stage=stage, outcome=outcome)
+
+
+_async_transport = None
+
+
+def shared_async_transport():
+    global _async_transport
+    if _async_transport is None:
+        _async_transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+            max_connections=None, max_keepalive_connections=UPSTREAM_POOL_SIZE,
+            keepalive_expiry=UPSTREAM_IDLE_TIMEOUT))
+    return _async_transport
+
+
+async def trace_connections(event_name, info):
+    # httpx/httpcore 的 trace 回调：每次新建 TCP 连接计数一次
+    if event_name == 'connection.connect_tcp.complete':
+        pool_stats.incr('connections')
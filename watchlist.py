@@ -0,0 +1,190 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+from logs import get_logger
+from metrics import BALANCE_CHECKS, WATCHLIST_ALERTS
+
+# --- 低余额监控 ---
+# 登记在 storage.watchlist 中的房间由 BalanceRefresher 定期批量刷新剩余电量：
+# 按楼栋分组，每栋楼一个会话只请求一次首页和楼栋回发，同一楼层的页面表单重复用于选择该层的每个房间，
+# 选择房间后跳转的结果页已带剩余电量，直接解析后结束——不查询日期范围、不翻页 (余额快速路径)。
+# 每个房间只需一次选择请求 (含跳转)，外加每栋楼 2 次、每个楼层 1 次回发。
+# 预计可用天数 = 剩余电量 / 最近 WATCHLIST_USAGE_DAYS 天的日均用量 (每日汇总表)，近期没有记录时用全部历史的日均用量。
+# 多进程部署时每个 worker 都有自己的定时器，由两把数据库锁协调：
+#   - watchlist:batch   定时刷新的节拍，有效期为一个 interval，刷新后不释放：每个 interval 全部进程只刷新一次
+#   - watchlist:running 正在刷新，刷新结束时释放：手动触发 (trigger) 只检查这把锁，不会与正在进行的刷新重叠
+# 最近一次刷新的汇总写入 store 的 state 表 (watchlist:last_run)，任一 worker 查询到的都是全局最近一次的结果。
+
+WATCHLIST_INTERVAL = int(os.environ.get('WATCHLIST_INTERVAL', 3600))
+WATCHLIST_CONCURRENCY = int(os.environ.get('WATCHLIST_CONCURRENCY', 4))
+WATCHLIST_USAGE_DAYS = int(os.environ.get('WATCHLIST_USAGE_DAYS', 14))
+# 默认告警阈值：剩余电量 (度) 或预计可用天数低于该值
+WATCHLIST_THRESHOLD = float(os.environ.get('WATCHLIST_THRESHOLD', 10))
+WATCHLIST_DAYS_THRESHOLD = float(os.environ.get('WATCHLIST_DAYS_THRESHOLD', 3))
+
+log = get_logger('watchlist')
+
+
+def days_to_empty(remaining, daily_usage):
+    if remaining is None or not daily_usage or daily_usage <= 0:
+        return None
+    return max(remaining, 0.0) / daily_usage
+
+
+def watch_entry(row):
+    """store.get_watchlist 的一行 -> API 表示 (含预计可用天数和是否告警)。"""
+    remaining = row.get('remaining_electricity')
+    daily = row['recent_daily'] or row['average_daily']
+    days = days_to_empty(remaining, daily)
+    threshold = WATCHLIST_THRESHOLD if row['threshold'] is None else row['threshold']
+    days_threshold = WATCHLIST_DAYS_THRESHOLD if row['days_threshold'] is None else row['days_threshold']
+    return {
+        "room": {key: row.get(key) for key in ('building', 'floor', 'room')},
+        "room_id": row['id'],
+        "remaining_electricity": remaining,
+        "balance_time": row.get('balance_time') or row.get('scrape_time'),
+        "checked_at": row['checked_at'],
+        "error": row['error'],
+        "daily_usage": round(daily, 2) if daily else None,
+        "days_to_empty": round(days, 1) if days is not None else None,
+        "threshold": threshold,
+        "days_threshold": days_threshold,
+        "alert": remaining is not None and (remaining <= threshold or (days is not None and days <= days_threshold)),
+    }
+
+
+def sort_watchlist(entries):
+    # 告警在前，其次按预计可用天数、剩余电量升序；没有余额或用量数据的排在最后
+    return sorted(entries, key=lambda e: (
+        not e['alert'],
+        e['days_to_empty'] is None,
+        e['days_to_empty'] if e['days_to_empty'] is not None else 0,
+        e['remaining_electricity'] is None,
+        e['remaining_electricity'] or 0,
+    ))
+
+
+def load_watchlist(store, today=None):
+    """按告警优先级排序的监控列表。"""
+    since = ((today or date.today()) - timedelta(days=WATCHLIST_USAGE_DAYS - 1)).isoformat()
+    return sort_watchlist([watch_entry(row) for row in store.get_watchlist(since)])
+
+
+class BalanceRefresher:
+    def __init__(self, store, fetch_fn, interval=WATCHLIST_INTERVAL, max_concurrency=WATCHLIST_CONCURRENCY):
+        """
+        fetch_fn(building_value, {floor_value: [room_value, ...]}) 刷新一栋楼中这些房间的余额，
+        返回 {(floor_value, room_value): 剩余电量或异常}；未返回的房间视为失败。
+        """
+        self.store = store
+        self.fetch_fn = fetch_fn
+        self.interval = interval
+        self.max_concurrency = max_concurrency
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._running = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def last_run(self):
+        """全部进程中最近一次刷新的汇总。"""
+        return self.store.get_state('watchlist:last_run')
+
+    def run_once(self, scheduled=True):
+        """
+        刷新全部监控房间，返回本次汇总；其他线程或进程正在刷新时返回 None。
+        scheduled=True (定时刷新) 时本 interval 内已有进程刷新过也返回 None。
+        """
+        if not self._running.acquire(blocking=False):
+            return None
+        try:
+            # 节拍锁到期前不释放：其他 worker 的定时器在本 interval 内拿不到锁
+            if scheduled and not self.store.try_lock('watchlist:batch', self.owner, self.interval):
+                return None
+            if not self.store.try_lock('watchlist:running', self.owner, max(self.interval, 60)):
+                return None
+            try:
+                return self._run()
+            finally:
+                self.store.release_lock('watchlist:running', self.owner)
+        finally:
+            self._running.release()
+
+    def _run(self):
+        started = time.time()
+        buildings = defaultdict(lambda: defaultdict(list))
+        room_ids = {}
+        for room in self.store.watched_rooms():
+            buildings[room['building_value']][room['floor_value']].append(room['room_value'])
+            room_ids[(room['building_value'], room['floor_value'], room['room_value'])] = room['id']
+
+        summary = {"rooms": len(room_ids), "ok": 0, "failed": 0, "buildings": len(buildings)}
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='watchlist') as pool:
+            futures = {pool.submit(self.fetch_fn, building_value, floors): (building_value, floors)
+                       for building_value, floors in buildings.items()}
+            for future in as_completed(futures):
+                building_value, floors = futures[future]
+                try:
+                    balances = future.result()
+                except Exception as e:
+                    log.warning('watchlist.building_failed', building_value=building_value, error=str(e))
+                    balances = {}
+                    error = str(e)
+                else:
+                    error = "未返回剩余电量"
+                # 每栋楼的结果在一个事务中写入
+                results = []
+                for floor_value, room_values in floors.items():
+                    for room_value in room_values:
+                        room_id = room_ids[(building_value, floor_value, room_value)]
+                        value = balances.get((floor_value, room_value))
+                        if isinstance(value, Exception) or value is None:
+                            results.append((room_id, None, str(value) if isinstance(value, Exception) else error))
+                        else:
+                            results.append((room_id, value, None))
+                self.store.save_balances(results, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                for _, _, room_error in results:
+                    outcome = 'error' if room_error else 'ok'
+                    summary['failed' if room_error else 'ok'] += 1
+                    BALANCE_CHECKS.inc(outcome=outcome)
+
+        summary["alerts"] = sum(1 for entry in load_watchlist(self.store) if entry['alert'])
+        summary["elapsed"] = round(time.time() - started, 2)
+        summary["finished_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        WATCHLIST_ALERTS.set(summary["alerts"])
+        self.store.set_state('watchlist:last_run', summary)
+        log.info('watchlist.done', **summary)
+        return summary
+
+    def trigger(self):
+        """在后台线程中立即刷新一次；本进程或其他进程已在刷新时返回 False。"""
+        if self.running():
+            return False
+        threading.Thread(target=self.run_once, args=(False,), name='watchlist-trigger', daemon=True).start()
+        return True
+
+    def running(self):
+        """本进程或其他进程正在刷新。"""
+        return self._running.locked() or self.store.lock_owner('watchlist:running') is not None
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                log.exception('watchlist.error', error=str(e))
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run_forever, name='watchlist', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()